@@ -3,14 +3,34 @@ Azure OpenAI 聊天测试
 支持文本和图片输入，使用 Responses API
 """
 
+import hashlib
 import streamlit as st
-from openai import OpenAI
-import json
-from pathlib import Path
-import base64
-import time
-from io import BytesIO
-from PIL import Image
+import uuid
+from dataclasses import asdict
+from openai import NotFoundError
+
+from chat_request import build_input_items, build_request, create_stream, request_bytes
+from client_pool import PoolSettings, get_registry, http2_available
+from config_store import get_section, list_profiles, load_config, save_config, set_section
+from context_budget import (
+    SUMMARY_TOKENS, TokenCalibration, apply_plan, chained_tokens, context_limit, estimate_text_tokens,
+    plan_context, project_ttft, replan, summarize_messages
+)
+from fanout import fan_out
+from hedging import HedgedStream, HedgeTarget, get_hedge_policy
+from history_store import (
+    DEFAULT_SESSION_CAP, append_message, compact_image, enforce_cap, message_text,
+    resolve_message, resolve_messages, session_size, spilled_count, thumbnail
+)
+from image_utils import DETAIL_LEVELS, encode_image_cached, get_image_cache
+from load_balancer import deployments_from_config, get_balancer
+from metrics_store import record_turn
+from rate_limiter import estimate_request_tokens, get_limiter
+from response_cache import RecordingStream, cache_key, get_response_cache, replay_events
+from stream_metrics import StreamRecorder
+from stream_render import RenderScheduler
+from stream_worker import StreamWorker
+from tracing import get_tracer, record_stream_phases
 
 # 页面配置
 st.set_page_config(
@@ -19,55 +39,494 @@ st.set_page_config(
     layout="wide"
 )
 
-# 配置文件路径
-CONFIG_FILE = Path("config.json")
-
-# 加载配置
-def load_config():
-    if CONFIG_FILE.exists():
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-# 保存配置
-def save_config(config):
-    try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
-        return True
-    except:
-        return False
-
 # 编码图片为 base64
-def encode_image(image_file):
-    """将上传的图片文件编码为 base64 URL"""
+def encode_image(image_file, detail="auto", model=""):
+    """将上传的图片文件预处理并编码为 base64 URL，返回 EncodedImage"""
     try:
-        # 读取图片
-        image = Image.open(image_file)
-        # 转换为 RGB（如果是 RGBA）
-        if image.mode == 'RGBA':
-            image = image.convert('RGB')
-        
-        # 保存到字节流
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        img_bytes = buffered.getvalue()
-        
-        # 编码为 base64
-        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-        return f"data:image/jpeg;base64,{img_base64}"
+        return encode_image_cached(image_file.getvalue(), detail, model)
     except Exception as e:
         st.error(f"图片编码失败: {str(e)}")
         return None
 
+def image_caption(image_stats):
+    """图片编码统计说明"""
+    caption = (
+        f"🖼️ {format_bytes(image_stats['original_bytes'])} → "
+        f"{format_bytes(image_stats['sent_bytes'])} · "
+        f"{image_stats['sent_size'][0]}×{image_stats['sent_size'][1]} {image_stats['format'].upper()} · "
+        f"约 {image_stats['estimated_tokens']} tokens · "
+        f"{image_stats['encode_ms']:.1f} ms"
+    )
+    if image_stats['cache_hit']:
+        caption += " · 缓存命中"
+    return caption
+
+# Azure 只缓存 1024 tokens 以上的提示前缀
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# 对话模式
+CONVERSATION_MODES = {
+    "chain": "🔗 链式（previous_response_id）",
+    "replay": "🔁 完整回放",
+    "single": "1️⃣ 单轮",
+}
+
+def format_bytes(num_bytes):
+    """字节数转换为可读字符串"""
+    for unit in ["B", "KB", "MB"]:
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+def make_user_message(prompt, uploaded_file, image_detail, model, trace=None):
+    """构造用户消息；有图片时编码并记录统计"""
+    user_message = {"role": "user", "text": prompt}
+    
+    # 处理图片
+    if uploaded_file is not None:
+        with tracer.span("encode_image", trace, detail=image_detail) as span:
+            encoded_image = encode_image(uploaded_file, image_detail, model)
+            if encoded_image:
+                span.set(
+                    original_bytes=encoded_image.original_bytes,
+                    sent_bytes=encoded_image.sent_bytes,
+                    cache_hit=encoded_image.cache_hit
+                )
+        if encoded_image:
+            # 原图和 data URL 存到磁盘，会话中只保留缩略图和哈希
+            compact_image(user_message, uploaded_file.getvalue(), encoded_image.data_url)
+            user_message["image_detail"] = image_detail
+            user_message["image_stats"] = {
+                k: v for k, v in asdict(encoded_image).items() if k != "data_url"
+            }
+    return user_message
+
+def render_comparison(results):
+    """对比结果排名（按 TTFT，失败的排在最后）"""
+    ranked = sorted(
+        results,
+        key=lambda r: (r["error"] is not None, r["metrics"]["ttft"] if r["metrics"] else 0)
+    )
+    st.table([
+        {
+            "排名": rank,
+            "配置": r["name"],
+            "模型": r["model"],
+            "Reasoning": r["reasoning_effort"],
+            "TTFT (s)": f"{r['metrics']['ttft']:.2f}" if not r["error"] else "-",
+            "总时长 (s)": f"{r['metrics']['total_duration']:.2f}" if not r["error"] else "-",
+            "输出速度 (tok/s)": f"{r['metrics']['output_tokens_per_sec']:.1f}" if not r["error"] else "-",
+            "Reasoning Tokens": r["metrics"]["reasoning_tokens"] if not r["error"] else "-",
+            "Total Tokens": r["metrics"]["total_tokens"] if not r["error"] else "-",
+            "错误": r["error"] or "",
+        }
+        for rank, r in enumerate(ranked, start=1)
+    ])
+
+def render_profile_metrics(metrics):
+    """单个对比列的指标"""
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("⏱️ TTFT", f"{metrics.ttft:.2f}s")
+        st.metric("🧠 Reasoning", metrics.reasoning_tokens)
+    with col2:
+        st.metric("⌛ 总时长", f"{metrics.total_duration:.2f}s")
+        st.metric("📊 Total Tokens", metrics.total_tokens)
+
+def run_comparison(user_message, profiles):
+    """把同一条消息并行发送到多个配置，每个配置一列实时显示"""
+    # 对比消息不进入后续对话历史，这里单独构造本轮 input
+    input_items = build_input_items([dict(resolve_message(user_message), comparison_prompt=False)])
+    jobs = []
+    for profile in profiles:
+        client, _ = get_registry().acquire(
+            profile["endpoint"], profile["api_key"], profile["model"], pool_settings
+        )
+        request = build_request(
+            profile["model"], input_items, profile["reasoning_effort"], instructions=instructions
+        )
+        jobs.append((client, request))
+    
+    columns = st.columns(len(profiles))
+    renderers = []
+    for column, profile in zip(columns, profiles):
+        with column:
+            st.markdown(f"**{profile['name']}**  \n`{profile['model']}` · {profile['reasoning_effort']}")
+            renderers.append(RenderScheduler(
+                st.empty(), fps=render_fps, max_buffer_bytes=int(render_buffer_bytes)
+            ))
+    
+    results = [None] * len(profiles)
+    for index, kind, payload in fan_out(jobs, stall_threshold):
+        profile = profiles[index]
+        if kind == "delta":
+            renderers[index].append(payload)
+            continue
+        
+        text = renderers[index].finish()
+        error = None
+        if kind == "error":
+            error, metrics = payload
+            error = f"{type(error).__name__}: {error}"
+        else:
+            metrics = payload
+        
+        with columns[index]:
+            if error:
+                st.error(f"❌ {error}")
+            else:
+                render_profile_metrics(metrics)
+        
+        results[index] = {
+            "name": profile["name"],
+            "model": profile["model"],
+            "reasoning_effort": profile["reasoning_effort"],
+            "text": text,
+            "metrics": asdict(metrics),
+            "error": error,
+        }
+        record_turn(
+            endpoint=profile["endpoint"],
+            model=profile["model"],
+            reasoning_effort=profile["reasoning_effort"],
+            image_bytes=user_message.get("image_stats", {}).get("sent_bytes", 0),
+            ttft=metrics.ttft,
+            total_duration=metrics.total_duration,
+            input_tokens=metrics.input_tokens,
+            cached_tokens=metrics.cached_tokens,
+            output_tokens=metrics.output_tokens,
+            reasoning_tokens=metrics.reasoning_tokens,
+            total_tokens=metrics.total_tokens,
+            error_class=error.split(":")[0] if error else None
+        )
+    
+    render_comparison(results)
+    return results
+
+def estimate_savings(messages, metrics, fallback_tokens):
+    """停止生成时估算少生成的 tokens 和时间：按本会话已完成回答的平均值，没有时用预估输出 tokens"""
+    completed = [
+        message["metrics"] for message in messages
+        if message["role"] == "assistant" and message.get("metrics", {}).get("completed")
+    ]
+    received = metrics.text_deltas
+    elapsed = metrics.total_duration
+    if completed:
+        expected_tokens = sum(m["output_tokens"] for m in completed) / len(completed)
+        expected_seconds = sum(m["total_duration"] for m in completed) / len(completed)
+    else:
+        expected_tokens = fallback_tokens
+        expected_seconds = elapsed + max(fallback_tokens - received, 0) * metrics.tpot
+    return max(int(expected_tokens - received), 0), max(expected_seconds - elapsed, 0.0)
+
+def estimate_cache_savings(metrics, prefill_tokens_per_sec, input_price, cached_discount):
+    """前缀缓存命中时省下的预填充时间（秒）和费用（按每百万 input tokens 单价和缓存折扣）"""
+    saved_seconds = metrics.cached_tokens / prefill_tokens_per_sec if prefill_tokens_per_sec else 0.0
+    saved_cost = metrics.cached_tokens * input_price / 1_000_000 * cached_discount
+    return saved_seconds, saved_cost
+
+def plan_turn_context():
+    """按上下文预算规划回放的消息（只在本地估算，不发请求）"""
+    summary = st.session_state.context_summary
+    reserve = 0
+    if context_strategy == "summarize":
+        reserve = estimate_text_tokens(summary["text"]) if summary else SUMMARY_TOKENS
+    return plan_context(
+        st.session_state.messages, int(context_budget), st.session_state.token_calibration,
+        base_tokens=estimate_text_tokens(instructions), keep_recent_turns=int(keep_recent_turns),
+        downsample_images=downsample_old_images, reserve_tokens=reserve,
+        previous_start=st.session_state.context_start
+    )
+
+
+def replay_input(plan, client, model, trace):
+    """
+    按规划构造完整回放的 input；摘要模式下先把新去掉的轮次并入摘要
+    返回 (input, 实际发送的规划)：不修改传入的 plan，裁剪位置在本轮成功后才记住
+    """
+    messages = st.session_state.messages
+    summary = st.session_state.context_summary
+    if plan is None:
+        return build_input_items(resolve_messages(messages)), None
+    start = plan.start
+    if plan.start > 0 and context_strategy == "summarize":
+        covered = summary["covered"] if summary else 0
+        if covered < plan.start:
+            with tracer.span("context.summarize", trace) as span:
+                try:
+                    text = summarize_messages(
+                        client, model, messages[covered:plan.start], summary["text"] if summary else None
+                    )
+                    summary = st.session_state.context_summary = {"covered": plan.start, "text": text}
+                    span.set(messages=plan.start - covered, summary_tokens=estimate_text_tokens(text))
+                except Exception as e:
+                    span.set(error=f"{type(e).__name__}: {e}")
+                    st.warning(f"⚠️ 摘要失败，较早的轮次直接丢弃：{e}")
+                    summary = None
+        elif covered > plan.start:
+            # 摘要已覆盖到更后面的消息，从摘要之后开始发送，避免重复
+            start = covered
+    else:
+        summary = None
+    summary_text = summary["text"] if summary and start > 0 else None
+    plan = replan(
+        messages, plan, start, st.session_state.token_calibration,
+        base_tokens=estimate_text_tokens(instructions),
+        summary_tokens=estimate_text_tokens(summary_text) if summary_text else 0
+    )
+    return build_input_items(apply_plan(messages, plan, model, summary_text)), plan
+
+
+def follow_turn(turn):
+    """显示进行中的回答直到结束并保存本轮结果；脚本被打断重跑后从头重新接上"""
+    worker = turn["worker"]
+    with st.chat_message("assistant"):
+        message_placeholder = st.empty()
+        stop_placeholder = st.empty()
+        if not worker.done:
+            stop_placeholder.button("⏹️ 停止生成", on_click=worker.cancel, key=f"stop_{turn['id']}")
+        renderer = RenderScheduler(
+            message_placeholder,
+            fps=render_fps,
+            max_buffer_bytes=int(render_buffer_bytes)
+        )
+        with tracer.span("render", turn["trace"]) as render_span:
+            for delta in renderer.events(worker.follow()):
+                if delta:
+                    renderer.append(delta)
+                else:
+                    # 长时间没有增量（如推理中）时也调用一次 st，点击停止触发的重跑才能打断这里
+                    renderer.tick()
+        
+        # 先更新会话状态（期间不调用 st.*，不会被重跑打断），再显示
+        st.session_state.active_turn = None
+        metrics = worker.metrics
+        limiter, ticket = turn["limiter"], turn["ticket"]
+        
+        # 补记流式阶段，结束本轮的根 span
+        trace = turn["trace"]
+        record_stream_phases(tracer, worker.recorder, trace)
+        render_span.set(**renderer.stats())
+        trace.set(
+            input_tokens=metrics.input_tokens,
+            output_tokens=metrics.output_tokens,
+            reasoning_tokens=metrics.reasoning_tokens,
+            cancelled=worker.cancelled
+        )
+        if worker.error is not None:
+            trace.set(error=f"{type(worker.error).__name__}: {worker.error}")
+        trace.end()
+        
+        # 对冲时按胜出的部署记录
+        hedge = turn["hedge"]
+        record = dict(turn["record"])
+        if hedge is not None and hedge.winner is not None:
+            record.update(endpoint=hedge.winner.endpoint, model=hedge.winner.model)
+        
+        if worker.error is not None:
+            if ticket is not None:
+                limiter.reconcile(ticket, 0)
+            record_turn(**record, error_class=type(worker.error).__name__)
+            stop_placeholder.empty()
+            renderer.finish()
+            st.error(f"❌ 错误: {str(worker.error)}")
+            return
+        
+        saved_tokens, saved_seconds = 0, 0.0
+        if worker.cancelled:
+            saved_tokens, saved_seconds = estimate_savings(
+                st.session_state.messages, metrics, turn["expected_output_tokens"]
+            )
+        
+        # 用实际用量修正配额预估；停止时没有 usage，按已收到的增量估算输出
+        if ticket is not None:
+            if worker.cancelled:
+                actual_tokens = ticket.estimated_tokens - turn["expected_output_tokens"] + metrics.text_deltas
+            else:
+                actual_tokens = metrics.total_tokens
+            limiter.reconcile(ticket, actual_tokens)
+        
+        # 用实际 input tokens 校准本地估算；缓存命中、停止时没有 usage
+        context_plan = turn.get("context")
+        if context_plan is not None and not turn["cache_hit"] and metrics.input_tokens:
+            st.session_state.token_calibration.observe(context_plan.raw_tokens, metrics.input_tokens)
+        # 本轮成功回放后记住裁剪位置，之后几轮沿用，发送的前缀保持不变
+        if context_plan is not None:
+            st.session_state.context_start = context_plan.start
+        
+        # 保存助手消息（停止时保留已生成的部分）
+        append_message(st.session_state.messages, {
+            "role": "assistant", 
+            "text": worker.text,
+            "response_id": metrics.response_id,
+            "metrics": asdict(metrics),
+            "stats": {
+                "uploaded_bytes": turn["uploaded_bytes"],
+                "input_tokens": metrics.input_tokens,
+                "cached_tokens": metrics.cached_tokens,
+                "mode": turn["mode"],
+                "cache_hit": turn["cache_hit"],
+                "truncated": worker.cancelled,
+                "saved_tokens": saved_tokens,
+                "saved_seconds": saved_seconds,
+                "hedge": {
+                    "fired": hedge.fired,
+                    "winner": hedge.winner.name if hedge.winner else None,
+                } if hedge is not None else None,
+                "context": {
+                    "estimated_tokens": context_plan.planned_tokens,
+                    "full_tokens": context_plan.full_tokens,
+                    "dropped": context_plan.start,
+                    "downsampled": len(context_plan.downsample),
+                    "summarized": context_strategy == "summarize" and context_plan.start > 0
+                                  and st.session_state.context_summary is not None,
+                } if context_plan is not None and context_plan.trimmed else None,
+            }
+        }, session_cap)
+        # 被停止的响应、备用部署上的响应不作为下一轮的 previous_response_id，下一轮完整回放
+        hedge_switched = hedge is not None and hedge.winner is hedge.targets[1]
+        st.session_state.last_response_id = (
+            None if worker.cancelled or hedge_switched else metrics.response_id
+        )
+        st.session_state.last_deployment = turn["deployment"]
+        
+        # 写入指标库（后台批量写入）；缓存命中不代表部署延迟，不记录
+        if not turn["cache_hit"]:
+            if worker.cancelled:
+                error_class = "Cancelled"
+            else:
+                error_class = None if metrics.completed else "Incomplete"
+            record_turn(
+                **record,
+                ttft=metrics.ttft,
+                total_duration=metrics.total_duration,
+                input_tokens=metrics.input_tokens,
+                cached_tokens=metrics.cached_tokens,
+                output_tokens=metrics.output_tokens,
+                reasoning_tokens=metrics.reasoning_tokens,
+                total_tokens=metrics.total_tokens,
+                error_class=error_class
+            )
+        
+        stop_placeholder.empty()
+        renderer.finish()
+        if worker.cancelled:
+            st.caption(f"⏹️ 已停止生成 · 约少生成 {saved_tokens} tokens / {saved_seconds:.1f}s")
+        
+        # 显示指标
+        if metrics.total_tokens > 0:
+            col1, col2, col3, col4, col5, col6, col7 = st.columns(7)
+            with col1:
+                st.metric(
+                    "⏱️ TTFT", f"{metrics.ttft:.2f}s",
+                    delta=(
+                        "缓存命中" if turn["cache_hit"]
+                        else f"🪁 {hedge.winner.name}" if hedge_switched
+                        else "复用连接" if turn["connection_reused"] else "新建连接"
+                    ),
+                    delta_color="off"
+                )
+            with col2:
+                st.metric("⌛ 总时长", f"{metrics.total_duration:.2f}s")
+            with col3:
+                st.metric("📤 上传", format_bytes(turn["uploaded_bytes"]))
+            with col4:
+                st.metric("📥 Input Tokens", metrics.input_tokens)
+            with col5:
+                st.metric("🧠 Reasoning", metrics.reasoning_tokens)
+            with col6:
+                st.metric("📊 Total Tokens", metrics.total_tokens)
+            with col7:
+                st.metric("🚦 排队", f"{turn['queue_wait']:.2f}s", help="等待部署配额的时间，不计入 TTFT")
+            
+            col1, col2, col3, col4, col5, col6 = st.columns(6)
+            with col1:
+                st.metric("📶 ITL p50", f"{metrics.itl_p50 * 1000:.0f} ms")
+            with col2:
+                st.metric(
+                    "📶 ITL p90 / p99",
+                    f"{metrics.itl_p90 * 1000:.0f} / {metrics.itl_p99 * 1000:.0f} ms"
+                )
+            with col3:
+                st.metric("🔤 TPOT", f"{metrics.tpot * 1000:.1f} ms")
+            with col4:
+                st.metric("⚡ 输出速度", f"{metrics.output_tokens_per_sec:.1f} tok/s")
+            with col5:
+                st.metric(
+                    "🐢 卡顿", metrics.stall_count,
+                    help=f"token 间隔超过 {stall_threshold}s 的次数，共 {metrics.stall_seconds:.2f}s"
+                )
+            with col6:
+                st.metric("💭 推理耗时", f"{metrics.reasoning_seconds:.2f}s")
+            
+            # 提示缓存：缓存命中的回放没有真实用量，不显示
+            if not turn["cache_hit"]:
+                cache_ratio = metrics.cached_tokens / metrics.input_tokens if metrics.input_tokens else 0.0
+                saved_prefill, saved_cost = estimate_cache_savings(
+                    metrics, prefill_tokens_per_sec, input_price, cached_discount
+                )
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("♻️ Cached Tokens", metrics.cached_tokens)
+                with col2:
+                    st.metric(
+                        "🎯 缓存命中率", f"{cache_ratio:.0%}",
+                        help=f"前缀不足 {PROMPT_CACHE_MIN_TOKENS} tokens 或指令、历史有变化时不会命中"
+                    )
+                with col3:
+                    st.metric("⏳ 约省预填充", f"{saved_prefill * 1000:.0f} ms",
+                              help=f"按预填充速度 {prefill_tokens_per_sec} tokens/s 估算")
+                with col4:
+                    st.metric("💰 约省费用", f"${saved_cost:.5f}",
+                              help=f"按 ${input_price}/1M input tokens、缓存折扣 {cached_discount:.0%} 估算")
+        
+        # 对冲结果
+        if hedge is not None and hedge.winner is not None and hedge.policy is not None:
+            hedge_stats = hedge.policy.stats()
+            st.caption(
+                f"🪁 对冲{'已触发' if hedge.fired else '未触发'}（延迟 {hedge.delay * 1000:.0f} ms）· "
+                f"胜出：{hedge.winner.name} · "
+                f"对冲率 {hedge_stats['hedge_rate']:.0%}（{hedge_stats['fired']}/{hedge_stats['requests']}）· "
+                f"备用胜出 {hedge_stats['secondary_wins']}"
+            )
+        
+        # 渲染开销
+        render_stats = renderer.stats()
+        st.caption(
+            f"🖥️ 渲染 {render_stats['render_calls']} 次 / {render_stats['deltas']} 个增量 · "
+            f"渲染耗时 {render_stats['render_seconds'] * 1000:.0f} ms · "
+            f"等待网络 {render_stats['wait_seconds']:.2f}s"
+        )
+
 # 初始化 session state
 if 'messages' not in st.session_state:
     st.session_state.messages = []
-if 'config' not in st.session_state:
-    st.session_state.config = load_config()
+if 'history_window' not in st.session_state:
+    st.session_state.history_window = 0
+if 'active_turn' not in st.session_state:
+    st.session_state.active_turn = None
+if 'last_deployment' not in st.session_state:
+    st.session_state.last_deployment = None
+if 'context_summary' not in st.session_state:
+    st.session_state.context_summary = None
+if 'context_start' not in st.session_state:
+    st.session_state.context_start = 0
+if 'token_calibration' not in st.session_state:
+    st.session_state.token_calibration = TokenCalibration()
+
+# 阶段追踪（进程级，默认关闭）
+tracer = get_tracer()
+
+# 熔断状态显示
+BREAKER_STATES = {"closed": "🟢 正常", "half_open": "🟡 探测中", "open": "🔴 熔断"}
+if 'last_response_id' not in st.session_state:
+    st.session_state.last_response_id = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# 每次运行都读取，文件未变化时命中缓存；其他页面保存后这里会看到新配置
+config = load_config()
 
 # 标题
 st.title("💬 GPT 聊天测试")
@@ -76,40 +535,118 @@ st.title("💬 GPT 聊天测试")
 with st.sidebar:
     st.header("⚙️ 聊天模型配置")
     
+    # 选择命名配置（profile），未填写的字段继承 default
+    profiles = list_profiles(config)
+    active_profile = config.get('active_profile', 'default')
+    profile = st.selectbox(
+        "配置",
+        options=profiles,
+        index=profiles.index(active_profile) if active_profile in profiles else 0,
+        key="chat_profile"
+    )
+    new_profile = st.text_input("另存为新配置", placeholder="留空则保存到当前配置", key="chat_new_profile")
+
     # 从配置文件加载聊天模型的配置
-    chat_config = st.session_state.config.get('chat', {})
+    chat_config = get_section(config, 'chat', profile)
     
     # API 配置
     api_key = st.text_input(
         "API Key", 
         type="password", 
         value=chat_config.get('api_key', ''),
-        key="chat_api_key"
+        key=f"chat_api_key_{profile}"
     )
     endpoint = st.text_input(
         "Endpoint (Base URL)", 
         placeholder="https://your-resource.openai.azure.com/openai/deployments/your-model",
         value=chat_config.get('endpoint', ''),
-        key="chat_endpoint",
+        key=f"chat_endpoint_{profile}",
         help="完整的部署 URL"
     )
     model = st.text_input(
         "模型名称", 
         value=chat_config.get('model', 'gpt-4o'),
-        key="chat_model"
+        key=f"chat_model_{profile}"
+    )
+    instructions = st.text_area(
+        "系统指令（Instructions）",
+        value=chat_config.get('instructions', ''),
+        height=120,
+        key=f"chat_instructions_{profile}",
+        help="每轮原样放在提示最前面；内容不变时长前缀可以命中 Azure 提示缓存，不要放时间戳等每轮变化的内容"
     )
+    if instructions:
+        instructions_bytes = instructions.encode('utf-8')
+        instructions_tokens = estimate_request_tokens({"instructions": instructions}, 0)
+        st.caption(
+            f"{format_bytes(len(instructions_bytes))} · 约 {instructions_tokens} tokens · "
+            f"指纹 `{hashlib.sha256(instructions_bytes).hexdigest()[:12]}`"
+            + ("" if instructions_tokens >= PROMPT_CACHE_MIN_TOKENS
+               else f" · 不足 {PROMPT_CACHE_MIN_TOKENS} tokens，单靠指令不会命中缓存")
+        )
+    
+    # 连接池设置
+    with st.expander("🔌 连接池"):
+        pool_config = chat_config.get('pool', {})
+        max_connections = st.number_input(
+            "最大连接数", min_value=1, max_value=200,
+            value=pool_config.get('max_connections', 20)
+        )
+        max_keepalive = st.number_input(
+            "Keep-Alive 连接数", min_value=0, max_value=200,
+            value=pool_config.get('max_keepalive_connections', 10)
+        )
+        keepalive_expiry = st.number_input(
+            "Keep-Alive 过期 (秒)", min_value=1.0, max_value=600.0,
+            value=float(pool_config.get('keepalive_expiry', 60.0))
+        )
+        connect_timeout = st.number_input(
+            "连接超时 (秒)", min_value=1.0, max_value=120.0,
+            value=float(pool_config.get('connect_timeout', 10.0))
+        )
+        read_timeout = st.number_input(
+            "读取超时 (秒)", min_value=1.0, max_value=1800.0,
+            value=float(pool_config.get('read_timeout', 120.0))
+        )
+        use_http2 = st.checkbox(
+            "HTTP/2",
+            value=pool_config.get('http2', False),
+            disabled=not http2_available(),
+            help="需要安装 httpx[http2]"
+        )
+        idle_ttl = st.number_input(
+            "空闲回收 (秒)", min_value=10.0, max_value=86400.0,
+            value=float(pool_config.get('idle_ttl', 900.0)),
+            help="客户端空闲超过该时间后关闭"
+        )
+    
+    pool_settings = PoolSettings(
+        max_connections=int(max_connections),
+        max_keepalive_connections=int(max_keepalive),
+        keepalive_expiry=float(keepalive_expiry),
+        connect_timeout=float(connect_timeout),
+        read_timeout=float(read_timeout),
+        http2=bool(use_http2),
+        idle_ttl=float(idle_ttl),
+    )
+    
+    # 配置有效时提前建立连接
+    if api_key and endpoint:
+        get_registry().warm_up(endpoint, api_key, model, pool_settings)
     
     # 保存配置按钮
     if st.button("💾 保存聊天配置", use_container_width=True):
-        config = st.session_state.config
-        config['chat'] = {
+        target_profile = new_profile.strip() or profile
+        set_section(config, 'chat', {
             'api_key': api_key,
             'endpoint': endpoint,
-            'model': model
-        }
+            'model': model,
+            'instructions': instructions,
+            'pool': asdict(pool_settings)
+        }, target_profile)
+        config['active_profile'] = target_profile
         if save_config(config):
-            st.session_state.config = config
-            st.success("✅ 聊天配置已保存！")
+            st.success(f"✅ 聊天配置已保存到「{target_profile}」！")
         else:
             st.error("❌ 保存失败")
     
@@ -126,154 +663,714 @@ with st.sidebar:
         help="推理级别（仅支持 GPT-5 系列和 o 系列）"
     )
     
+    # 图片细节级别
+    image_detail = st.selectbox(
+        "图片细节",
+        options=DETAIL_LEVELS,
+        index=0,
+        help="auto/high：缩放到 2048 内且短边 768；low：缩放到 512；original：不缩放"
+    )
+    image_cache_stats = get_image_cache().stats()
+    st.caption(
+        f"图片缓存：{image_cache_stats['entries']} 项 · "
+        f"{format_bytes(image_cache_stats['bytes'])} · "
+        f"命中 {image_cache_stats['hits']}/{image_cache_stats['hits'] + image_cache_stats['misses']}"
+    )
+    
+    # 多轮对话模式
+    conversation_mode = st.selectbox(
+        "对话模式",
+        options=list(CONVERSATION_MODES),
+        format_func=CONVERSATION_MODES.get,
+        help="链式：服务端保存上下文，每轮只上传新消息；完整回放：每轮重发全部历史；单轮：不带历史"
+    )
+    
+    # 流式渲染
+    with st.expander("🖥️ 流式渲染"):
+        render_fps = st.slider(
+            "刷新帧率 (FPS)", min_value=1, max_value=60, value=15,
+            help="每秒最多刷新页面的次数，增量在两次刷新之间合并"
+        )
+        render_buffer_bytes = st.number_input(
+            "缓冲字节阈值", min_value=16, max_value=65536, value=1024,
+            help="缓冲区超过该大小时立即刷新"
+        )
+    
+    # 延迟指标
+    with st.expander("📏 延迟指标"):
+        stall_threshold = st.number_input(
+            "卡顿阈值 (秒)", min_value=0.05, max_value=30.0, value=1.0, step=0.05,
+            help="token 间隔超过该值记为一次卡顿"
+        )
+    
+    # 提示缓存收益估算
+    with st.expander("♻️ 提示缓存"):
+        prefill_tokens_per_sec = st.number_input(
+            "预填充速度 (tokens/s)", min_value=100, max_value=1000000, value=5000, step=500,
+            help="估算命中缓存省下的 TTFT：缓存 tokens ÷ 预填充速度"
+        )
+        input_price = st.number_input(
+            "Input 单价 ($/1M tokens)", min_value=0.0, max_value=1000.0, value=2.5, step=0.25
+        )
+        cached_discount = st.slider(
+            "缓存折扣", min_value=0.0, max_value=1.0, value=0.5, step=0.05,
+            help="缓存 tokens 相对普通 input 便宜的比例，以部署的定价为准"
+        )
+        session_metrics = [
+            message["metrics"] for message in st.session_state.messages
+            if message["role"] == "assistant" and message.get("metrics")
+        ]
+        session_input = sum(m.get("input_tokens", 0) for m in session_metrics)
+        session_cached = sum(m.get("cached_tokens", 0) for m in session_metrics)
+        st.caption(
+            f"本会话 {len(session_metrics)} 轮 · 缓存 {session_cached}/{session_input} input tokens"
+            f"（{session_cached / session_input if session_input else 0:.0%}）· "
+            f"约省 ${session_cached * input_price / 1_000_000 * cached_discount:.4f}"
+        )
+    
+    # 响应缓存
+    with st.expander("🗄️ 响应缓存"):
+        use_response_cache = st.checkbox(
+            "启用响应缓存", value=False,
+            help="相同的模型、输入（图片按内容哈希）和推理参数直接回放上次的回答"
+        )
+        cache_ttl_hours = st.number_input("有效期 (小时)", min_value=0.1, max_value=720.0, value=24.0)
+        cache_memory_mb = st.number_input("内存上限 (MB)", min_value=1, max_value=4096, value=32)
+        cache_disk_mb = st.number_input("磁盘上限 (MB)", min_value=1, max_value=65536, value=512)
+        response_cache = get_response_cache()
+        response_cache.configure(
+            ttl=cache_ttl_hours * 3600,
+            max_memory_bytes=int(cache_memory_mb) * 1024 * 1024,
+            max_disk_bytes=int(cache_disk_mb) * 1024 * 1024
+        )
+        if st.button("🧹 清空缓存", use_container_width=True):
+            response_cache.clear()
+    
+    cache_stats = response_cache.stats()
+    if use_response_cache:
+        st.caption(
+            f"🗄️ 缓存命中率 {cache_stats['hit_rate'] * 100:.0f}% "
+            f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}) · "
+            f"节省 {format_bytes(cache_stats['bytes_saved'])} / {cache_stats['tokens_saved']} tokens"
+        )
+    
+    # 多部署对比
+    with st.expander("🆚 多部署对比"):
+        compare_mode = st.checkbox(
+            "启用对比模式", value=False,
+            help="同一条消息并行发送到下表中的每个配置（单轮，不带历史）"
+        )
+        compare_table = st.data_editor(
+            config.get('compare', [
+                {"name": "A", "endpoint": "", "model": model, "reasoning_effort": "none", "api_key": ""},
+            ]),
+            num_rows="dynamic",
+            column_config={
+                "name": st.column_config.TextColumn("名称", required=True),
+                "endpoint": st.column_config.TextColumn("Endpoint", help="留空使用上方的 Endpoint"),
+                "model": st.column_config.TextColumn("模型", required=True),
+                "reasoning_effort": st.column_config.SelectboxColumn(
+                    "Reasoning", options=["none", "minimal", "low", "medium", "high"], default="none"
+                ),
+                "api_key": st.column_config.TextColumn("API Key", help="留空使用上方的 API Key"),
+            },
+            key="compare_profiles"
+        )
+        if st.button("💾 保存对比配置", use_container_width=True):
+            config['compare'] = compare_table
+            if save_config(config):
+                st.success("✅ 对比配置已保存！")
+            else:
+                st.error("❌ 保存失败")
+    
+    compare_profiles = [
+        {
+            "name": row.get("name") or f"#{i + 1}",
+            "endpoint": row.get("endpoint") or endpoint,
+            "model": row.get("model") or model,
+            "reasoning_effort": row.get("reasoning_effort") or "none",
+            "api_key": row.get("api_key") or api_key,
+        }
+        for i, row in enumerate(compare_table)
+    ]
+    
+    # 配额限流（进程内所有会话共享）
+    with st.expander("🚦 配额限流"):
+        use_rate_limit = st.checkbox(
+            "启用配额限流", value=False,
+            help="按部署的 RPM / TPM 在所有会话之间排队，避免突发请求触发 429"
+        )
+        rpm_limit = st.number_input("RPM", min_value=1, max_value=100000, value=60)
+        tpm_limit = st.number_input("TPM", min_value=1000, max_value=10000000, value=60000)
+        expected_output_tokens = st.number_input(
+            "预估输出 tokens", min_value=0, max_value=100000,
+            value=1000,
+            help="准入时按 input 估算 + 该值预占 TPM，完成后按实际用量修正"
+        )
+        max_queue_wait = st.number_input("最长排队 (秒)", min_value=1.0, max_value=600.0, value=30.0)
+        max_session_queue = st.number_input("每会话最多排队", min_value=1, max_value=100, value=4)
+        if use_rate_limit and endpoint:
+            limiter_stats = get_limiter(
+                endpoint, model, int(rpm_limit), int(tpm_limit),
+                float(max_queue_wait), int(max_session_queue)
+            ).stats()
+            st.caption(
+                f"可用 {limiter_stats['requests_available']:.1f} 请求 / "
+                f"{limiter_stats['tokens_available']:.0f} tokens · "
+                f"排队 {limiter_stats['queued']}（{limiter_stats['sessions_waiting']} 个会话）· "
+                f"拒绝 {limiter_stats['rejected']}"
+            )
+    
+    # 负载均衡（在多个配置的部署之间路由）
+    balancer_config = config.get('balancer', {})
+    with st.expander("⚖️ 负载均衡"):
+        use_balancer = st.checkbox(
+            "启用负载均衡", value=False,
+            help="每轮按 TTFT 和错误率在多个配置的部署之间选择，429 / 5xx 的部署自动熔断"
+        )
+        balance_profiles = st.multiselect(
+            "参与的配置", options=profiles,
+            default=[name for name in balancer_config.get('weights', {}) if name in profiles]
+        )
+        balance_weights = {
+            name: st.number_input(
+                f"权重 · {name}", min_value=0.1, max_value=100.0, step=0.5,
+                value=float(balancer_config.get('weights', {}).get(name, 1.0)),
+                key=f"balance_weight_{name}"
+            )
+            for name in balance_profiles
+        }
+        if st.button("💾 保存负载均衡配置", use_container_width=True):
+            config['balancer'] = {'weights': balance_weights}
+            if save_config(config):
+                st.success("✅ 负载均衡配置已保存！")
+            else:
+                st.error("❌ 保存失败")
+        
+        balancer = None
+        balance_deployments = deployments_from_config(config, balance_weights)
+        if balance_deployments:
+            balancer = get_balancer(balance_deployments)
+            health_rows = balancer.stats()
+            st.dataframe(
+                [
+                    {
+                        "部署": row["name"],
+                        "状态": BREAKER_STATES[row["state"]],
+                        "在途": row["in_flight"],
+                        "TTFT": f"{row['ewma_ttft'] * 1000:.0f} ms" if row["ewma_ttft"] is not None else "—",
+                        "错误率": f"{row['error_rate']:.0%}",
+                        "请求": row["requests"],
+                    }
+                    for row in health_rows
+                ],
+                hide_index=True,
+                use_container_width=True
+            )
+            for row in health_rows:
+                if row["state"] == "open":
+                    st.caption(f"🔴 {row['name']}：{row['retry_in']:.0f}s 后探测 · {row['last_error']}")
+        elif balance_profiles:
+            st.caption("所选配置缺少 endpoint 或 API Key（需先保存）")
+    
+    # 对冲请求
+    with st.expander("🪁 对冲请求"):
+        use_hedging = st.checkbox(
+            "启用对冲", value=False,
+            help="主部署迟迟没有开始输出时，把同一请求发到备用部署，先开始输出的一方胜出，另一方取消"
+        )
+        hedge_profiles = [name for name in profiles if name != profile]
+        hedge_profile = st.selectbox(
+            "备用部署（配置）", options=hedge_profiles,
+            disabled=not hedge_profiles,
+            help="在上方「配置」中保存其他区域的部署后可选"
+        )
+        hedge_delay_ms = st.number_input(
+            "对冲延迟 (ms)", min_value=50, max_value=60000, value=1500, step=50,
+            help="主部署超过该时间没有输出时发起备用请求；自适应且样本足够时改用百分位"
+        )
+        hedge_adaptive = st.checkbox("按最近 TTFT 百分位自适应", value=True)
+        hedge_percentile = st.slider(
+            "TTFT 百分位", min_value=50, max_value=99, value=95,
+            disabled=not hedge_adaptive,
+            help="越高对冲越少、成本越低；越低尾延迟越小"
+        )
+        if endpoint:
+            # 仅用于显示；实际的延迟和统计在发送时按选中的主部署计算
+            sidebar_policy = get_hedge_policy(endpoint, model)
+            hedge_stats = sidebar_policy.stats()
+            sidebar_delay = sidebar_policy.delay(
+                hedge_delay_ms / 1000, hedge_percentile if hedge_adaptive else None
+            )
+            st.caption(
+                f"当前延迟 {sidebar_delay * 1000:.0f} ms · "
+                f"对冲率 {hedge_stats['hedge_rate']:.0%}（{hedge_stats['fired']}/{hedge_stats['requests']}）· "
+                f"备用胜出 {hedge_stats['secondary_wins']}"
+            )
+    
+    # 阶段追踪
+    with st.expander("🔬 阶段追踪"):
+        # 追踪器在进程内共享，只在本会话改动设置时更新，避免各会话每次重跑互相覆盖
+        st.checkbox(
+            "记录阶段 span", value=tracer.enabled, key="trace_enabled",
+            on_change=lambda: tracer.configure(st.session_state.trace_enabled),
+            help="图片编码、获取客户端、发送、等待首个事件、推理、生成、渲染；关闭时几乎没有开销"
+        )
+        st.number_input(
+            "缓冲 span 数", min_value=100, max_value=1000000, value=10000, step=1000,
+            key="trace_capacity",
+            on_change=lambda: tracer.configure(tracer.enabled, int(st.session_state.trace_capacity))
+        )
+        st.caption(f"缓冲区中 {len(tracer.spans())} 个 span")
+        if st.button("💾 导出到 traces/", use_container_width=True):
+            chrome_path = tracer.export("chrome")
+            otlp_path = tracer.export("otlp")
+            st.success(f"✅ 已导出 {chrome_path.name} 和 {otlp_path.name}")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                    "⬇️ Chrome trace",
+                    data=chrome_path.read_bytes(),
+                    file_name=chrome_path.name,
+                    mime="application/json",
+                    use_container_width=True,
+                    help="用 Perfetto（ui.perfetto.dev）或 chrome://tracing 打开"
+                )
+            with col2:
+                st.download_button(
+                    "⬇️ OTLP JSON",
+                    data=otlp_path.read_bytes(),
+                    file_name=otlp_path.name,
+                    mime="application/json",
+                    use_container_width=True
+                )
+        if st.button("🧹 清空 span", use_container_width=True):
+            tracer.clear()
+    
+    # 会话内存
+    with st.expander("🧠 会话内存"):
+        page_size = st.number_input(
+            "显示最近消息数", min_value=2, max_value=500, value=20, step=2,
+            help="更早的消息点击「加载更早的消息」后再渲染"
+        )
+        session_cap_mb = st.number_input(
+            "每会话内存上限 (MB)", min_value=1, max_value=1024,
+            value=DEFAULT_SESSION_CAP // (1024 * 1024),
+            help="超过上限时，较早消息的缩略图和文本移到磁盘，用到时再读取"
+        )
+        session_cap = int(session_cap_mb) * 1024 * 1024
+        enforce_cap(st.session_state.messages, session_cap)
+        st.caption(
+            f"{len(st.session_state.messages)} 条消息 · "
+            f"内存 {format_bytes(session_size(st.session_state.messages))} / {format_bytes(session_cap)} · "
+            f"{spilled_count(st.session_state.messages)} 条已移到磁盘"
+        )
+
+    # 上下文预算：按模型保存，超出时降采样较早的图片、丢弃或摘要最早的轮次
+    with st.expander("📐 上下文预算"):
+        budget_config = config.get('context_budget', {}).get(model, {})
+        model_limit = context_limit(model)
+        use_context_budget = st.checkbox(
+            "启用上下文预算", value=budget_config.get('enabled', True), key=f"context_enabled_{model}",
+            help="完整回放时按预算裁剪历史；链式对话超出预算时改为裁剪后回放"
+        )
+        context_budget = st.number_input(
+            "Input 预算 (tokens)", min_value=1000, max_value=model_limit,
+            value=min(budget_config.get('budget', model_limit // 4), model_limit), step=1000,
+            key=f"context_budget_{model}",
+            help=f"{model} 的上下文上限约 {model_limit} tokens；input 越长 TTFT 越高"
+        )
+        context_strategy = st.selectbox(
+            "超出预算时", options=["drop", "summarize"],
+            index=["drop", "summarize"].index(budget_config.get('strategy', 'drop')),
+            format_func=lambda s: {"drop": "丢弃最早的轮次", "summarize": "摘要最早的轮次"}[s],
+            key=f"context_strategy_{model}",
+            help="摘要会额外调用一次模型，摘要作为第一条消息发送，instructions 不变，不影响提示缓存"
+        )
+        keep_recent_turns = st.number_input(
+            "始终保留最近轮数", min_value=1, max_value=50, value=budget_config.get('keep_recent_turns', 2),
+            key=f"context_keep_{model}"
+        )
+        downsample_old_images = st.checkbox(
+            "较早的图片改为低细节", value=budget_config.get('downsample_images', True),
+            key=f"context_downsample_{model}"
+        )
+        if st.button("💾 保存预算", use_container_width=True):
+            config.setdefault('context_budget', {})[model] = {
+                'enabled': use_context_budget,
+                'budget': int(context_budget),
+                'strategy': context_strategy,
+                'keep_recent_turns': int(keep_recent_turns),
+                'downsample_images': downsample_old_images,
+            }
+            if save_config(config):
+                st.success(f"✅ 已保存 {model} 的上下文预算")
+            else:
+                st.error("❌ 保存失败")
+
+        # 当前上下文大小和预计 TTFT（按本会话的 input tokens 与 TTFT 拟合）
+        context_plan = plan_turn_context()
+        st.progress(
+            min(context_plan.full_tokens / context_budget, 1.0),
+            text=f"上下文约 {context_plan.full_tokens} / {int(context_budget)} tokens"
+        )
+        ttft_samples = [
+            (message["metrics"]["input_tokens"] - message["metrics"].get("cached_tokens", 0),
+             message["metrics"]["ttft"])
+            for message in st.session_state.messages
+            if message["role"] == "assistant" and (message.get("metrics") or {}).get("completed")
+            and not message.get("stats", {}).get("cache_hit")
+        ]
+        send_tokens = context_plan.planned_tokens if use_context_budget else context_plan.full_tokens
+        if conversation_mode == "single":
+            send_tokens = estimate_text_tokens(instructions)
+        elif conversation_mode == "chain" and st.session_state.last_response_id:
+            # 链式对话发送的是服务端保存的上下文，未超出预算时不裁剪
+            chained = chained_tokens(st.session_state.messages)
+            if chained is not None and not (use_context_budget and chained > context_budget):
+                send_tokens = chained
+        projected_ttft, ttft_per_1k, fitted = project_ttft(ttft_samples, send_tokens, prefill_tokens_per_sec)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("📐 下一轮发送", f"{send_tokens} tokens", help="不含本轮的新消息")
+        with col2:
+            st.metric(
+                "⏱️ 预计 TTFT", f"{projected_ttft:.2f}s",
+                delta=f"+{ttft_per_1k * 1000:.0f} ms / 1k tokens", delta_color="off",
+                help="按本会话的 input tokens 与 TTFT 拟合" if fitted
+                else f"样本不足，按预填充速度 {prefill_tokens_per_sec} tokens/s 估算"
+            )
+        calibration = st.session_state.token_calibration
+        summary = st.session_state.context_summary
+        st.caption(
+            f"本地估算 × {calibration.ratio:.2f}（{calibration.samples} 轮校准）"
+            + (
+                f" · 将去掉 {context_plan.start} 条、{len(context_plan.downsample)} 张图降为低细节"
+                if use_context_budget and context_plan.trimmed else ""
+            )
+            + (f" · 摘要覆盖 {summary['covered']} 条" if summary else "")
+        )
+
     st.divider()
     
     # 清空按钮
     if st.button("🗑️ 清空对话", use_container_width=True):
+        if st.session_state.active_turn is not None:
+            st.session_state.active_turn["worker"].cancel()
+            st.session_state.active_turn = None
         st.session_state.messages = []
+        st.session_state.history_window = 0
+        st.session_state.last_response_id = None
+        st.session_state.context_summary = None
+        st.session_state.context_start = 0
         st.rerun()
 
-# 显示对话历史
-for message in st.session_state.messages:
+# 显示对话历史：只渲染最近的消息，更早的按页加载
+history_window = max(st.session_state.history_window, int(page_size))
+hidden_count = max(len(st.session_state.messages) - history_window, 0)
+if hidden_count:
+    if st.button(f"⬆️ 加载更早的消息（还有 {hidden_count} 条）"):
+        st.session_state.history_window = history_window + int(page_size)
+        st.rerun()
+
+for message in st.session_state.messages[hidden_count:]:
     with st.chat_message(message["role"]):
         # 显示文本
-        if "text" in message:
-            st.write(message["text"])
+        if "text" in message or "text_ref" in message:
+            st.write(message_text(message))
+        
+        # 显示图片（缩略图）
+        if "image_hash" in message:
+            image = thumbnail(message)
+            if image is not None:
+                st.image(image, width=300)
+            else:
+                st.caption("🖼️ 原图已从磁盘清理")
+        if "image_stats" in message:
+            st.caption(image_caption(message["image_stats"]))
+        
+        # 显示对比结果
+        if message["role"] == "assistant" and "comparison" in message:
+            columns = st.columns(len(message["comparison"]))
+            for column, result in zip(columns, message["comparison"]):
+                with column:
+                    st.markdown(f"**{result['name']}**  \n`{result['model']}` · {result['reasoning_effort']}")
+                    st.markdown(result["text"])
+            render_comparison(message["comparison"])
+        
+        # 显示本轮指标记录
+        if "metrics" in message:
+            with st.expander("📏 本轮指标"):
+                st.json(message["metrics"])
         
-        # 显示图片
-        if "image" in message:
-            st.image(message["image"], width=300)
+        # 显示本轮上传量
+        if "stats" in message:
+            st.caption(
+                f"📤 {format_bytes(message['stats']['uploaded_bytes'])} · "
+                f"📥 {message['stats']['input_tokens']} input tokens"
+                + (
+                    f"（♻️ 缓存 {message['stats']['cached_tokens']}）"
+                    if message['stats'].get('cached_tokens') else ""
+                )
+                + f" · {CONVERSATION_MODES[message['stats']['mode']]}"
+                + (" · 🗄️ 缓存命中" if message['stats'].get('cache_hit') else "")
+                + (
+                    f" · ⏹️ 已停止（约少生成 {message['stats']['saved_tokens']} tokens）"
+                    if message['stats'].get('truncated') else ""
+                )
+                + (
+                    f" · 🪁 对冲胜出：{message['stats']['hedge']['winner']}"
+                    if (message['stats'].get('hedge') or {}).get('fired') else ""
+                )
+                + (
+                    f" · 📐 上下文 {message['stats']['context']['full_tokens']} → "
+                    f"{message['stats']['context']['estimated_tokens']} tokens"
+                    f"（{'摘要' if message['stats']['context']['summarized'] else '去掉'} "
+                    f"{message['stats']['context']['dropped']} 条，"
+                    f"{message['stats']['context']['downsampled']} 张图降为低细节）"
+                    if message['stats'].get('context') else ""
+                )
+            )
+
+# 上一次运行被打断（点击停止或操作了其他控件）时，接着显示进行中的回答
+if st.session_state.active_turn is not None:
+    follow_turn(st.session_state.active_turn)
 
 # 图片上传
-uploaded_file = st.file_uploader("📎 上传图片（可选）", type=['png', 'jpg', 'jpeg'], key="image_upload")
+uploaded_file = st.file_uploader("📎 上传图片（可选）", type=['png', 'jpg', 'jpeg', 'webp', 'gif', 'bmp', 'tiff'], key="image_upload")
 
 # 用户输入
 if prompt := st.chat_input("输入你的消息..."):
     # 检查配置
-    if not api_key or not endpoint:
+    if (not api_key or not endpoint) and not (use_balancer and balancer):
         st.error("❌ 请先在侧边栏配置 API Key 和 Endpoint")
+    elif compare_mode:
+        # 对比模式：图片只编码一次，所有配置共用
+        user_message = make_user_message(prompt, uploaded_file, image_detail, model)
+        user_message["comparison_prompt"] = True
+        append_message(st.session_state.messages, user_message, session_cap)
+        
+        with st.chat_message("user"):
+            st.write(prompt)
+            if "image_hash" in user_message:
+                st.image(uploaded_file, width=300)
+                st.caption(image_caption(user_message["image_stats"]))
+        
+        with st.chat_message("assistant"):
+            results = run_comparison(user_message, compare_profiles)
+        append_message(st.session_state.messages, {"role": "assistant", "comparison": results}, session_cap)
     else:
-        # 构造用户消息
-        user_message = {"role": "user", "text": prompt}
+        # 本轮的根 span，在回答结束时（可能在之后的重跑中）结束
+        trace = tracer.span(
+            "chat.turn", model=model, reasoning_effort=reasoning_effort, mode=conversation_mode
+        )
         
-        # 处理图片
-        image_data = None
-        if uploaded_file is not None:
-            image_data = encode_image(uploaded_file)
-            if image_data:
-                user_message["image"] = uploaded_file
+        # 构造用户消息
+        user_message = make_user_message(prompt, uploaded_file, image_detail, model, trace)
+        image_data = user_message.get("image_hash")
         
         # 添加用户消息
-        st.session_state.messages.append(user_message)
+        append_message(st.session_state.messages, user_message, session_cap)
         
         # 显示用户消息
         with st.chat_message("user"):
             st.write(prompt)
             if uploaded_file is not None and image_data:
                 st.image(uploaded_file, width=300)
+                st.caption(image_caption(user_message["image_stats"]))
+        
+        # 负载均衡：本轮选中的部署替换侧边栏中的部署；链式对话优先沿用上一轮的部署
+        deployment = None
+        if use_balancer and balancer is not None:
+            deployment = balancer.pick(
+                prefer=st.session_state.last_deployment if conversation_mode == "chain" else None
+            )
+            endpoint, api_key, model = deployment.endpoint, deployment.api_key, deployment.model
+        trace.set(endpoint=endpoint, model=model)
+        
+        # 指标库记录的公共字段
+        turn_record = {
+            "endpoint": endpoint,
+            "model": model,
+            "reasoning_effort": reasoning_effort,
+            "image_bytes": user_message.get("image_stats", {}).get("sent_bytes", 0),
+        }
+        
+        # 配额准入凭据（失败时需要退还预估的 token）
+        ticket = None
         
         # 调用 API
         try:
-            # 初始化客户端
-            client = OpenAI(
-                base_url=endpoint,
-                api_key=api_key,
-            )
+            # 获取共享客户端（复用连接池）
+            with tracer.span("client.acquire", trace) as span:
+                client, connection_reused = get_registry().acquire(
+                    endpoint, api_key, model, pool_settings
+                )
+                span.set(reused=connection_reused)
             
             # 构造 input（使用 Responses API 格式）
-            content = [
-                {
-                    "type": "input_text",
-                    "text": prompt
-                }
-            ]
+            # 链式模式只发送本轮新消息，由服务端通过 previous_response_id 拼接上下文
+            # 上下文预算：完整回放时裁剪历史；链式对话的服务端上下文超出预算时改为裁剪后回放
+            previous_response_id = None
+            turn_mode = conversation_mode
+            context_plan = plan_turn_context() if use_context_budget and conversation_mode != "single" else None
+            chained = chained_tokens(st.session_state.messages) if context_plan is not None else None
+            if conversation_mode == "chain" and st.session_state.last_response_id and not (
+                chained is not None and chained > context_budget
+            ):
+                previous_response_id = st.session_state.last_response_id
+                input_items = build_input_items(resolve_messages(st.session_state.messages[-1:]))
+            elif conversation_mode == "single":
+                input_items = build_input_items(resolve_messages(st.session_state.messages[-1:]))
+            else:
+                if conversation_mode == "chain" and len(st.session_state.messages) > 1:
+                    # 链已断开（上一轮被停止、由备用部署回答或超出预算），本轮按完整回放记录
+                    turn_mode = "replay"
+                    if st.session_state.last_response_id:
+                        st.info(f"📐 服务端上下文约 {chained} tokens，超出预算，本轮改为裁剪后回放")
+                with tracer.span("context.plan", trace) as span:
+                    input_items, context_plan = replay_input(context_plan, client, model, trace)
+                    if context_plan is not None:
+                        span.set(
+                            full_tokens=context_plan.full_tokens,
+                            planned_tokens=context_plan.planned_tokens,
+                            dropped=context_plan.start,
+                            downsampled=len(context_plan.downsample)
+                        )
             
-            # 如果有图片，添加到 content
-            if image_data:
-                content.append({
-                    "type": "input_image",
-                    "image_url": image_data
-                })
+            # 流式请求
+            with tracer.span("build_request", trace) as span:
+                request = build_request(
+                    model, input_items, reasoning_effort, previous_response_id, instructions
+                )
+                span.set(input_items=len(input_items))
             
-            input_items = [
-                {
-                    "type": "message",
-                    "role": "user",
-                    "content": content
-                }
-            ]
+            # 响应缓存：命中时直接回放，不发请求
+            cached_entry = None
+            if use_response_cache:
+                cached_entry = response_cache.get(cache_key(request, endpoint))
             
-            # 显示助手消息
-            with st.chat_message("assistant"):
-                message_placeholder = st.empty()
-                metrics_placeholder = st.empty()
+            limiter = None
+            hedge = None
+            queue_wait = 0.0
+            if cached_entry is not None:
+                recorder = StreamRecorder(stall_threshold=stall_threshold)
+                stream = replay_events(cached_entry)
+                uploaded_bytes = 0
+            else:
+                # 配额准入：排队时间单独统计，不计入 TTFT
+                if use_rate_limit:
+                    limiter = get_limiter(
+                        endpoint, model, int(rpm_limit), int(tpm_limit),
+                        float(max_queue_wait), int(max_session_queue)
+                    )
+                    with st.spinner("🚦 等待配额..."), tracer.span("quota.admission", trace):
+                        ticket = limiter.acquire(
+                            st.session_state.session_id,
+                            estimate_request_tokens(request, int(expected_output_tokens))
+                        )
+                    queue_wait = ticket.wait_seconds
                 
-                full_response = ""
-                first_token_time = None
-                start_time = time.time()
-                reasoning_tokens = 0
-                total_tokens = 0
+                recorder = StreamRecorder(stall_threshold=stall_threshold)
+                if use_hedging and hedge_profile:
+                    # 备用部署没有主部署的服务端上下文，始终完整回放
+                    secondary_config = get_section(config, 'chat', hedge_profile)
+                    secondary_model = secondary_config.get('model', model)
+                    secondary_client, _ = get_registry().acquire(
+                        secondary_config['endpoint'], secondary_config['api_key'],
+                        secondary_model, pool_settings
+                    )
+                    secondary_input = input_items if previous_response_id is None else \
+                        replay_input(context_plan, client, model, trace)[0]
+                    # 延迟和 TTFT 样本按本轮实际的主部署（负载均衡选中的部署）统计
+                    hedge_policy = get_hedge_policy(endpoint, model) if endpoint else None
+                    hedge_delay = hedge_delay_ms / 1000
+                    if hedge_policy is not None:
+                        hedge_delay = hedge_policy.delay(hedge_delay, hedge_percentile if hedge_adaptive else None)
+                    stream = hedge = HedgedStream(
+                        HedgeTarget(
+                            deployment.name if deployment is not None else profile,
+                            endpoint, model, client, request, limiter
+                        ),
+                        HedgeTarget(
+                            hedge_profile, secondary_config['endpoint'], secondary_model, secondary_client,
+                            build_request(
+                                secondary_model, secondary_input, reasoning_effort, instructions=instructions
+                            )
+                        ),
+                        hedge_delay,
+                        hedge_policy
+                    )
+                else:
+                    send_span = tracer.span("request.send", trace)
+                    try:
+                        stream = create_stream(client, request, limiter)
+                    except NotFoundError:
+                        if previous_response_id is None:
+                            raise
+                        # 服务端上下文已过期，退回完整回放
+                        st.warning("⚠️ 上一轮响应已失效，改为完整回放历史")
+                        previous_response_id = None
+                        turn_mode = "replay"
+                        input_items, context_plan = replay_input(context_plan, client, model, trace)
+                        request = build_request(model, input_items, reasoning_effort, instructions=instructions)
+                        stream = create_stream(client, request, limiter)
+                    finally:
+                        send_span.end()
                 
-                # 流式请求
-                reasoning_config = {"effort": reasoning_effort} if reasoning_effort != "none" else None
+                # 本轮实际上传的 input 大小
+                uploaded_bytes = request_bytes(request)
+                trace.set(request_bytes=uploaded_bytes)
                 
-                stream = client.responses.create(
-                    model=model,
-                    input=input_items,
-                    stream=True,
-                    reasoning=reasoning_config
-                )
-                
-                # 处理流式事件
-                for event in stream:
-                    # 捕获文本增量
-                    if event.type == "response.output_text.delta":
-                        if first_token_time is None:
-                            first_token_time = time.time()
-                        
-                        if hasattr(event, 'delta') and event.delta:
-                            full_response += event.delta
-                            message_placeholder.write(full_response)
-                    
-                    # 捕获完成事件，提取 tokens
-                    elif event.type == "response.completed":
-                        if hasattr(event, 'response') and event.response and hasattr(event.response, 'usage'):
-                            usage = event.response.usage
-                            
-                            # 提取 Total Tokens
-                            if hasattr(usage, 'total_tokens'):
-                                total_tokens = usage.total_tokens
-                            
-                            # 提取 Reasoning Tokens
-                            if hasattr(usage, 'output_tokens_details') and usage.output_tokens_details:
-                                if hasattr(usage.output_tokens_details, 'reasoning_tokens'):
-                                    reasoning_tokens = usage.output_tokens_details.reasoning_tokens
-                
-                end_time = time.time()
-                
-                # 计算指标
-                ttft = (first_token_time - start_time) if first_token_time else 0
-                total_duration = end_time - start_time
-                
-                # 显示指标
-                if total_tokens > 0:
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric("⏱️ TTFT", f"{ttft:.2f}s")
-                    with col2:
-                        st.metric("⌛ 总时长", f"{total_duration:.2f}s")
-                    with col3:
-                        st.metric("🧠 Reasoning", reasoning_tokens)
-                    with col4:
-                        st.metric("📊 Total Tokens", total_tokens)
-                
-                # 保存助手消息
-                st.session_state.messages.append({
-                    "role": "assistant", 
-                    "text": full_response
-                })
+                if use_response_cache:
+                    if hedge is not None:
+                        # 对冲时按胜出的部署写入
+                        def key(hedge=hedge):
+                            return cache_key(hedge.winner.request, hedge.winner.endpoint)
+                    else:
+                        key = cache_key(request, endpoint)
+                    stream = RecordingStream(stream, response_cache, key, uploaded_bytes)
+            
+            # 负载均衡：流结束时在工作线程里回报结果（页面没有再接上也会执行）
+            on_done = None
+            if deployment is not None:
+                def on_done(worker, balancer=balancer, deployment=deployment,
+                            hedge=hedge, cache_hit=cached_entry is not None):
+                    # 缓存命中、备用部署胜出时没有该部署的 TTFT 样本
+                    measured = not cache_hit and (hedge is None or hedge.winner is hedge.targets[0])
+                    balancer.report(
+                        deployment, ttft=worker.metrics.ttft if measured else None, error=worker.error
+                    )
+            
+            # 在后台线程消费流，页面可以随时停止；本轮状态放进 session_state，重跑后继续显示
+            turn = st.session_state.active_turn = {
+                "id": uuid.uuid4().hex,
+                "worker": StreamWorker(stream, recorder, on_done).start(),
+                "trace": trace,
+                "deployment": deployment.name if deployment is not None else None,
+                "record": turn_record,
+                "limiter": limiter,
+                "ticket": ticket,
+                "expected_output_tokens": int(expected_output_tokens),
+                "hedge": hedge,
+                "uploaded_bytes": uploaded_bytes,
+                "mode": turn_mode,
+                "context": context_plan if previous_response_id is None else None,
+                "cache_hit": cached_entry is not None,
+                "connection_reused": connection_reused,
+                "queue_wait": queue_wait,
+            }
+            ticket = None
         
         except Exception as e:
+            if ticket is not None:
+                limiter.reconcile(ticket, 0)
+            if deployment is not None:
+                balancer.report(deployment, error=e)
+            trace.set(error=f"{type(e).__name__}: {e}").end()
+            record_turn(**turn_record, error_class=type(e).__name__)
             st.error(f"❌ 错误: {str(e)}")
             import traceback
             st.error(traceback.format_exc())
+        else:
+            follow_turn(turn)
@@ -0,0 +1,375 @@
+"""
+批量请求
+流式读取 JSONL / CSV 提示词文件，有界并发执行，失败重试，结果逐条写入输出文件并支持断点续跑
+
+输入（JSONL 每行一个对象，CSV 需要表头）字段：
+    id                可选，缺省为行号
+    prompt            必填
+    image             可选，本地路径 / http(s) URL / data URL
+    reasoning_effort  可选，覆盖命令行参数
+
+用法：
+    python batch_runner.py prompts.jsonl results.jsonl --workers 8
+    python batch_runner.py prompts.jsonl results.jsonl --balance eastus:2,westus
+"""
+
+import argparse
+import csv
+import json
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+from chat_request import abort_stream, build_input_items, build_request, consume_stream
+from client_pool import PoolSettings, get_registry
+from config_store import DEFAULT_PROFILE, get_section, load_config
+from image_utils import encode_image_cached
+from load_balancer import deployments_from_config, get_balancer, parse_weights
+from stream_metrics import StreamRecorder
+
+# 可重试的状态码
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# 中断后等待在途条目收尾的最长时间（秒）
+DRAIN_SECONDS = 5.0
+
+
+class IncompleteResponse(Exception):
+    """流以 response.failed / response.incomplete 结束（没有 response.completed），可重试"""
+
+
+@dataclass
+class BatchConfig:
+    """批量参数"""
+    endpoint: str
+    api_key: str
+    model: str
+    input_path: str
+    output_path: str
+    reasoning_effort: str = "none"
+    image_detail: str = "auto"
+    workers: int = 4
+    max_retries: int = 5
+    backoff_base: float = 1.0
+    backoff_max: float = 60.0
+    # 续跑时是否重新执行之前失败的条目
+    retry_failed: bool = False
+    # 负载均衡的部署（load_balancer.Deployment）；非空时忽略 endpoint / api_key / model
+    deployments: list = field(default_factory=list)
+
+
+def iter_items(path):
+    """逐行读取输入文件，产出 dict（始终带 id）"""
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.suffix.lower() == '.csv':
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for line_number, row in enumerate(rows, start=1):
+            row = dict(row)
+            row["id"] = str(row.get("id") or line_number)
+            yield row
+
+
+def count_items(path):
+    """条目数：CSV 按记录数（引号内可以换行），JSONL 按非空行数，与 iter_items 一致"""
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.suffix.lower() == '.csv':
+            return sum(1 for _ in csv.DictReader(f))
+        return sum(1 for line in f if line.strip())
+
+
+def load_checkpoint(output_path, retry_failed=False):
+    """从已有输出文件读取已完成的 id"""
+    done = set()
+    path = Path(output_path)
+    if not path.exists():
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时可能留下半行
+                continue
+            if record.get("status") == "ok" or not retry_failed:
+                done.add(record["id"])
+    return done
+
+
+def _image_url(value, base_dir, detail, model):
+    if value.startswith(("http://", "https://", "data:")):
+        return value
+    path = Path(value)
+    if not path.is_absolute():
+        path = base_dir / path
+    return encode_image_cached(path.read_bytes(), detail, model).data_url
+
+
+def retry_delay(error, attempt, base=1.0, maximum=60.0):
+    """
+    重试等待时间：优先使用 Retry-After / retry-after-ms 响应头，
+    否则指数退避加随机抖动；不可重试时返回 None
+    """
+    if isinstance(error, APIStatusError):
+        if error.status_code not in RETRYABLE_STATUS:
+            return None
+        headers = error.response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return min(float(headers["retry-after-ms"]) / 1000, maximum)
+            if headers.get("retry-after"):
+                return min(float(headers["retry-after"]), maximum)
+        except ValueError:
+            pass
+    elif not isinstance(error, (APIConnectionError, APITimeoutError, IncompleteResponse)):
+        return None
+    return min(base * 2 ** attempt, maximum) * random.uniform(0.5, 1.0)
+
+
+def _until_stopped(stream, stop_event):
+    """中断后在下一个事件处关闭流，不再等待本条完成"""
+    for event in stream:
+        if stop_event is not None and stop_event.is_set():
+            abort_stream(stream)
+            return
+        yield event
+
+
+class _ResultWriter:
+    """线程安全地逐行追加结果，每行写完立即落盘"""
+
+    def __init__(self, path):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def process_item(client, config, item, base_dir, stop_event=None, balancer=None, clients=None):
+    """
+    执行单个条目（含重试），返回结果记录；使用负载均衡时每次尝试重新选择部署
+    因 stop_event 中断而放弃时返回 None（不写入结果，续跑时重新执行）
+    """
+    record = {"id": item["id"], "status": "error", "attempts": 0}
+    try:
+        message = {"role": "user", "text": item["prompt"]}
+        if item.get("image"):
+            message["image_url"] = _image_url(item["image"], base_dir, config.image_detail, config.model)
+            message["image_detail"] = config.image_detail
+        request = build_request(
+            config.model,
+            build_input_items([message]),
+            item.get("reasoning_effort") or config.reasoning_effort
+        )
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+
+    for attempt in range(config.max_retries + 1):
+        record["attempts"] = attempt + 1
+        deployment = None
+        if balancer is not None:
+            deployment = balancer.pick()
+            client = clients[deployment.name]
+            request["model"] = deployment.model
+            record["deployment"] = deployment.name
+        recorder = StreamRecorder()
+        try:
+            text = consume_stream(_until_stopped(client.responses.create(**request), stop_event), recorder)
+            metrics = recorder.finish()
+            if not metrics.completed:
+                raise IncompleteResponse("Incomplete")
+        except Exception as e:
+            recorder.finish()
+            if stop_event is not None and stop_event.is_set():
+                return None
+            if deployment is not None:
+                balancer.report(deployment, error=e)
+            record["error"] = f"{type(e).__name__}: {e}"
+            delay = retry_delay(e, attempt, config.backoff_base, config.backoff_max)
+            if delay is None or attempt == config.max_retries:
+                return record
+            if stop_event is not None and stop_event.wait(delay):
+                return None
+            if stop_event is None:
+                time.sleep(delay)
+            continue
+
+        if deployment is not None:
+            balancer.report(deployment, ttft=metrics.ttft)
+        record.update({
+            "status": "ok",
+            "error": None,
+            "text": text,
+            "response_id": metrics.response_id,
+            "ttft": metrics.ttft,
+            "total_duration": metrics.total_duration,
+            "input_tokens": metrics.input_tokens,
+            "output_tokens": metrics.output_tokens,
+            "reasoning_tokens": metrics.reasoning_tokens,
+            "total_tokens": metrics.total_tokens,
+        })
+        return record
+    return record
+
+
+def run_batch(config, progress=None, stop_event=None):
+    """
+    执行批量任务，返回统计 dict
+
+    已写入输出文件的 id 会被跳过（断点续跑）。输入按需读取，
+    在途条目不超过 workers * 2，progress(stats) 在调用方线程回调
+    """
+    done_ids = load_checkpoint(config.output_path, config.retry_failed)
+    base_dir = Path(config.input_path).parent
+    settings = PoolSettings(
+        max_connections=max(config.workers, 1),
+        max_keepalive_connections=max(config.workers, 1),
+    )
+    # 由本模块负责重试（需要读取 Retry-After）
+    balancer = None
+    clients = None
+    client = None
+    if config.deployments:
+        balancer = get_balancer(config.deployments)
+        clients = {}
+        for deployment in config.deployments:
+            deployment_client, _ = get_registry().acquire(
+                deployment.endpoint, deployment.api_key, deployment.model, settings
+            )
+            clients[deployment.name] = deployment_client.with_options(max_retries=0)
+    else:
+        client, _ = get_registry().acquire(config.endpoint, config.api_key, config.model, settings)
+        client = client.with_options(max_retries=0)
+
+    stop_event = stop_event or threading.Event()
+    stats = {
+        "total": count_items(config.input_path),
+        "skipped": 0, "ok": 0, "error": 0, "retries": 0, "tokens": 0,
+        "elapsed": 0.0,
+    }
+    start = time.perf_counter()
+    writer = _ResultWriter(config.output_path)
+    in_flight = set()
+
+    def collect(futures, report=True):
+        for future in futures:
+            record = future.result()
+            if record is None:
+                continue
+            writer.write(record)
+            stats[record["status"]] += 1
+            stats["retries"] += max(record["attempts"] - 1, 0)
+            stats["tokens"] += record.get("total_tokens", 0)
+        stats["elapsed"] = time.perf_counter() - start
+        if report and progress is not None:
+            progress(dict(stats))
+
+    pool = ThreadPoolExecutor(max_workers=config.workers, thread_name_prefix="batch")
+    try:
+        for item in iter_items(config.input_path):
+            if stop_event.is_set():
+                break
+            if item["id"] in done_ids:
+                stats["skipped"] += 1
+                continue
+            # 有界提交：在途过多时先等待完成
+            while len(in_flight) >= config.workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(pool.submit(
+                process_item, client, config, item, base_dir, stop_event, balancer, clients
+            ))
+
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+    except BaseException:
+        # Ctrl+C 或 Streamlit 重跑打断：先让在途条目停止（流在下一个事件处关闭、重试等待立即返回），
+        # 短暂等待它们收尾后写出已完成的结果；此时不再回调 progress。
+        # 因中断而放弃的条目不写入，续跑时重新执行
+        stop_event.set()
+        done, _ = wait(in_flight, timeout=DRAIN_SECONDS)
+        collect([future for future in done if not future.cancelled()], report=False)
+        raise
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+
+    stats["elapsed"] = time.perf_counter() - start
+    stats["stopped"] = stop_event.is_set()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量执行 Responses API 请求")
+    parser.add_argument("input", help="输入文件（.jsonl 或 .csv）")
+    parser.add_argument("output", help="输出 JSONL（已存在时续跑）")
+    parser.add_argument("--config", default="config.json", help="配置文件，读取其中的 chat 配置")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, help="使用的命名配置")
+    parser.add_argument("--balance", help="在多个命名配置之间负载均衡，如 eastus:2,westus")
+    parser.add_argument("--endpoint")
+    parser.add_argument("--api-key")
+    parser.add_argument("--model")
+    parser.add_argument("--reasoning-effort", default="none",
+                        choices=["none", "minimal", "low", "medium", "high"])
+    parser.add_argument("--image-detail", default="auto")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--retry-failed", action="store_true", help="续跑时重新执行失败的条目")
+    args = parser.parse_args(argv)
+
+    file_config = load_config(args.config)
+    chat_config = get_section(file_config, 'chat', args.profile)
+
+    config = BatchConfig(
+        endpoint=args.endpoint or chat_config.get('endpoint', ''),
+        api_key=args.api_key or chat_config.get('api_key', ''),
+        model=args.model or chat_config.get('model', 'gpt-4o'),
+        input_path=args.input,
+        output_path=args.output,
+        reasoning_effort=args.reasoning_effort,
+        image_detail=args.image_detail,
+        workers=args.workers,
+        max_retries=args.max_retries,
+        retry_failed=args.retry_failed,
+        deployments=deployments_from_config(file_config, parse_weights(args.balance)) if args.balance else [],
+    )
+    if not config.deployments and (not config.endpoint or not config.api_key):
+        parser.error("缺少 endpoint 或 api_key")
+
+    def progress(stats):
+        finished = stats["ok"] + stats["error"] + stats["skipped"]
+        print(
+            f"\r[{stats['elapsed']:7.1f}s] {finished}/{stats['total']} "
+            f"成功 {stats['ok']} 失败 {stats['error']} 跳过 {stats['skipped']} 重试 {stats['retries']}",
+            end="", flush=True
+        )
+
+    stop_event = threading.Event()
+    try:
+        stats = run_batch(config, progress, stop_event)
+    except KeyboardInterrupt:
+        print("\n已中断，重新运行同一命令即可从断点继续")
+        return
+    print()
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+"""
+Responses API 并发压测
+页面（pages/3_📈_Benchmark.py）和命令行共用
+
+用法：
+    python benchmark.py --concurrency 8 --duration 60 --out result.json --csv result.csv
+    python benchmark.py --mock --concurrency 8 --duration 10
+"""
+
+import argparse
+import csv
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from openai import APIStatusError
+
+from chat_request import build_input_items, build_request, consume_stream, request_bytes
+from client_pool import PoolSettings, get_registry
+from config_store import DEFAULT_PROFILE, get_section, load_config
+from image_utils import encode_image_cached
+from load_balancer import deployments_from_config, get_balancer, parse_weights
+from stream_metrics import StreamRecorder, percentile
+
+DEFAULT_PROMPTS = [
+    "用一句话介绍你自己。",
+    "解释一下什么是 TCP 三次握手。",
+    "写一首关于秋天的四行短诗。",
+]
+
+
+@dataclass
+class BenchmarkConfig:
+    """压测参数"""
+    endpoint: str
+    api_key: str
+    model: str
+    prompts: list = field(default_factory=lambda: list(DEFAULT_PROMPTS))
+    # 所有请求共用的 instructions（固定前缀，可验证提示缓存）
+    instructions: str = ""
+    # 图片原始字节
+    images: list = field(default_factory=list)
+    image_detail: str = "auto"
+    reasoning_effort: str = "none"
+    # 并发上限；rate 为 0 时是闭环压测（始终保持 concurrency 个请求在途）
+    concurrency: int = 4
+    # 目标发送速率（请求/秒），大于 0 时为开环压测
+    rate: float = 0.0
+    duration: float = 30.0
+    max_requests: int = 0
+    # 负载均衡的部署（load_balancer.Deployment）；非空时忽略 endpoint / api_key / model
+    deployments: list = field(default_factory=list)
+
+
+@dataclass
+class RequestResult:
+    """单个请求的结果（时间单位：秒，相对压测开始）"""
+    index: int
+    scheduled_at: float
+    started_at: float
+    prompt_index: int
+    image_index: int = -1
+    ttft: float = 0.0
+    total_duration: float = 0.0
+    output_tokens_per_sec: float = 0.0
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    reasoning_tokens: int = 0
+    total_tokens: int = 0
+    uploaded_bytes: int = 0
+    status_code: int = 200
+    error: str = ""
+    deployment: str = ""
+
+
+def load_prompts(path):
+    """读取提示词文件：.jsonl 每行 {"prompt": ...}，其余按行读取"""
+    path = Path(path)
+    prompts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.suffix == '.jsonl':
+                prompts.append(json.loads(line)["prompt"])
+            else:
+                prompts.append(line)
+    return prompts
+
+
+def encode_images(images, detail="auto", model=""):
+    """图片只编码一次，所有请求共用"""
+    return [encode_image_cached(raw, detail, model).data_url for raw in images]
+
+
+def _run_one(client, config, image_urls, index, scheduled_at, bench_start, balancer=None, clients=None):
+    started_at = time.perf_counter() - bench_start
+    model = config.model
+    deployment = None
+    if balancer is not None:
+        deployment = balancer.pick()
+        client = clients[deployment.name]
+        model = deployment.model
+    prompt_index = index % len(config.prompts)
+    image_index = index % len(image_urls) if image_urls else -1
+
+    message = {"role": "user", "text": config.prompts[prompt_index]}
+    if image_index >= 0:
+        message["image_url"] = image_urls[image_index]
+        message["image_detail"] = config.image_detail
+    request = build_request(
+        model, build_input_items([message]), config.reasoning_effort,
+        instructions=config.instructions or None
+    )
+
+    result = RequestResult(
+        index=index,
+        scheduled_at=scheduled_at,
+        started_at=started_at,
+        prompt_index=prompt_index,
+        image_index=image_index,
+        uploaded_bytes=request_bytes(request),
+        deployment=deployment.name if deployment is not None else "",
+    )
+    recorder = StreamRecorder()
+    error = None
+    try:
+        consume_stream(client.responses.create(**request), recorder)
+    except APIStatusError as e:
+        error = e
+        result.status_code = e.status_code
+        result.error = type(e).__name__
+    except Exception as e:
+        error = e
+        result.status_code = 0
+        result.error = type(e).__name__
+
+    metrics = recorder.finish()
+    if deployment is not None:
+        balancer.report(deployment, ttft=metrics.ttft, error=error)
+    result.ttft = metrics.ttft
+    result.total_duration = metrics.total_duration
+    result.output_tokens_per_sec = metrics.output_tokens_per_sec
+    result.input_tokens = metrics.input_tokens
+    result.cached_tokens = metrics.cached_tokens
+    result.output_tokens = metrics.output_tokens
+    result.reasoning_tokens = metrics.reasoning_tokens
+    result.total_tokens = metrics.total_tokens
+    if not result.error and not metrics.completed:
+        result.status_code = 0
+        result.error = "Incomplete"
+    return result
+
+
+def run_benchmark(config, progress=None, stop_event=None):
+    """
+    执行压测，返回 (results, wall_seconds)
+
+    调度在调用方线程进行，progress(done, sent, elapsed) 也在调用方线程回调，
+    因此可以直接在 Streamlit 脚本中更新页面
+    """
+    image_urls = encode_images(config.images, config.image_detail, config.model)
+    settings = PoolSettings(
+        max_connections=max(config.concurrency, 1),
+        max_keepalive_connections=max(config.concurrency, 1),
+    )
+    # 压测需要看到真实的 429，不让 SDK 自动重试
+    balancer = None
+    clients = None
+    client = None
+    if config.deployments:
+        balancer = get_balancer(config.deployments)
+        clients = {}
+        for deployment in config.deployments:
+            deployment_client, _ = get_registry().acquire(
+                deployment.endpoint, deployment.api_key, deployment.model, settings
+            )
+            clients[deployment.name] = deployment_client.with_options(max_retries=0)
+    else:
+        client, _ = get_registry().acquire(config.endpoint, config.api_key, config.model, settings)
+        client = client.with_options(max_retries=0)
+
+    stop_event = stop_event or threading.Event()
+    results = []
+    in_flight = set()
+    sent = 0
+    bench_start = time.perf_counter()
+    deadline = bench_start + config.duration
+    next_send = bench_start
+    last_progress = 0.0
+
+    with ThreadPoolExecutor(max_workers=config.concurrency, thread_name_prefix="bench") as pool:
+        while not stop_event.is_set():
+            now = time.perf_counter()
+            if now >= deadline or (config.max_requests and sent >= config.max_requests):
+                break
+
+            # 发送新请求
+            if config.rate > 0:
+                while (now >= next_send and len(in_flight) < config.concurrency
+                       and not (config.max_requests and sent >= config.max_requests)):
+                    in_flight.add(pool.submit(
+                        _run_one, client, config, image_urls, sent, next_send - bench_start, bench_start,
+                        balancer, clients
+                    ))
+                    sent += 1
+                    next_send += 1.0 / config.rate
+                if len(in_flight) >= config.concurrency:
+                    # 被并发上限挡住时等某个请求完成，而不是按发送时刻空转
+                    timeout = max(0.0, min(deadline - now, 0.25))
+                else:
+                    timeout = max(0.0, min(next_send - now, deadline - now, 0.25))
+            else:
+                while (len(in_flight) < config.concurrency
+                       and not (config.max_requests and sent >= config.max_requests)):
+                    in_flight.add(pool.submit(
+                        _run_one, client, config, image_urls, sent, now - bench_start, bench_start,
+                        balancer, clients
+                    ))
+                    sent += 1
+                timeout = max(0.0, min(deadline - now, 0.25))
+
+            if in_flight:
+                done, in_flight = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                results.extend(f.result() for f in done)
+            else:
+                time.sleep(timeout)
+
+            if progress is not None and now - last_progress >= 0.5:
+                progress(len(results), sent, now - bench_start)
+                last_progress = now
+
+        # 等待在途请求结束
+        while in_flight:
+            done, in_flight = wait(in_flight, timeout=0.5, return_when=FIRST_COMPLETED)
+            results.extend(f.result() for f in done)
+            if progress is not None:
+                progress(len(results), sent, time.perf_counter() - bench_start)
+
+    wall_seconds = time.perf_counter() - bench_start
+    results.sort(key=lambda r: r.index)
+    return results, wall_seconds
+
+
+def summarize(results, wall_seconds):
+    """汇总百分位数、错误率和实际 RPM/TPM"""
+    ok = [r for r in results if not r.error]
+    total = len(results)
+
+    def pcts(values):
+        return {
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'mean': sum(values) / len(values) if values else 0.0,
+        }
+
+    minutes = wall_seconds / 60 if wall_seconds > 0 else 1
+    return {
+        'requests': total,
+        'succeeded': len(ok),
+        'errors': total - len(ok),
+        'error_rate': (total - len(ok)) / total if total else 0.0,
+        'rate_429': sum(1 for r in results if r.status_code == 429) / total if total else 0.0,
+        'wall_seconds': wall_seconds,
+        'achieved_rpm': len(ok) / minutes,
+        'achieved_tpm': sum(r.total_tokens for r in ok) / minutes,
+        # 提示缓存：命中缓存的 input tokens 占比
+        'cache_hit_ratio': (
+            sum(r.cached_tokens for r in ok) / sum(r.input_tokens for r in ok)
+            if sum(r.input_tokens for r in ok) else 0.0
+        ),
+        'ttft': pcts([r.ttft for r in ok]),
+        'total_duration': pcts([r.total_duration for r in ok]),
+        'output_tokens_per_sec': pcts([r.output_tokens_per_sec for r in ok]),
+        'error_types': {
+            error: sum(1 for r in results if r.error == error)
+            for error in sorted({r.error for r in results if r.error})
+        },
+        # 负载均衡时各部署的分布
+        'deployments': {
+            name: {
+                'requests': sum(1 for r in results if r.deployment == name),
+                'errors': sum(1 for r in results if r.deployment == name and r.error),
+                'ttft_p50': percentile([r.ttft for r in ok if r.deployment == name], 50),
+            }
+            for name in sorted({r.deployment for r in results if r.deployment})
+        },
+    }
+
+
+def build_report(config, results, summary):
+    """完整结果（不包含 API Key 和图片内容）"""
+    config_dict = asdict(config)
+    config_dict.pop('api_key', None)
+    config_dict['images'] = len(config.images)
+    for deployment in config_dict['deployments']:
+        deployment.pop('api_key', None)
+    return {
+        'config': config_dict,
+        'summary': summary,
+        'results': [asdict(r) for r in results],
+    }
+
+
+def export_json(config, results, summary, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(build_report(config, results, summary), f, indent=2, ensure_ascii=False)
+
+
+def results_to_csv(results, f):
+    """逐请求结果写为 CSV"""
+    fieldnames = list(RequestResult.__dataclass_fields__)
+    writer = csv.DictWriter(f, fieldnames=fieldnames)
+    writer.writeheader()
+    for r in results:
+        writer.writerow(asdict(r))
+
+
+def export_csv(results, path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        results_to_csv(results, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Responses API 并发压测")
+    parser.add_argument("--config", default="config.json", help="配置文件，读取其中的 chat 配置")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, help="使用的命名配置")
+    parser.add_argument("--balance", help="在多个命名配置之间负载均衡，如 eastus:2,westus")
+    parser.add_argument("--endpoint", help="覆盖配置文件中的 endpoint")
+    parser.add_argument("--api-key", help="覆盖配置文件中的 api_key")
+    parser.add_argument("--model", help="覆盖配置文件中的 model")
+    parser.add_argument("--prompts", help="提示词文件（.txt 每行一个，或 .jsonl）")
+    parser.add_argument("--instructions-file", help="instructions 文件，原样作为所有请求的固定前缀")
+    parser.add_argument("--image", action="append", default=[], help="附加图片，可重复")
+    parser.add_argument("--image-detail", default="auto")
+    parser.add_argument("--reasoning-effort", default="none",
+                        choices=["none", "minimal", "low", "medium", "high"])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0.0, help="目标请求/秒，0 表示闭环")
+    parser.add_argument("--duration", type=float, default=30.0, help="持续时间（秒）")
+    parser.add_argument("--max-requests", type=int, default=0)
+    parser.add_argument("--mock", action="store_true", help="在进程内启动本地模拟服务并对其压测")
+    parser.add_argument("--out", help="导出 JSON")
+    parser.add_argument("--csv", help="导出 CSV")
+    args = parser.parse_args(argv)
+
+    file_config = load_config(args.config)
+    chat_config = get_section(file_config, 'chat', args.profile)
+
+    config = BenchmarkConfig(
+        endpoint=args.endpoint or chat_config.get('endpoint', ''),
+        api_key=args.api_key or chat_config.get('api_key', ''),
+        model=args.model or chat_config.get('model', 'gpt-4o'),
+        images=[Path(p).read_bytes() for p in args.image],
+        image_detail=args.image_detail,
+        reasoning_effort=args.reasoning_effort,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        duration=args.duration,
+        max_requests=args.max_requests,
+        deployments=deployments_from_config(file_config, parse_weights(args.balance)) if args.balance else [],
+    )
+    if args.prompts:
+        config.prompts = load_prompts(args.prompts)
+    if args.instructions_file:
+        config.instructions = Path(args.instructions_file).read_text(encoding='utf-8')
+    if args.mock:
+        from mock_server import start_mock_server
+        _, config.endpoint = start_mock_server()
+        config.api_key = config.api_key or "mock"
+    if not config.deployments and (not config.endpoint or not config.api_key):
+        parser.error("缺少 endpoint 或 api_key")
+
+    def progress(done, sent, elapsed):
+        print(f"\r[{elapsed:6.1f}s] 已完成 {done} / 已发送 {sent}", end="", flush=True)
+
+    results, wall_seconds = run_benchmark(config, progress)
+    print()
+    summary = summarize(results, wall_seconds)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+    if args.out:
+        export_json(config, results, summary, args.out)
+    if args.csv:
+        export_csv(results, args.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Responses API 请求构造
+聊天页面、基准测试等共用
+"""
+
+import json
+import socket
+
+from openai import RateLimitError
+
+
+def build_content(text, image_url=None, image_detail="auto"):
+    """构造一条用户消息的 content（Responses API 格式）"""
+    content = [
+        {
+            "type": "input_text",
+            "text": text
+        }
+    ]
+
+    # 如果有图片，添加到 content
+    if image_url:
+        content.append({
+            "type": "input_image",
+            "image_url": image_url,
+            "detail": "high" if image_detail == "original" else image_detail
+        })
+    return content
+
+
+def is_comparison(message):
+    """对比模式的消息（用户提问和各配置的回答）不进入对话上下文"""
+    return bool(message.get("comparison_prompt") or message.get("comparison"))
+
+
+def build_input_items(messages):
+    """把对话记录转换为 Responses API 的 input（跳过对比模式的消息）"""
+    input_items = []
+    for message in messages:
+        if is_comparison(message):
+            continue
+        if message["role"] == "user":
+            input_items.append({
+                "type": "message",
+                "role": "user",
+                "content": build_content(
+                    message["text"], message.get("image_url"), message.get("image_detail", "auto")
+                )
+            })
+        elif message.get("text"):
+            input_items.append({
+                "type": "message",
+                "role": "assistant",
+                "content": message["text"]
+            })
+    return input_items
+
+
+def build_request(model, input_items, reasoning_effort="none", previous_response_id=None, instructions=None):
+    """
+    构造 client.responses.create 的参数（流式）
+
+    instructions 原样发送、位于提示最前面；每轮逐字节不变时 Azure 前缀缓存才能命中
+    """
+    request = {
+        "model": model,
+        "stream": True,
+    }
+    if instructions:
+        request["instructions"] = instructions
+    request["input"] = input_items
+    if reasoning_effort != "none":
+        request["reasoning"] = {"effort": reasoning_effort}
+    if previous_response_id:
+        request["previous_response_id"] = previous_response_id
+    return request
+
+
+def request_bytes(request):
+    """请求体 input 部分的大小（字节）"""
+    return len(json.dumps(request["input"], ensure_ascii=False).encode('utf-8'))
+
+
+def create_stream(client, request, limiter=None):
+    """发起流式请求；传入限流器时读取响应头更新剩余配额"""
+    if limiter is None:
+        return client.responses.create(**request)
+    try:
+        raw = client.responses.with_raw_response.create(**request)
+    except RateLimitError as e:
+        limiter.on_rate_limited(e.response.headers)
+        raise
+    limiter.update_from_headers(raw.headers)
+    return raw.parse()
+
+
+def abort_stream(stream):
+    """
+    从其他线程中止流式响应
+
+    HTTP/1.1 先关闭 socket，阻塞中的读取立即返回，服务端随之停止生成（该连接不再复用）；
+    HTTP/2 的连接由多个请求共用，只重置本请求的流
+    """
+    response = getattr(stream, 'response', None)
+    if response is not None and response.http_version == "HTTP/1.1":
+        network_stream = response.extensions.get("network_stream")
+        sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    close = getattr(stream, 'close', None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def consume_stream(stream, recorder, on_delta=None):
+    """消费流式事件，返回完整文本；on_delta 在每个文本增量时调用"""
+    parts = []
+    for event in stream:
+        recorder.on_event(event)
+        if event.type == "response.output_text.delta" and event.delta:
+            parts.append(event.delta)
+            if on_delta is not None:
+                on_delta(event.delta)
+    return "".join(parts)
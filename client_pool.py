@@ -0,0 +1,286 @@
+"""
+OpenAI 客户端连接池
+进程级共享，跨 Streamlit 会话和重跑复用 httpx 连接
+"""
+
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+
+import httpx
+from openai import OpenAI
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    """连接池参数"""
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 60.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 120.0
+    http2: bool = False
+    idle_ttl: float = 900.0
+
+
+@dataclass
+class _Entry:
+    client: OpenAI
+    http_client: httpx.Client
+    settings: PoolSettings
+    created_at: float
+    last_used: float
+    # 最近一次收到响应的时间，用于判断 keep-alive 连接是否仍然存活
+    last_active: float = 0.0
+    uses: int = 0
+    warming: bool = False
+    http2: bool = False
+    # 进行中的请求数（响应体关闭前都算）；大于 0 时不关闭客户端
+    active: int = 0
+    # 已从注册表移除，最后一个请求结束时关闭
+    retired: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def http2_available():
+    """是否安装了 h2（httpx 的 HTTP/2 依赖）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _LeasedStream(httpx.SyncByteStream):
+    """响应体关闭时回调 release（只回调一次）"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class _LeaseTransport(httpx.BaseTransport):
+    """统计客户端上进行中的请求，流式响应读完或关闭后才算结束"""
+
+    def __init__(self, transport, acquire, release):
+        self._transport = transport
+        self._acquire = acquire
+        self._release = release
+
+    def handle_request(self, request):
+        self._acquire()
+        try:
+            response = self._transport.handle_request(request)
+        except BaseException:
+            self._release()
+            raise
+        response.stream = _LeasedStream(response.stream, self._release)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+def _make_key(endpoint, api_key, model, settings):
+    # 不在字典中保存明文 key
+    key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    return (endpoint.rstrip('/'), key_hash, model, settings)
+
+
+class ClientRegistry:
+    """按 endpoint / key / model 缓存 OpenAI 客户端"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _create(self, endpoint, api_key, settings):
+        now = time.monotonic()
+        use_http2 = settings.http2 and http2_available()
+        entry = None
+
+        def on_response(response):
+            if entry is not None:
+                entry.last_active = time.monotonic()
+
+        transport = _LeaseTransport(
+            httpx.HTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=settings.max_connections,
+                    max_keepalive_connections=settings.max_keepalive_connections,
+                    keepalive_expiry=settings.keepalive_expiry,
+                ),
+                http2=use_http2,
+            ),
+            acquire=lambda: self._lease(entry),
+            release=lambda: self._release(entry),
+        )
+        http_client = httpx.Client(
+            transport=transport,
+            timeout=httpx.Timeout(settings.read_timeout, connect=settings.connect_timeout),
+            event_hooks={'response': [on_response]},
+        )
+        client = OpenAI(
+            base_url=endpoint,
+            api_key=api_key,
+            http_client=http_client,
+        )
+        entry = _Entry(
+            client=client,
+            http_client=http_client,
+            settings=settings,
+            created_at=now,
+            last_used=now,
+            http2=use_http2,
+        )
+        return entry
+
+    @staticmethod
+    def _lease(entry):
+        with entry.lock:
+            entry.active += 1
+
+    def _release(self, entry):
+        with entry.lock:
+            entry.active -= 1
+            close = entry.retired and entry.active == 0
+        if close:
+            self._close(entry)
+
+    def _retire(self, key):
+        """从注册表移除；没有进行中的请求时立即关闭，否则等最后一个请求结束"""
+        entry = self._entries.pop(key)
+        with entry.lock:
+            entry.retired = True
+            close = entry.active == 0
+        if close:
+            self._close(entry)
+
+    def _evict_idle(self, now):
+        # 长时间的流式请求期间 last_used 不会更新，正在使用的客户端不淘汰
+        expired = [
+            key for key, entry in self._entries.items()
+            if now - entry.last_used > entry.settings.idle_ttl and entry.active == 0
+        ]
+        for key in expired:
+            self._retire(key)
+
+    @staticmethod
+    def _close(entry):
+        try:
+            entry.http_client.close()
+        except Exception:
+            pass
+
+    def _get_entry(self, endpoint, api_key, model, settings):
+        now = time.monotonic()
+        key = _make_key(endpoint, api_key, model, settings)
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._create(endpoint, api_key, settings)
+                self._entries[key] = entry
+            entry.last_used = now
+        return entry
+
+    def acquire(self, endpoint, api_key, model, settings=PoolSettings()):
+        """
+        获取共享客户端
+
+        返回 (client, reused)，reused 表示本次请求大概率复用了已建立的连接
+        （keep-alive 过期时间内有过响应）
+        """
+        entry = self._get_entry(endpoint, api_key, model, settings)
+        now = time.monotonic()
+        with entry.lock:
+            reused = (
+                entry.last_active > 0
+                and now - entry.last_active < settings.keepalive_expiry
+            )
+            entry.uses += 1
+        return entry.client, reused
+
+    def warm_up(self, endpoint, api_key, model, settings=PoolSettings()):
+        """
+        后台预热连接（DNS + TCP + TLS），不阻塞调用方
+
+        已有存活连接或正在预热时直接返回
+        """
+        entry = self._get_entry(endpoint, api_key, model, settings)
+        now = time.monotonic()
+        with entry.lock:
+            if entry.warming:
+                return
+            if entry.last_active > 0 and now - entry.last_active < settings.keepalive_expiry:
+                return
+            entry.warming = True
+
+        def run():
+            try:
+                # 任何状态码都可以，只需要把连接建立起来放回池中
+                entry.http_client.head(str(entry.client.base_url))
+            except Exception:
+                pass
+            finally:
+                with entry.lock:
+                    entry.warming = False
+
+        threading.Thread(target=run, daemon=True, name="client-warmup").start()
+
+    def retire(self, endpoint=None):
+        """
+        移除客户端：之后的请求会新建客户端，
+        其他会话正在使用的旧客户端继续完成请求，最后一个请求结束时关闭
+        """
+        with self._lock:
+            for key in [key for key in self._entries if endpoint is None or key[0] == endpoint.rstrip('/')]:
+                self._retire(key)
+
+    def invalidate(self, endpoint=None):
+        """关闭并移除客户端；endpoint 为 None 时清空全部"""
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if endpoint is None or key[0] == endpoint.rstrip('/')
+            ]
+            for key in keys:
+                self._close(self._entries.pop(key))
+
+    def stats(self):
+        """当前缓存的客户端概况"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'endpoint': key[0],
+                    'model': key[2],
+                    'uses': entry.uses,
+                    'active': entry.active,
+                    'http2': entry.http2,
+                    'idle_seconds': now - entry.last_used,
+                    'age_seconds': now - entry.created_at,
+                }
+                for key, entry in self._entries.items()
+            ]
+
+
+_registry = ClientRegistry()
+
+
+def get_registry():
+    """进程级单例"""
+    return _registry
@@ -0,0 +1,178 @@
+"""
+配置存储
+所有页面共用：按文件 mtime 缓存解析结果，原子写入，支持多个命名配置（profile）和环境变量覆盖
+
+config.json 结构：
+    {
+      "chat": {...}, "realtime": {...},              # default 配置
+      "profiles": {"eastus": {"chat": {...}}},       # 命名配置，未填写的字段继承 default
+      "active_profile": "default"
+    }
+
+环境变量 AOAI_<SECTION>_<KEY>（如 AOAI_CHAT_API_KEY、AOAI_REALTIME_ENDPOINT）优先于文件，
+只作用于当前激活的配置（active_profile），也不会被写回文件
+"""
+
+import copy
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from client_pool import get_registry
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 配置文件路径
+CONFIG_FILE = Path("config.json")
+DEFAULT_PROFILE = "default"
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _stamp(path):
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+@contextmanager
+def _file_lock(path):
+    """进程内用线程锁，POSIX 上再加文件锁，防止多个进程同时写"""
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(path.with_name(path.name + ".lock"), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_config(path=CONFIG_FILE):
+    """读取配置；文件未变化（mtime 和大小相同）时直接返回缓存的副本"""
+    path = Path(path)
+    stamp = _stamp(path)
+    if stamp is None:
+        return {}
+
+    cached = _cache.get(path)
+    if cached is None or cached[0] != stamp:
+        data = _read(path)
+        if cached is not None:
+            _invalidate_clients(cached[1], data)
+        cached = _cache[path] = (stamp, data)
+    return copy.deepcopy(cached[1])
+
+
+def save_config(config, path=CONFIG_FILE):
+    """原子写入：先写同目录临时文件再替换，读者不会看到半个文件"""
+    path = Path(path)
+    try:
+        with _file_lock(path):
+            old = _read(path)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent or ".", prefix=path.name, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(config, f, indent=2, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            _invalidate_clients(old, config)
+            _cache[path] = (_stamp(path), copy.deepcopy(config))
+        return True
+    except Exception:
+        return False
+
+
+def list_profiles(config):
+    """所有配置名，default 在最前"""
+    return [DEFAULT_PROFILE] + sorted(config.get('profiles', {}))
+
+
+def env_overrides(section):
+    """环境变量 AOAI_<SECTION>_<KEY> 提供的值"""
+    prefix = f"AOAI_{section.upper()}_"
+    return {
+        name[len(prefix):].lower(): value
+        for name, value in os.environ.items()
+        if name.startswith(prefix) and value
+    }
+
+
+def _file_section(config, section, profile):
+    if not profile or profile == DEFAULT_PROFILE:
+        return config.get(section, {})
+    return config.get('profiles', {}).get(profile, {}).get(section, {})
+
+
+def get_section(config, section, profile=DEFAULT_PROFILE):
+    """
+    取某个配置的 chat / realtime 部分：default ← profile ← 环境变量
+
+    环境变量只覆盖当前激活的配置，其他命名配置（负载均衡、对冲的备用部署）保持文件中的值
+    """
+    values = dict(config.get(section, {}))
+    if profile and profile != DEFAULT_PROFILE:
+        values.update(_file_section(config, section, profile))
+
+    if (profile or DEFAULT_PROFILE) == config.get('active_profile', DEFAULT_PROFILE):
+        values.update(env_overrides(section))
+    return values
+
+
+def set_section(config, section, values, profile=DEFAULT_PROFILE):
+    """写入某个配置的 chat / realtime 部分（修改并返回 config）；来自环境变量的值不写入，保留文件中原来的值"""
+    current = _file_section(config, section, profile)
+    values = dict(values)
+    for name, value in env_overrides(section).items():
+        if values.get(name) == value:
+            if name in current:
+                values[name] = current[name]
+            else:
+                values.pop(name, None)
+    if not profile or profile == DEFAULT_PROFILE:
+        config[section] = values
+    else:
+        config.setdefault('profiles', {}).setdefault(profile, {})[section] = values
+    return config
+
+
+def _chat_targets(config):
+    """配置中所有聊天部署的 (endpoint, api_key, model)"""
+    targets = {}
+    for profile in list_profiles(config):
+        chat = dict(config.get('chat', {}))
+        if profile != DEFAULT_PROFILE:
+            chat.update(config.get('profiles', {}).get(profile, {}).get('chat', {}))
+        targets[profile] = (chat.get('endpoint'), chat.get('api_key'), chat.get('model'))
+    return targets
+
+
+def _invalidate_clients(old, new):
+    """某个配置的 endpoint / key / model 变化时，让旧 endpoint 上缓存的客户端退役（进行中的请求不受影响）"""
+    new_targets = _chat_targets(new)
+    for profile, target in _chat_targets(old).items():
+        if target[0] and new_targets.get(profile) != target:
+            get_registry().retire(target[0])
@@ -0,0 +1,286 @@
+"""
+上下文预算
+按 input token 预算决定每轮发送哪些历史：较早的图片改为低细节，仍超出时丢弃（或摘要）最早的轮次。
+token 数用本地估算（不联网），并按服务端返回的 usage 校准
+"""
+
+from dataclasses import dataclass, field, replace
+
+from chat_request import is_comparison
+from history_store import get_blob_store, message_text, resolve_message
+from image_utils import encode_image_cached
+
+# 每条消息的格式开销
+MESSAGE_OVERHEAD = 4
+
+# 模型的上下文上限（按最长前缀匹配）
+MODEL_CONTEXT_LIMITS = {
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-5": 272000,
+    "o1": 200000,
+    "o3": 200000,
+    "o4-mini": 200000,
+}
+DEFAULT_CONTEXT_LIMIT = 128000
+
+# 超出预算时一次裁剪到预算的该比例，之后几轮前缀保持不变，提示缓存仍能命中
+TRIM_TARGET = 0.75
+
+# 摘要预留的 tokens
+SUMMARY_TOKENS = 600
+
+SUMMARY_INSTRUCTIONS = (
+    "把下面的对话压缩成简洁的中文摘要，保留事实、结论、用户的偏好和未完成的问题，"
+    "不要添加对话中没有的内容。"
+)
+SUMMARY_PREFIX = "（以下是之前对话的摘要）\n"
+
+
+def context_limit(model):
+    """模型的上下文上限（tokens）"""
+    matches = [prefix for prefix in MODEL_CONTEXT_LIMITS if model.startswith(prefix)]
+    if not matches:
+        return DEFAULT_CONTEXT_LIMIT
+    return MODEL_CONTEXT_LIMITS[max(matches, key=len)]
+
+
+def estimate_text_tokens(text):
+    """ASCII 约 4 个字符一个 token，中文等其他字符约 1 个字符一个 token"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _text_tokens(message):
+    """消息文本的 tokens；助手消息优先用 usage 中的可见输出 tokens，结果缓存在消息上"""
+    if "text_tokens" not in message:
+        metrics = message.get("metrics") or {}
+        if message["role"] == "assistant" and metrics.get("completed") and metrics.get("output_tokens"):
+            message["text_tokens"] = metrics["output_tokens"] - metrics.get("reasoning_tokens", 0)
+        else:
+            message["text_tokens"] = estimate_text_tokens(message_text(message))
+    return message["text_tokens"]
+
+
+def _image_tokens(message, low_detail=False):
+    if "image_hash" not in message:
+        return 0
+    stats = message.get("image_stats") or {}
+    if low_detail:
+        return stats.get("low_detail_tokens", 85)
+    return stats.get("estimated_tokens", 0)
+
+
+def message_tokens(message, low_detail=False):
+    """单条消息发送时的 tokens（估算）"""
+    return _text_tokens(message) + _image_tokens(message, low_detail) + MESSAGE_OVERHEAD
+
+
+def chained_tokens(messages):
+    """链式对话中服务端上下文的 tokens：最近一轮的实际 input + 可见输出，加上之后的新消息"""
+    for index in range(len(messages) - 1, -1, -1):
+        metrics = messages[index].get("metrics") or {}
+        if messages[index]["role"] == "assistant" and metrics.get("input_tokens"):
+            carried = metrics["input_tokens"] + metrics.get("output_tokens", 0) - metrics.get("reasoning_tokens", 0)
+            return carried + sum(message_tokens(message) for message in messages[index + 1:])
+    return None
+
+
+@dataclass
+class TokenCalibration:
+    """本地估算与服务端 usage 的比例（指数滑动平均）"""
+    ratio: float = 1.0
+    samples: int = 0
+    alpha: float = 0.3
+
+    def observe(self, estimated, actual):
+        if estimated <= 0 or actual <= 0:
+            return
+        sample = min(max(actual / estimated, 0.5), 2.0)
+        self.ratio = sample if self.samples == 0 else self.ratio + self.alpha * (sample - self.ratio)
+        self.samples += 1
+
+    def apply(self, tokens):
+        return int(tokens * self.ratio)
+
+
+@dataclass
+class ContextPlan:
+    """本轮发送的上下文：start 之前的消息不发送，downsample 中的消息图片改为低细节"""
+    start: int = 0
+    downsample: set = field(default_factory=set)
+    # 完整历史和本轮实际发送的估算 tokens（已校准，含 instructions）
+    full_tokens: int = 0
+    planned_tokens: int = 0
+    # 本轮发送的未校准估算，收到 usage 后用来校准
+    raw_tokens: int = 0
+    budget: int = 0
+
+    @property
+    def trimmed(self):
+        return self.start > 0 or bool(self.downsample)
+
+
+def _turn_starts(messages):
+    """每轮（用户消息开始）的起始下标"""
+    return [
+        i for i, message in enumerate(messages)
+        if message["role"] == "user" and not is_comparison(message)
+    ]
+
+
+def _sendable(messages):
+    return [i for i, message in enumerate(messages) if not is_comparison(message)]
+
+
+def _cost(messages, sendable, start, low=(), base_tokens=0, reserve_tokens=0):
+    """从 start 开始发送（low 中的图片为低细节）的未校准估算"""
+    tokens = base_tokens + sum(
+        message_tokens(messages[i], low_detail=i in low) for i in sendable if i >= start
+    )
+    return tokens + (reserve_tokens if start > 0 else 0)
+
+
+def plan_context(messages, budget, calibration=None, base_tokens=0, keep_recent_turns=2,
+                 downsample_images=True, reserve_tokens=0, previous_start=0):
+    """
+    按预算规划本轮上下文
+
+    - base_tokens：instructions 等固定部分；reserve_tokens：摘要预留
+    - 最近 keep_recent_turns 轮始终完整发送（即使超出预算）
+    - 先把较早轮次的图片改为低细节，仍超出时从最早的轮次开始整轮去掉，一次裁到预算的 TRIM_TARGET
+    - previous_start 为上一轮的裁剪位置：仍在预算内时沿用（前缀不变，提示缓存可以命中），
+      再次超出时才往后裁
+    """
+    calibration = calibration or TokenCalibration()
+    sendable = _sendable(messages)
+
+    def cost(start, low=()):
+        return _cost(messages, sendable, start, low, base_tokens, reserve_tokens)
+
+    raw = cost(0)
+    plan = ContextPlan(
+        full_tokens=calibration.apply(raw), planned_tokens=calibration.apply(raw),
+        raw_tokens=raw, budget=budget
+    )
+    if plan.full_tokens <= budget:
+        return plan
+
+    starts = _turn_starts(messages)
+    protected = starts[-min(max(keep_recent_turns, 1), len(starts))] if starts else 0
+
+    # 较早轮次的图片改为低细节
+    low = set()
+    if downsample_images:
+        low = {i for i in sendable if i < protected and "image_hash" in messages[i]}
+
+    if previous_start not in starts or previous_start > protected:
+        previous_start = 0
+    plan.start = previous_start
+    plan.raw_tokens = cost(previous_start, low)
+    plan.planned_tokens = calibration.apply(plan.raw_tokens)
+    if plan.planned_tokens <= budget:
+        plan.downsample = {i for i in low if i >= plan.start}
+        return plan
+
+    target = int(budget * TRIM_TARGET)
+    for start in starts:
+        if start <= previous_start:
+            continue
+        if start > protected:
+            break
+        plan.start = start
+        plan.raw_tokens = cost(start, low)
+        plan.planned_tokens = calibration.apply(plan.raw_tokens)
+        if plan.planned_tokens <= target:
+            break
+    plan.downsample = {i for i in low if i >= plan.start}
+    return plan
+
+
+def replan(messages, plan, start=None, calibration=None, base_tokens=0, summary_tokens=0):
+    """
+    返回新的规划（不修改 plan）：start 可以往后移，summary_tokens 为实际发送的摘要 tokens，
+    按实际发送的内容重新估算 raw_tokens / planned_tokens，校准才对得上
+    """
+    calibration = calibration or TokenCalibration()
+    start = plan.start if start is None else max(start, plan.start)
+    downsample = {i for i in plan.downsample if i >= start}
+    raw = _cost(messages, _sendable(messages), start, downsample, base_tokens, summary_tokens)
+    return replace(plan, start=start, downsample=downsample, raw_tokens=raw,
+                   planned_tokens=calibration.apply(raw))
+
+
+def _low_detail_url(message, model):
+    raw_bytes = get_blob_store().get(message["image_hash"])
+    if raw_bytes is None:
+        return None
+    encoded = encode_image_cached(raw_bytes, "low", model)
+    message.setdefault("image_stats", {})["low_detail_tokens"] = encoded.estimated_tokens
+    return encoded.data_url
+
+
+def apply_plan(messages, plan, model="", summary=None):
+    """
+    按规划生成本轮要发送的消息（已解析，可直接 build_input_items）
+    summary 非空时作为第一条消息代替被去掉的轮次
+    """
+    selected = []
+    if plan.start > 0 and summary:
+        selected.append({"role": "user", "text": SUMMARY_PREFIX + summary})
+    for i, message in enumerate(messages[plan.start:], start=plan.start):
+        resolved = resolve_message(message)
+        if i in plan.downsample:
+            resolved = dict(resolved)
+            image_url = _low_detail_url(message, model)
+            if image_url is None:
+                # 原图已从磁盘淘汰，只发送文本
+                resolved.pop("image_url", None)
+            else:
+                resolved["image_url"] = image_url
+                resolved["image_detail"] = "low"
+        selected.append(resolved)
+    return selected
+
+
+def summarize_messages(client, model, messages, previous_summary=None, max_output_tokens=SUMMARY_TOKENS):
+    """调用模型把被去掉的轮次（连同之前的摘要）压缩成摘要文本"""
+    lines = []
+    if previous_summary:
+        lines.append(f"之前的摘要：{previous_summary}")
+    for message in messages:
+        if is_comparison(message):
+            continue
+        role = "用户" if message["role"] == "user" else "助手"
+        text = message_text(message)
+        if "image_hash" in message:
+            text += "（附图片）"
+        lines.append(f"{role}：{text}")
+    response = client.responses.create(
+        model=model,
+        instructions=SUMMARY_INSTRUCTIONS,
+        input="\n".join(lines),
+        max_output_tokens=max_output_tokens,
+    )
+    return response.output_text
+
+
+def project_ttft(samples, tokens, fallback_tokens_per_sec):
+    """
+    预计 TTFT：samples 为本会话 [(input_tokens, ttft)]，样本足够时用最小二乘拟合，
+    否则按预填充速度估算；返回 (秒, 每 1k tokens 增加的秒数, 是否来自拟合)
+    """
+    samples = [(x, y) for x, y in samples if x > 0 and y > 0]
+    if len(samples) >= 3:
+        n = len(samples)
+        mean_x = sum(x for x, _ in samples) / n
+        mean_y = sum(y for _, y in samples) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+        if var_x > 0:
+            slope = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+            slope = max(slope, 0.0)
+            intercept = max(mean_y - slope * mean_x, 0.0)
+            return intercept + slope * tokens, slope * 1000, True
+    slope = 1 / fallback_tokens_per_sec if fallback_tokens_per_sec else 0.0
+    base = min((y for _, y in samples), default=0.0)
+    return base + slope * tokens, slope * 1000, False
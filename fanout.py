@@ -0,0 +1,46 @@
+"""
+多部署并行请求
+同一请求并发发送到多个部署，增量在调用方线程按到达顺序产出
+"""
+
+import queue
+import threading
+
+from chat_request import consume_stream
+from stream_metrics import StreamRecorder
+
+
+def fan_out(jobs, stall_threshold=1.0):
+    """
+    并行执行 jobs（[(client, request), ...]）
+
+    产出 (index, kind, payload)：
+    - ("delta", 文本增量)
+    - ("done", TurnMetrics)
+    - ("error", (异常, TurnMetrics))
+
+    网络请求和计时都在工作线程完成，调用方线程只负责渲染，
+    因此可以在 Streamlit 脚本中直接使用
+    """
+    events = queue.Queue()
+
+    def worker(index, client, request):
+        recorder = StreamRecorder(stall_threshold=stall_threshold)
+        try:
+            stream = client.responses.create(**request)
+            consume_stream(stream, recorder, on_delta=lambda delta: events.put((index, "delta", delta)))
+            events.put((index, "done", recorder.finish()))
+        except Exception as e:
+            events.put((index, "error", (e, recorder.finish())))
+
+    for index, (client, request) in enumerate(jobs):
+        threading.Thread(
+            target=worker, args=(index, client, request), daemon=True, name=f"fanout-{index}"
+        ).start()
+
+    remaining = len(jobs)
+    while remaining:
+        index, kind, payload = events.get()
+        if kind != "delta":
+            remaining -= 1
+        yield index, kind, payload
@@ -0,0 +1,216 @@
+"""
+对冲请求
+主部署在限定时间内没有开始输出时，把同一请求发到备用部署，先开始输出的一方胜出，另一方取消
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from chat_request import abort_stream, create_stream
+from stream_metrics import percentile
+
+# 视为“开始输出”的事件
+FIRST_OUTPUT_EVENTS = ("response.output_text.delta", "response.completed")
+
+_DONE = object()
+
+
+@dataclass
+class HedgeTarget:
+    """参与对冲的一个部署"""
+    name: str
+    endpoint: str
+    model: str
+    client: object
+    request: dict
+    limiter: object = None
+
+
+class HedgePolicy:
+    """
+    单个主部署的对冲延迟和统计
+
+    延迟取最近 TTFT 的指定百分位（样本不足时用固定值），
+    百分位越高对冲越少，成本越低
+    """
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self._ttfts = deque(maxlen=window)
+        self.requests = 0
+        self.fired = 0
+        self.secondary_wins = 0
+
+    def delay(self, fixed_delay, adaptive_percentile=None, min_samples=20):
+        with self._lock:
+            samples = list(self._ttfts)
+        if adaptive_percentile and len(samples) >= min_samples:
+            return percentile(samples, adaptive_percentile)
+        return fixed_delay
+
+    def observe(self, ttft, fired, winner_index):
+        """ttft 为主部署的首个输出时间，未知（备用胜出）时传 None"""
+        with self._lock:
+            if ttft is not None:
+                self._ttfts.append(ttft)
+            self.requests += 1
+            self.fired += fired
+            self.secondary_wins += winner_index == 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "fired": self.fired,
+                "hedge_rate": self.fired / self.requests if self.requests else 0.0,
+                "secondary_wins": self.secondary_wins,
+                "samples": len(self._ttfts),
+            }
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_hedge_policy(endpoint, model):
+    """按主部署 (endpoint, model) 共享"""
+    key = (endpoint.rstrip('/'), model)
+    with _policies_lock:
+        policy = _policies.get(key)
+        if policy is None:
+            policy = _policies[key] = HedgePolicy()
+        return policy
+
+
+class _Leg:
+    """一路请求：工作线程发起流式请求，事件放入共享队列"""
+
+    def __init__(self, index, target, events):
+        self.index = index
+        self.target = target
+        self.events = events
+        self.stream = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True, name=f"hedge-{self.index}").start()
+
+    def _run(self):
+        try:
+            stream = create_stream(self.target.client, self.target.request, self.target.limiter)
+            with self._lock:
+                self.stream = stream
+            if self._cancel.is_set():
+                return
+            for event in stream:
+                if self._cancel.is_set():
+                    return
+                self.events.put((self, event))
+        except Exception as e:
+            if not self._cancel.is_set():
+                self.events.put((self, e))
+        finally:
+            self._close()
+            self.events.put((self, _DONE))
+
+    def _close(self):
+        with self._lock:
+            stream = self.stream
+        if stream is not None:
+            abort_stream(stream)
+
+    def cancel(self):
+        self._cancel.set()
+        self._close()
+
+
+class HedgedStream:
+    """
+    与 SDK 流同形的可迭代对象
+
+    - 主部署在 delay 秒内没有开始输出（或已失败）时发起备用请求
+    - 先开始输出的一路胜出，之前缓冲的事件按原顺序产出，另一路立即关闭
+    - close() 取消所有请求
+    """
+
+    def __init__(self, primary, secondary, delay, policy=None):
+        self.targets = [primary, secondary]
+        self.delay = delay
+        self.policy = policy
+        self.fired = False
+        self.winner = None
+        self._events = queue.Queue()
+        self._legs = []
+        self._closed = False
+
+    def _fire(self, index):
+        leg = _Leg(index, self.targets[index], self._events)
+        self._legs.append(leg)
+        leg.start()
+        if index == 1:
+            self.fired = True
+
+    def __iter__(self):
+        start = time.perf_counter()
+        self._fire(0)
+        buffers = {0: [], 1: []}
+        finished = set()
+        error = None
+
+        # 竞速阶段：等待某一路开始输出
+        while self.winner is None:
+            timeout = None
+            if not self.fired:
+                timeout = max(start + self.delay - time.perf_counter(), 0)
+            try:
+                leg, item = self._events.get(timeout=timeout)
+            except queue.Empty:
+                self._fire(1)
+                continue
+
+            if item is _DONE:
+                finished.add(leg.index)
+                if not self.fired and not self._closed:
+                    # 主部署未输出就失败或结束，立即改发备用部署
+                    self._fire(1)
+                elif len(finished) == len(self._legs):
+                    if error is not None:
+                        raise error
+                    return
+                continue
+            if isinstance(item, Exception):
+                error = item
+                continue
+
+            buffers[leg.index].append(item)
+            if item.type in FIRST_OUTPUT_EVENTS:
+                self.winner = self.targets[leg.index]
+                winner_leg = leg
+                for other in self._legs:
+                    if other is not leg:
+                        other.cancel()
+
+        if self.policy is not None:
+            # 只记录主部署自己的首个输出时间；备用胜出时主部署的 TTFT 未知，不作为样本
+            primary_ttft = time.perf_counter() - start if winner_leg.index == 0 else None
+            self.policy.observe(primary_ttft, self.fired, winner_leg.index)
+
+        yield from buffers[winner_leg.index]
+        while True:
+            leg, item = self._events.get()
+            if leg is not winner_leg:
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        self._closed = True
+        for leg in self._legs:
+            leg.cancel()
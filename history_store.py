@@ -0,0 +1,209 @@
+"""
+对话历史存储
+会话内只保留文本、缩略图和内容哈希；原图、编码后的 data URL 按哈希写入磁盘，用到时再读取。
+会话超过内存上限时，从最早的消息开始把缩略图和文本也移到磁盘
+"""
+
+import hashlib
+import json
+import os
+import threading
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+# 磁盘存储目录（按内容寻址，所有会话共用）
+HISTORY_DIR = Path(".history_store")
+
+# 缩略图参数
+THUMBNAIL_SIDE = 320
+THUMBNAIL_QUALITY = 70
+
+# 默认每会话内存上限
+DEFAULT_SESSION_CAP = 8 * 1024 * 1024
+
+# 最近的几条消息始终留在内存
+KEEP_RECENT = 2
+
+
+class BlobStore:
+    """按 sha256 寻址的磁盘存储，按最近使用时间淘汰"""
+
+    def __init__(self, directory=HISTORY_DIR, max_disk_bytes=1024 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
+
+    def put(self, data):
+        """写入 bytes，返回哈希；已存在时只更新 mtime"""
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if path.exists():
+            os.utime(path)
+            return key
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        # 每写入一批检查一次磁盘占用，避免每次都遍历目录
+        with self._lock:
+            self._puts += 1
+            check = self._puts % 32 == 1
+        if check:
+            self._evict_disk()
+        return key
+
+    def get(self, key):
+        """读取 bytes；已被淘汰时返回 None"""
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_text(self, text):
+        return self.put(text.encode('utf-8'))
+
+    def get_text(self, key):
+        data = self.get(key)
+        return None if data is None else data.decode('utf-8')
+
+    def _evict_disk(self):
+        files = []
+        for path in self.directory.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+_store = BlobStore()
+
+
+def get_blob_store():
+    """进程级单例"""
+    return _store
+
+
+def make_thumbnail(raw_bytes, side=THUMBNAIL_SIDE):
+    """生成 JPEG 缩略图（bytes）"""
+    with Image.open(BytesIO(raw_bytes)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((side, side))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+        return output.getvalue()
+
+
+def message_size(message):
+    """消息在会话内存中的大致字节数"""
+    size = len(message.get("text", "").encode('utf-8'))
+    size += len(message.get("image_thumb") or b"")
+    rest = {
+        k: v for k, v in message.items()
+        if k not in ("text", "image_thumb", "size")
+    }
+    return size + len(json.dumps(rest, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+def compact_image(message, raw_bytes, data_url):
+    """原图和 data URL 写入磁盘，消息中只留哈希和缩略图"""
+    store = get_blob_store()
+    message["image_hash"] = store.put(raw_bytes)
+    message["image_url_ref"] = store.put_text(data_url)
+    message["image_thumb"] = make_thumbnail(raw_bytes)
+    return message
+
+
+def thumbnail(message):
+    """消息的缩略图；已移到磁盘时从原图重新生成（原图也被淘汰时返回 None）"""
+    if message.get("image_thumb"):
+        return message["image_thumb"]
+    raw_bytes = get_blob_store().get(message["image_hash"])
+    return None if raw_bytes is None else make_thumbnail(raw_bytes)
+
+
+def message_text(message):
+    """消息文本（可能已移到磁盘）"""
+    if "text_ref" in message:
+        return get_blob_store().get_text(message["text_ref"]) or ""
+    return message.get("text", "")
+
+
+def resolve_message(message):
+    """还原构造请求需要的字段（text、image_url），返回新 dict"""
+    if "text_ref" not in message and "image_url_ref" not in message:
+        return message
+    resolved = dict(message)
+    if "text_ref" in message:
+        resolved["text"] = message_text(message)
+    if "image_url_ref" in message:
+        image_url = get_blob_store().get_text(message["image_url_ref"])
+        if image_url is not None:
+            resolved["image_url"] = image_url
+    return resolved
+
+
+def resolve_messages(messages):
+    return [resolve_message(message) for message in messages]
+
+
+def append_message(messages, message, cap=DEFAULT_SESSION_CAP):
+    """追加消息并记录大小；超过上限时把较早消息的缩略图和文本移到磁盘"""
+    message["size"] = message_size(message)
+    messages.append(message)
+    enforce_cap(messages, cap)
+    return message
+
+
+def session_size(messages):
+    return sum(message.get("size", 0) for message in messages)
+
+
+def enforce_cap(messages, cap=DEFAULT_SESSION_CAP):
+    """从最早的消息开始移出缩略图，仍超限再移出文本；返回移出的条数"""
+    total = session_size(messages)
+    spilled = 0
+    store = get_blob_store()
+    for field in ("image_thumb", "text"):
+        for message in messages[:-KEEP_RECENT]:
+            if total <= cap:
+                return spilled
+            if field == "image_thumb" and message.get("image_thumb"):
+                message["image_thumb"] = None
+            elif field == "text" and message.get("text"):
+                message["text_ref"] = store.put_text(message.pop("text"))
+            else:
+                continue
+            total -= message["size"]
+            message["size"] = message_size(message)
+            total += message["size"]
+            spilled += 1
+    return spilled
+
+
+def spilled_count(messages):
+    """已移到磁盘的消息数"""
+    return sum(
+        1 for message in messages
+        if "text_ref" in message or ("image_hash" in message and not message.get("image_thumb"))
+    )
@@ -0,0 +1,233 @@
+"""
+图片预处理
+按模型的视觉 token 预算缩放、按内容选择格式，并按内容哈希缓存 data URL
+"""
+
+import base64
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# 图片细节级别
+DETAIL_LEVELS = ["auto", "low", "high", "original"]
+
+# 按 32px patch 计费的模型（其余按 512px tile 计费）
+PATCH_MODELS = ("gpt-4.1-mini", "gpt-4.1-nano", "o4-mini")
+PATCH_SIZE = 32
+MAX_PATCHES = 1536
+
+# tile 计费参数
+TILE_SIZE = 512
+HIGH_MAX_SIDE = 2048
+HIGH_SHORT_SIDE = 768
+LOW_MAX_SIDE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+JPEG_QUALITY = 85
+
+
+@dataclass
+class EncodedImage:
+    """编码结果及统计"""
+    data_url: str
+    content_hash: str
+    original_bytes: int
+    sent_bytes: int
+    original_size: tuple
+    sent_size: tuple
+    format: str
+    estimated_tokens: int
+    encode_ms: float
+    cache_hit: bool = False
+
+
+def _uses_patches(model):
+    return any(model.startswith(prefix) for prefix in PATCH_MODELS)
+
+
+def target_size(width, height, detail="auto", model=""):
+    """计算缩放后的尺寸（只缩小不放大）"""
+    if detail == "original":
+        return width, height
+
+    if _uses_patches(model):
+        patches = math.ceil(width / PATCH_SIZE) * math.ceil(height / PATCH_SIZE)
+        if patches <= MAX_PATCHES:
+            return width, height
+        scale = math.sqrt(MAX_PATCHES * PATCH_SIZE * PATCH_SIZE / (width * height))
+        # 保证缩放后 patch 数不超过预算
+        while math.ceil(width * scale / PATCH_SIZE) * math.ceil(height * scale / PATCH_SIZE) > MAX_PATCHES:
+            scale *= 0.98
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    if detail == "low":
+        scale = min(1.0, LOW_MAX_SIDE / max(width, height))
+    else:
+        # 先限制在 2048x2048 内，再把短边缩到 768
+        scale = min(1.0, HIGH_MAX_SIDE / max(width, height))
+        scale = min(scale, HIGH_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_tokens(width, height, detail="auto", model=""):
+    """估算图片的 input token 数（基于缩放后的尺寸）"""
+    if _uses_patches(model):
+        return math.ceil(width / PATCH_SIZE) * math.ceil(height / PATCH_SIZE)
+    if detail == "low":
+        return BASE_TOKENS
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return BASE_TOKENS + TILE_TOKENS * tiles
+
+
+def _has_alpha(image):
+    if image.mode in ('RGBA', 'LA', 'PA'):
+        return image.convert('RGBA').getchannel('A').getextrema()[0] < 255
+    if image.mode == 'P':
+        return 'transparency' in image.info
+    return False
+
+
+def _is_graphic(image):
+    """颜色数很少时视为截图/图表，PNG 更小更清晰"""
+    sample = image.convert('RGB')
+    # 最近邻采样不会产生新颜色，只用于减少扫描量
+    sample.thumbnail((256, 256), Image.NEAREST)
+    return sample.getcolors(maxcolors=256) is not None
+
+
+def _normalize(image, keep_alpha):
+    """统一转换为 RGB / RGBA / L，兼容所有 PIL 模式"""
+    if keep_alpha:
+        return image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA', 'PA', 'P'):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    if image.mode in ('L', 'RGB'):
+        return image
+    if image.mode in ('1', 'I', 'I;16', 'F'):
+        return image.convert('L')
+    # CMYK / YCbCr / LAB / HSV 等
+    return image.convert('RGB')
+
+
+def preprocess_image(raw_bytes, detail="auto", model="", content_hash=None):
+    """解码、缩放并重新编码图片，返回 EncodedImage"""
+    start = time.perf_counter()
+    if content_hash is None:
+        content_hash = hashlib.sha256(raw_bytes).hexdigest()
+
+    image = Image.open(BytesIO(raw_bytes))
+    image = ImageOps.exif_transpose(image)
+    original_size = image.size
+
+    keep_alpha = _has_alpha(image)
+    graphic = keep_alpha or _is_graphic(image)
+    image = _normalize(image, keep_alpha)
+
+    size = target_size(image.width, image.height, detail, model)
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS)
+
+    buffered = BytesIO()
+    if graphic:
+        image.save(buffered, format="PNG", optimize=True)
+        mime = "png"
+    else:
+        image.save(buffered, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        mime = "jpeg"
+    img_bytes = buffered.getvalue()
+
+    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
+    return EncodedImage(
+        data_url=f"data:image/{mime};base64,{img_base64}",
+        content_hash=content_hash,
+        original_bytes=len(raw_bytes),
+        sent_bytes=len(img_bytes),
+        original_size=original_size,
+        sent_size=image.size,
+        format=mime,
+        estimated_tokens=estimate_tokens(image.width, image.height, detail, model),
+        encode_ms=(time.perf_counter() - start) * 1000,
+    )
+
+
+class ImageCache:
+    """按内容哈希缓存编码结果，LRU，按总字节数限制"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, key, item):
+        size = len(item.data_url)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.data_url)
+            self._items[key] = item
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted.data_url)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_cache = ImageCache()
+
+
+def get_image_cache():
+    """进程级单例"""
+    return _cache
+
+
+def encode_image_cached(raw_bytes, detail="auto", model=""):
+    """带缓存的 preprocess_image；命中时不再解码和编码"""
+    start = time.perf_counter()
+    content_hash = hashlib.sha256(raw_bytes).hexdigest()
+    key = (content_hash, detail, _uses_patches(model))
+
+    cached = _cache.get(key)
+    if cached is not None:
+        return replace(
+            cached,
+            cache_hit=True,
+            encode_ms=(time.perf_counter() - start) * 1000,
+        )
+
+    encoded = preprocess_image(raw_bytes, detail, model, content_hash)
+    encoded.encode_ms = (time.perf_counter() - start) * 1000
+    _cache.put(key, encoded)
+    return encoded
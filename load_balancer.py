@@ -0,0 +1,240 @@
+"""
+多部署负载均衡
+按权重、TTFT 和错误率的指数滑动平均（EWMA）选择部署；429 / 5xx / 连接错误触发熔断，冷却后半开探测
+聊天页面、基准测试、批量请求共用
+"""
+
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+from config_store import get_section
+
+# 视为部署故障的状态码（其余 4xx 是请求本身的问题）
+FAILURE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# 熔断状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass(frozen=True)
+class Deployment:
+    """一个可路由的部署"""
+    name: str
+    endpoint: str
+    api_key: str
+    model: str
+    weight: float = 1.0
+
+
+def is_endpoint_failure(error):
+    """是否应计入熔断（部署不可用，而不是请求有误）"""
+    if isinstance(error, APIStatusError):
+        return error.status_code in FAILURE_STATUS
+    return isinstance(error, (APIConnectionError, APITimeoutError))
+
+
+def _retry_after(error):
+    if not isinstance(error, APIStatusError):
+        return 0.0
+    headers = error.response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return 0.0
+
+
+class _Health:
+    """单个部署的健康状态"""
+
+    def __init__(self):
+        self.state = CLOSED
+        self.ewma_ttft = None
+        self.ewma_error = 0.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.open_seconds = 0.0
+        self.retry_at = 0.0
+        self.probing = False
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+
+
+class LoadBalancer:
+    """
+    部署池
+
+    - pick() 用带权重的“二选一”（power of two choices）：按权重抽两个可用部署，取得分低的
+    - 得分 = EWMA TTFT × (1 + 在途数) × (1 + 4 × EWMA 错误率) / 权重；没有样本的部署优先试探
+    - 连续失败达到阈值（或收到带 Retry-After 的 429）时熔断，冷却后只放行一个探测请求，
+      探测成功恢复，失败则冷却时间加倍
+    - 没有可用部署时选最早结束冷却的一个，不直接拒绝
+    """
+
+    def __init__(self, deployments, alpha=0.2, failure_threshold=3,
+                 open_seconds=10.0, max_open_seconds=300.0):
+        self.deployments = list(deployments)
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self._lock = threading.Lock()
+        self._health = {deployment.name: _Health() for deployment in self.deployments}
+
+    def configure(self, deployments):
+        """更新部署列表（权重、key 等），保留已有的健康状态"""
+        with self._lock:
+            self.deployments = list(deployments)
+            for deployment in self.deployments:
+                self._health.setdefault(deployment.name, _Health())
+
+    def _available(self, health, now):
+        if health.state == OPEN and now >= health.retry_at:
+            health.state = HALF_OPEN
+        if health.state == HALF_OPEN:
+            return not health.probing
+        return health.state == CLOSED
+
+    def _score(self, deployment, health):
+        ttft = health.ewma_ttft if health.ewma_ttft is not None else 0.0
+        return (
+            (ttft + 0.05) * (1 + health.in_flight) * (1 + 4 * health.ewma_error)
+            / max(deployment.weight, 1e-6)
+        )
+
+    def pick(self, prefer=None):
+        """选择部署并计入在途；prefer 可用时优先（链式对话需要同一部署）"""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [d for d in self.deployments if self._available(self._health[d.name], now)]
+            preferred = [d for d in candidates if d.name == prefer]
+            if preferred:
+                chosen = preferred[0]
+            elif not candidates:
+                chosen = min(self.deployments, key=lambda d: self._health[d.name].retry_at)
+            elif len(candidates) == 1:
+                chosen = candidates[0]
+            else:
+                weights = [d.weight for d in candidates]
+                first, second = random.choices(candidates, weights=weights, k=2)
+                chosen = min(
+                    (first, second), key=lambda d: self._score(d, self._health[d.name])
+                )
+
+            health = self._health[chosen.name]
+            if health.state != CLOSED:
+                health.probing = True
+            health.in_flight += 1
+            health.requests += 1
+            return chosen
+
+    def report(self, deployment, ttft=None, error=None):
+        """请求结束：更新 EWMA 和熔断状态（每次 pick 对应一次 report）"""
+        failed = error is not None and is_endpoint_failure(error)
+        with self._lock:
+            health = self._health[deployment.name]
+            health.in_flight = max(health.in_flight - 1, 0)
+            was_probe = health.probing and health.state != CLOSED
+            health.probing = False
+            health.ewma_error += self.alpha * ((1.0 if failed else 0.0) - health.ewma_error)
+
+            if not failed:
+                if ttft:
+                    health.ewma_ttft = ttft if health.ewma_ttft is None else \
+                        health.ewma_ttft + self.alpha * (ttft - health.ewma_ttft)
+                health.consecutive_failures = 0
+                if health.state != CLOSED:
+                    health.state = CLOSED
+                    health.open_seconds = 0.0
+                return
+
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.last_error = f"{type(error).__name__}: {error}"[:200]
+            retry_after = _retry_after(error)
+            if was_probe or retry_after or health.consecutive_failures >= self.failure_threshold:
+                health.open_seconds = min(
+                    health.open_seconds * 2 if was_probe else self.base_open_seconds,
+                    self.max_open_seconds
+                )
+                health.state = OPEN
+                health.retry_at = time.monotonic() + max(health.open_seconds, retry_after)
+
+    def stats(self):
+        """每个部署一行"""
+        with self._lock:
+            now = time.monotonic()
+            rows = []
+            for deployment in self.deployments:
+                health = self._health[deployment.name]
+                self._available(health, now)
+                rows.append({
+                    "name": deployment.name,
+                    "endpoint": deployment.endpoint,
+                    "model": deployment.model,
+                    "weight": deployment.weight,
+                    "state": health.state,
+                    "in_flight": health.in_flight,
+                    "ewma_ttft": health.ewma_ttft,
+                    "error_rate": health.ewma_error,
+                    "requests": health.requests,
+                    "failures": health.failures,
+                    "retry_in": max(health.retry_at - now, 0.0) if health.state == OPEN else 0.0,
+                    "last_error": health.last_error,
+                })
+            return rows
+
+
+_balancers = {}
+_balancers_lock = threading.Lock()
+
+
+def get_balancer(deployments):
+    """同一组部署（按名称、endpoint、模型）在进程内共享健康状态"""
+    key = tuple(sorted((d.name, d.endpoint.rstrip('/'), d.model) for d in deployments))
+    with _balancers_lock:
+        balancer = _balancers.get(key)
+        if balancer is None:
+            balancer = _balancers[key] = LoadBalancer(deployments)
+            return balancer
+    if balancer.deployments != list(deployments):
+        balancer.configure(deployments)
+    return balancer
+
+
+def deployments_from_config(config, weights):
+    """weights: {配置名: 权重}，按命名配置的 chat 部分构造部署列表（跳过不完整的配置）"""
+    deployments = []
+    for name, weight in weights.items():
+        chat = get_section(config, 'chat', name)
+        if chat.get('endpoint') and chat.get('api_key'):
+            deployments.append(Deployment(
+                name=name,
+                endpoint=chat['endpoint'],
+                api_key=chat['api_key'],
+                model=chat.get('model', 'gpt-4o'),
+                weight=float(weight),
+            ))
+    return deployments
+
+
+def parse_weights(spec):
+    """命令行参数 "eastus:2,westus" → {"eastus": 2.0, "westus": 1.0}"""
+    weights = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition(":")
+        weights[name] = float(weight) if weight else 1.0
+    return weights
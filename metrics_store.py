@@ -0,0 +1,512 @@
+"""
+指标持久化
+每轮请求的指标写入本地 SQLite（后台批量写入），并维护按分钟的预聚合和延迟直方图
+"""
+
+import math
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from stream_metrics import percentile
+
+METRICS_DB = Path("metrics.db")
+
+# 直方图分桶：毫秒值按 1.08 的对数分桶，相对误差约 4%
+HIST_BASE = 1.08
+HIST_METRICS = ("ttft", "total_duration")
+
+COLUMNS = (
+    "ts", "source", "endpoint", "model", "reasoning_effort", "image_bytes",
+    "ttft", "total_duration", "input_tokens", "output_tokens", "reasoning_tokens",
+    "total_tokens", "error_class", "preset", "cached_tokens",
+)
+
+# Realtime 建连阶段（毫秒）
+SETUP_PHASES = (
+    "mic_ms", "offer_ms", "ice_gather_ms", "sdp_ms", "remote_ms", "ice_ms", "channel_ms",
+)
+SETUP_COLUMNS = (
+    "ts", "endpoint", "deployment", "region", "prewarmed",
+    *SETUP_PHASES, "click_to_ready_ms", "error", "preset",
+)
+
+# 后来新增的列：旧数据库在 connect() 时补上
+ADDED_COLUMNS = (
+    ("turns", "preset", "TEXT"),
+    ("realtime_setup", "preset", "TEXT"),
+    ("turns", "cached_tokens", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    source TEXT NOT NULL DEFAULT 'chat',
+    endpoint TEXT NOT NULL,
+    model TEXT NOT NULL,
+    reasoning_effort TEXT NOT NULL DEFAULT 'none',
+    image_bytes INTEGER NOT NULL DEFAULT 0,
+    ttft REAL,
+    total_duration REAL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    reasoning_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    error_class TEXT,
+    preset TEXT,
+    cached_tokens INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_turns_ts ON turns (ts);
+CREATE INDEX IF NOT EXISTS idx_turns_deployment_ts ON turns (endpoint, model, ts);
+
+CREATE TABLE IF NOT EXISTS realtime_setup (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    endpoint TEXT NOT NULL,
+    deployment TEXT NOT NULL,
+    region TEXT NOT NULL DEFAULT '',
+    prewarmed INTEGER NOT NULL DEFAULT 0,
+    mic_ms REAL,
+    offer_ms REAL,
+    ice_gather_ms REAL,
+    sdp_ms REAL,
+    remote_ms REAL,
+    ice_ms REAL,
+    channel_ms REAL,
+    click_to_ready_ms REAL,
+    error TEXT,
+    preset TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_realtime_setup_ts ON realtime_setup (ts);
+"""
+
+# 预聚合和直方图按 (分钟桶, source, endpoint, model, reasoning_effort) 分组，
+# 聊天和 Realtime 的 TTFT 含义不同，不能合并
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_minute (
+    bucket INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    model TEXT NOT NULL,
+    reasoning_effort TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    ttft_sum REAL NOT NULL,
+    duration_sum REAL NOT NULL,
+    tokens_sum INTEGER NOT NULL,
+    PRIMARY KEY (bucket, source, endpoint, model, reasoning_effort)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS hist_minute (
+    bucket INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    model TEXT NOT NULL,
+    reasoning_effort TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    bin INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (metric, bucket, source, endpoint, model, reasoning_effort, bin)
+) WITHOUT ROWID;
+"""
+
+
+def value_to_bin(seconds):
+    """秒 → 直方图分桶编号"""
+    ms = max(seconds * 1000, 1.0)
+    return int(math.floor(math.log(ms, HIST_BASE)))
+
+
+def bin_to_value(bin_index):
+    """分桶编号 → 桶中点（秒）"""
+    return HIST_BASE ** (bin_index + 0.5) / 1000
+
+
+def connect(path=METRICS_DB):
+    conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    for table, column, declaration in ADDED_COLUMNS:
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    _migrate_rollups(conn)
+    conn.executescript(ROLLUP_SCHEMA)
+    return conn
+
+
+def _migrate_rollups(conn):
+    """旧版预聚合的主键不含 source（Realtime 和聊天混在一起）：删除后按 turns 原始记录重建"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(rollup_minute)")}
+    if not existing or "source" in existing:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # 其他进程可能已经迁移过
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(rollup_minute)")}
+        if "source" not in existing:
+            conn.execute("DROP TABLE rollup_minute")
+            conn.execute("DROP TABLE IF EXISTS hist_minute")
+            for statement in ROLLUP_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            cursor = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM turns")
+            while True:
+                rows = [dict(zip(COLUMNS, row)) for row in cursor.fetchmany(5000)]
+                if not rows:
+                    break
+                _upsert_rollups(conn, *_aggregate(rows))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _aggregate(rows):
+    """turns 行（dict）→ 预聚合和直方图增量"""
+    rollups = defaultdict(lambda: [0, 0, 0.0, 0.0, 0])
+    hists = defaultdict(int)
+    for row in rows:
+        bucket = int(row["ts"] // 60)
+        key = (bucket, row["source"], row["endpoint"], row["model"], row["reasoning_effort"])
+        rollup = rollups[key]
+        rollup[0] += 1
+        if row["error_class"]:
+            rollup[1] += 1
+            continue
+        rollup[2] += row["ttft"] or 0.0
+        rollup[3] += row["total_duration"] or 0.0
+        rollup[4] += row["total_tokens"]
+        for metric in HIST_METRICS:
+            if row[metric]:
+                hists[(metric, *key, value_to_bin(row[metric]))] += 1
+    return rollups, hists
+
+
+def _upsert_rollups(conn, rollups, hists):
+    conn.executemany(
+        """
+        INSERT INTO rollup_minute VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (bucket, source, endpoint, model, reasoning_effort) DO UPDATE SET
+            requests = requests + excluded.requests,
+            errors = errors + excluded.errors,
+            ttft_sum = ttft_sum + excluded.ttft_sum,
+            duration_sum = duration_sum + excluded.duration_sum,
+            tokens_sum = tokens_sum + excluded.tokens_sum
+        """,
+        [(*key, *values) for key, values in rollups.items()]
+    )
+    conn.executemany(
+        """
+        INSERT INTO hist_minute (metric, bucket, source, endpoint, model, reasoning_effort, bin, count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (metric, bucket, source, endpoint, model, reasoning_effort, bin) DO UPDATE SET
+            count = count + excluded.count
+        """,
+        [(*key, count) for key, count in hists.items()]
+    )
+
+
+class MetricsWriter:
+    """后台线程批量写入，record() 只入队，不阻塞请求路径"""
+
+    def __init__(self, path=METRICS_DB, batch_size=200, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="metrics-writer")
+        self._thread.start()
+
+    def record(self, **fields):
+        fields.setdefault("ts", time.time())
+        self._queue.put(fields)
+
+    def flush(self, timeout=5.0):
+        """等待队列写完（测试或退出前调用）"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _run(self):
+        conn = connect(self.path)
+        while True:
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._write(conn, batch)
+                except sqlite3.Error:
+                    conn.rollback()
+            for waiter in waiters:
+                waiter.set()
+
+    @staticmethod
+    def _write(conn, batch):
+        rows = []
+        turns = []
+        setup_rows = []
+        for record in batch:
+            if record.get("_table") == "realtime_setup":
+                setup_row = {column: record.get(column) for column in SETUP_COLUMNS}
+                setup_row["region"] = setup_row["region"] or ""
+                setup_row["prewarmed"] = int(bool(setup_row["prewarmed"]))
+                setup_rows.append(tuple(setup_row[column] for column in SETUP_COLUMNS))
+                continue
+            row = {column: record.get(column) for column in COLUMNS}
+            row["source"] = row["source"] or "chat"
+            row["reasoning_effort"] = row["reasoning_effort"] or "none"
+            for column in ("image_bytes", "input_tokens", "cached_tokens", "output_tokens",
+                           "reasoning_tokens", "total_tokens"):
+                row[column] = row[column] or 0
+            rows.append(tuple(row[column] for column in COLUMNS))
+            turns.append(row)
+
+        with conn:
+            conn.executemany(
+                f"INSERT INTO turns ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+            _upsert_rollups(conn, *_aggregate(turns))
+            conn.executemany(
+                f"INSERT INTO realtime_setup ({', '.join(SETUP_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(SETUP_COLUMNS))})",
+                setup_rows
+            )
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """进程级单例"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MetricsWriter()
+        return _writer
+
+
+def record_turn(**fields):
+    """记录一轮请求的指标"""
+    get_writer().record(**fields)
+
+
+def record_realtime_setup(**fields):
+    """记录一次 Realtime 建连的阶段耗时（毫秒）"""
+    get_writer().record(_table="realtime_setup", **fields)
+
+
+# ---------- 查询 ----------
+
+def _filters(start, end, sources=None, endpoints=None, models=None, efforts=None):
+    """按分钟桶过滤的 WHERE 子句"""
+    clauses = ["bucket >= ?", "bucket <= ?"]
+    params = [int(start // 60), int(end // 60)]
+    for column, values in (
+        ("source", sources), ("endpoint", endpoints), ("model", models), ("reasoning_effort", efforts)
+    ):
+        if values:
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    return " AND ".join(clauses), params
+
+
+def list_dimensions(conn):
+    """已有的 source / endpoint / model / reasoning_effort 取值"""
+    return {
+        column: [row[0] for row in conn.execute(
+            f"SELECT DISTINCT {column} FROM rollup_minute ORDER BY 1"
+        )]
+        for column in ("source", "endpoint", "model", "reasoning_effort")
+    }
+
+
+def query_timeseries(conn, start, end, bucket_minutes=1, **filters):
+    """按时间桶聚合：请求数、错误数、平均 TTFT / 总时长、tokens"""
+    where, params = _filters(start, end, **filters)
+    rows = conn.execute(
+        f"""
+        SELECT (bucket / ?) * ? * 60 AS ts,
+               SUM(requests), SUM(errors),
+               SUM(ttft_sum) / MAX(SUM(requests) - SUM(errors), 1),
+               SUM(duration_sum) / MAX(SUM(requests) - SUM(errors), 1),
+               SUM(tokens_sum)
+        FROM rollup_minute WHERE {where}
+        GROUP BY 1 ORDER BY 1
+        """,
+        [bucket_minutes, bucket_minutes, *params]
+    ).fetchall()
+    return [
+        {
+            "ts": ts, "requests": requests, "errors": errors,
+            "ttft": ttft, "total_duration": duration, "tokens": tokens,
+        }
+        for ts, requests, errors, ttft, duration, tokens in rows
+    ]
+
+
+def query_histogram(conn, start, end, metric="ttft", **filters):
+    """返回 [(桶中点秒数, 次数)]"""
+    where, params = _filters(start, end, **filters)
+    rows = conn.execute(
+        f"""
+        SELECT bin, SUM(count) FROM hist_minute
+        WHERE metric = ? AND {where}
+        GROUP BY bin ORDER BY bin
+        """,
+        [metric, *params]
+    ).fetchall()
+    return [(bin_to_value(bin_index), count) for bin_index, count in rows]
+
+
+def histogram_percentile(histogram, p):
+    """由直方图估算百分位数"""
+    total = sum(count for _, count in histogram)
+    if total == 0:
+        return 0.0
+    target = total * p / 100
+    seen = 0
+    for value, count in histogram:
+        seen += count
+        if seen >= target:
+            return value
+    return histogram[-1][0]
+
+
+def query_comparison(conn, start, end, **filters):
+    """按来源和部署（endpoint + model + reasoning_effort）对比"""
+    where, params = _filters(start, end, **filters)
+    rows = conn.execute(
+        f"""
+        SELECT source, endpoint, model, reasoning_effort,
+               SUM(requests), SUM(errors),
+               SUM(ttft_sum) / MAX(SUM(requests) - SUM(errors), 1),
+               SUM(duration_sum) / MAX(SUM(requests) - SUM(errors), 1),
+               SUM(tokens_sum)
+        FROM rollup_minute WHERE {where}
+        GROUP BY source, endpoint, model, reasoning_effort
+        ORDER BY 5 DESC
+        """,
+        params
+    ).fetchall()
+
+    hist_rows = conn.execute(
+        f"""
+        SELECT source, endpoint, model, reasoning_effort, bin, SUM(count) FROM hist_minute
+        WHERE metric = 'ttft' AND {where}
+        GROUP BY source, endpoint, model, reasoning_effort, bin
+        ORDER BY bin
+        """,
+        params
+    ).fetchall()
+    histograms = defaultdict(list)
+    for source, endpoint, model, effort, bin_index, count in hist_rows:
+        histograms[(source, endpoint, model, effort)].append((bin_to_value(bin_index), count))
+
+    result = []
+    for source, endpoint, model, effort, requests, errors, ttft, duration, tokens in rows:
+        histogram = histograms[(source, endpoint, model, effort)]
+        result.append({
+            "source": source,
+            "endpoint": endpoint,
+            "model": model,
+            "reasoning_effort": effort,
+            "requests": requests,
+            "error_rate": errors / requests if requests else 0.0,
+            "ttft_mean": ttft,
+            "ttft_p50": histogram_percentile(histogram, 50),
+            "ttft_p90": histogram_percentile(histogram, 90),
+            "ttft_p99": histogram_percentile(histogram, 99),
+            "duration_mean": duration,
+            "tokens": tokens,
+        })
+    return result
+
+
+def query_recent(conn, start, end, limit=200):
+    """最近的原始记录（走 ts 索引）"""
+    cursor = conn.execute(
+        f"SELECT {', '.join(COLUMNS)} FROM turns WHERE ts >= ? AND ts <= ? ORDER BY ts DESC LIMIT ?",
+        (start, end, limit)
+    )
+    return [dict(zip(COLUMNS, row)) for row in cursor]
+
+
+def query_realtime_setup(conn, start, end):
+    """按部署、区域、是否预热汇总点击到就绪的耗时（毫秒）和各阶段中位数"""
+    rows = conn.execute(
+        f"SELECT {', '.join(SETUP_COLUMNS)} FROM realtime_setup WHERE ts >= ? AND ts <= ?",
+        (start, end)
+    ).fetchall()
+    groups = defaultdict(list)
+    for row in rows:
+        record = dict(zip(SETUP_COLUMNS, row))
+        groups[(record["endpoint"], record["deployment"], record["region"], record["prewarmed"])].append(record)
+
+    result = []
+    for (endpoint, deployment, region, prewarmed), records in sorted(groups.items()):
+        ok = [r for r in records if not r["error"]]
+        ready = [r["click_to_ready_ms"] for r in ok if r["click_to_ready_ms"] is not None]
+        item = {
+            "endpoint": endpoint,
+            "deployment": deployment,
+            "region": region,
+            "prewarmed": bool(prewarmed),
+            "sessions": len(records),
+            "error_rate": 1 - len(ok) / len(records),
+            "ready_p50": percentile(ready, 50),
+            "ready_p90": percentile(ready, 90),
+            "ready_p99": percentile(ready, 99),
+        }
+        for phase in SETUP_PHASES:
+            item[phase] = percentile([r[phase] for r in ok if r[phase] is not None], 50)
+        result.append(item)
+    return result
+
+
+def query_realtime_turns(conn, start, end):
+    """Realtime 每轮延迟按部署和会话预设汇总（秒）"""
+    rows = conn.execute(
+        """
+        SELECT endpoint, model, COALESCE(preset, ''), ttft, total_duration, error_class
+        FROM turns WHERE source = 'realtime' AND ts >= ? AND ts <= ?
+        """,
+        (start, end)
+    ).fetchall()
+    groups = defaultdict(list)
+    for endpoint, model, preset, ttft, duration, error_class in rows:
+        groups[(endpoint, model, preset)].append((ttft, duration, error_class))
+
+    result = []
+    for (endpoint, model, preset), records in sorted(groups.items()):
+        ok = [(ttft, duration) for ttft, duration, error_class in records if not error_class]
+        first_audio = [ttft for ttft, _ in ok if ttft is not None]
+        audio_done = [duration for _, duration in ok if duration is not None]
+        result.append({
+            "endpoint": endpoint,
+            "deployment": model,
+            "preset": preset,
+            "turns": len(records),
+            "interrupted_rate": 1 - len(ok) / len(records),
+            "first_audio_p50": percentile(first_audio, 50),
+            "first_audio_p90": percentile(first_audio, 90),
+            "audio_done_p50": percentile(audio_done, 50),
+        })
+    return result
@@ -0,0 +1,618 @@
+"""
+本地模拟服务
+模拟 Responses API 流式事件和 Realtime SDP 接口，用于离线、可复现的压测
+
+用法：
+    python mock_server.py --port 8765 --ttft 0.3 --tokens-per-sec 60
+
+然后把聊天页面的 Endpoint 设为 http://127.0.0.1:8765/openai/v1（任意以 /responses 结尾的路径都会被处理），
+Realtime 页面的 Endpoint 设为 http://127.0.0.1:8765/openai/realtime
+
+安装了 websockets 时还会在 --realtime-ws-port 上提供 Realtime WebSocket 接口（供 realtime_benchmark.py 使用）
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "the quick brown fox jumps over the lazy dog while streaming tokens "
+    "arrive at a steady pace so latency can be measured without any network"
+).split()
+
+# reasoning effort 对应的推理 token 数
+REASONING_TOKENS = {
+    "minimal": 0,
+    "low": 64,
+    "medium": 256,
+    "high": 1024,
+}
+
+
+@dataclass
+class MockSettings:
+    """模拟参数（时间单位：秒）"""
+    ttft: float = 0.3
+    tokens_per_sec: float = 60.0
+    # 每个 token 间隔的相对抖动（0.2 表示 ±20%）
+    jitter: float = 0.2
+    output_tokens: int = 120
+    reasoning_tokens_per_sec: float = 400.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    # 模拟部署配额，0 表示不限制
+    rpm_limit: int = 0
+    tpm_limit: int = 0
+    # 模拟 Azure 前缀缓存：相同前缀的重复请求返回 cached_tokens
+    prompt_cache: bool = True
+    sdp_delay: float = 0.2
+    # Realtime：每个输出 token 对应的语音时长
+    realtime_audio_per_token: float = 0.3
+    # Realtime：输入转写耗时（相对输入音频时长）
+    realtime_transcribe_ratio: float = 0.1
+    seed: int = 0
+
+
+def _estimate_tokens(value):
+    """粗略估算 token 数（约 4 字节一个 token）"""
+    return max(1, len(json.dumps(value, ensure_ascii=False).encode('utf-8')) // 4)
+
+
+def _stub_answer(offer):
+    """根据 offer 生成语法合法的 SDP answer（不会真正建立媒体连接）"""
+    lines = []
+    for line in offer.splitlines():
+        if line.startswith("a=setup:"):
+            line = "a=setup:active"
+        elif line.startswith("a=ice-ufrag:"):
+            line = "a=ice-ufrag:mock"
+        elif line.startswith("a=ice-pwd:"):
+            line = "a=ice-pwd:mockmockmockmockmockmock"
+        elif line.startswith("a=candidate:") or line.startswith("a=end-of-candidates"):
+            continue
+        lines.append(line)
+    return "\r\n".join(lines) + "\r\n"
+
+
+# 保存的响应条数上限（最近最少使用的先淘汰，之后引用会得到 404，与真实服务端过期一致）
+MAX_STORED_RESPONSES = 1000
+# 记住的提示缓存前缀数上限（最近最少使用的先淘汰）
+MAX_CACHED_PREFIXES = 1000
+
+
+class MockState:
+    """服务端状态：已存储的响应、配额窗口、请求计数"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.responses = OrderedDict()
+        self.prefixes = OrderedDict()
+        self.window = deque()
+        self.counter = 0
+
+    def store_response(self, response):
+        with self.lock:
+            self.responses[response["id"]] = response
+            while len(self.responses) > MAX_STORED_RESPONSES:
+                self.responses.popitem(last=False)
+
+    def get_response(self, response_id):
+        with self.lock:
+            response = self.responses.get(response_id)
+            if response is not None:
+                self.responses.move_to_end(response_id)
+            return response
+
+    def next_rng(self):
+        with self.lock:
+            self.counter += 1
+            return random.Random(f"{self.settings.seed}:{self.counter}")
+
+    def admit(self, tokens):
+        """按 60 秒滑动窗口检查 RPM/TPM，返回 (是否放行, 剩余请求数, 剩余 token 数)"""
+        s = self.settings
+        now = time.monotonic()
+        with self.lock:
+            while self.window and now - self.window[0][0] > 60:
+                self.window.popleft()
+            used_requests = len(self.window)
+            used_tokens = sum(t for _, t in self.window)
+            if (s.rpm_limit and used_requests + 1 > s.rpm_limit) or \
+                    (s.tpm_limit and used_tokens + tokens > s.tpm_limit):
+                return False, max(0, s.rpm_limit - used_requests), max(0, s.tpm_limit - used_tokens)
+            self.window.append((now, tokens))
+            return True, max(0, s.rpm_limit - used_requests - 1), max(0, s.tpm_limit - used_tokens - tokens)
+
+    def cached_tokens(self, body, input_tokens):
+        """instructions 和除最后一条以外的 input 视为可缓存前缀"""
+        if not self.settings.prompt_cache:
+            return 0
+        input_value = body.get("input")
+        history = input_value[:-1] if isinstance(input_value, list) else []
+        prefix = json.dumps([body.get("instructions"), history], ensure_ascii=False, sort_keys=True)
+        prefix_tokens = _estimate_tokens(prefix)
+        # Azure 只缓存 1024 token 以上的前缀，按 128 对齐
+        if prefix_tokens < 1024:
+            return 0
+        with self.lock:
+            hit = prefix in self.prefixes
+            self.prefixes[prefix] = True
+            self.prefixes.move_to_end(prefix)
+            while len(self.prefixes) > MAX_CACHED_PREFIXES:
+                self.prefixes.popitem(last=False)
+        return min(input_tokens, prefix_tokens // 128 * 128) if hit else 0
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _cors(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Headers", "*")
+        self.send_header("Access-Control-Allow-Methods", "POST, GET, OPTIONS")
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self._cors()
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, code, message, headers=None):
+        self._send_json(status, {"error": {"code": code, "message": message}}, headers)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self._cors()
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        # 连接预热
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        raw = self._read_body()
+        if path.endswith("/responses"):
+            self._handle_responses(json.loads(raw or b"{}"))
+        elif path.endswith("/realtime"):
+            self._handle_sdp(raw.decode('utf-8'))
+        else:
+            self._error(404, "NotFound", f"unknown path {self.path}")
+
+    # ---------- Realtime ----------
+
+    def _handle_sdp(self, offer):
+        time.sleep(self.state.settings.sdp_delay)
+        if "v=0" not in offer:
+            self._error(400, "BadRequest", "invalid SDP offer")
+            return
+        body = _stub_answer(offer).encode('utf-8')
+        self.send_response(201)
+        self.send_header("Content-Type", "application/sdp")
+        self.send_header("Content-Length", str(len(body)))
+        self._cors()
+        self.end_headers()
+        self.wfile.write(body)
+
+    # ---------- Responses API ----------
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _handle_responses(self, body):
+        state = self.state
+        settings = state.settings
+        rng = state.next_rng()
+
+        previous_id = body.get("previous_response_id")
+        previous = state.get_response(previous_id) if previous_id else None
+        if previous_id and previous is None:
+            self._error(404, "NotFound", f"Previous response with id '{previous_id}' not found.")
+            return
+
+        effort = (body.get("reasoning") or {}).get("effort")
+        reasoning_tokens = REASONING_TOKENS.get(effort, 0)
+        input_tokens = _estimate_tokens(body.get("input")) + _estimate_tokens(body.get("instructions") or "")
+        if previous is not None:
+            input_tokens += previous["usage"]["total_tokens"]
+        text_tokens = settings.output_tokens
+        if body.get("max_output_tokens"):
+            text_tokens = max(1, min(text_tokens, body["max_output_tokens"] - reasoning_tokens))
+        output_tokens = text_tokens + reasoning_tokens
+
+        # 错误注入和配额
+        admitted, remaining_requests, remaining_tokens = state.admit(input_tokens + output_tokens)
+        ratelimit_headers = {
+            "x-ratelimit-remaining-requests": str(remaining_requests),
+            "x-ratelimit-remaining-tokens": str(remaining_tokens),
+            "x-ratelimit-limit-requests": str(settings.rpm_limit),
+            "x-ratelimit-limit-tokens": str(settings.tpm_limit),
+        }
+        if not admitted or rng.random() < settings.rate_limit_rate:
+            self._error(429, "429", "Rate limit is exceeded. Try again later.", {
+                "Retry-After": f"{settings.retry_after:g}",
+                "retry-after-ms": str(int(settings.retry_after * 1000)),
+                **ratelimit_headers,
+            })
+            return
+        if rng.random() < settings.error_rate:
+            self._error(500, "InternalServerError", "Injected server error.")
+            return
+
+        response_id = f"resp_{uuid.uuid4().hex}"
+        item_id = f"msg_{uuid.uuid4().hex}"
+        words = [rng.choice(WORDS) for _ in range(text_tokens)]
+        text = " ".join(words)
+        cached = state.cached_tokens(body, input_tokens)
+        response = {
+            "id": response_id,
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": "in_progress",
+            "model": body.get("model", "mock"),
+            "output": [],
+            "previous_response_id": previous_id,
+            "instructions": body.get("instructions"),
+            "parallel_tool_calls": True,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": None,
+        }
+        usage = {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": cached},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": reasoning_tokens},
+            "total_tokens": input_tokens + output_tokens,
+        }
+        message = {
+            "id": item_id,
+            "type": "message",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }
+
+        if not body.get("stream"):
+            time.sleep(settings.ttft + reasoning_tokens / settings.reasoning_tokens_per_sec
+                       + text_tokens / settings.tokens_per_sec)
+            response.update(status="completed", output=[message], usage=usage)
+            state.store_response(response)
+            self._send_json(200, response, ratelimit_headers)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self._cors()
+        for key, value in ratelimit_headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+
+        sequence = 0
+
+        def emit(event_type, **payload):
+            nonlocal sequence
+            payload = {"type": event_type, "sequence_number": sequence, **payload}
+            sequence += 1
+            self._write_chunk(f"event: {event_type}\ndata: {json.dumps(payload)}\n\n".encode('utf-8'))
+
+        try:
+            emit("response.created", response=response)
+            emit("response.in_progress", response=response)
+
+            # 首字延迟 + 推理时间
+            time.sleep(settings.ttft + reasoning_tokens / settings.reasoning_tokens_per_sec)
+
+            in_progress_item = {**message, "status": "in_progress", "content": []}
+            emit("response.output_item.added", output_index=0, item=in_progress_item)
+            emit("response.content_part.added", item_id=item_id, output_index=0, content_index=0,
+                 part={"type": "output_text", "text": "", "annotations": []})
+
+            interval = 1.0 / settings.tokens_per_sec
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(max(0.0, interval * (1 + rng.uniform(-settings.jitter, settings.jitter))))
+                emit("response.output_text.delta", item_id=item_id, output_index=0, content_index=0,
+                     delta=word if i == 0 else " " + word)
+
+            emit("response.output_text.done", item_id=item_id, output_index=0, content_index=0, text=text)
+            emit("response.content_part.done", item_id=item_id, output_index=0, content_index=0,
+                 part=message["content"][0])
+            emit("response.output_item.done", output_index=0, item=message)
+
+            response.update(status="completed", output=[message], usage=usage)
+            state.store_response(response)
+            emit("response.completed", response=response)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消
+            self.close_connection = True
+
+
+# ---------- Realtime WebSocket ----------
+
+REALTIME_SAMPLE_RATE = 24000
+# 低于该 RMS 的 PCM16 音频视为静音
+VAD_SILENCE_RMS = 500
+
+
+def _rms(pcm):
+    count = len(pcm) // 2
+    if not count:
+        return 0.0
+    samples = memoryview(pcm)[:count * 2].cast('h')
+    return math.sqrt(sum(sample * sample for sample in samples) / count)
+
+
+class MockRealtimeSession:
+    """
+    一个 Realtime WebSocket 会话
+
+    支持 session.update、input_audio_buffer.append / commit / clear、response.create / cancel；
+    turn_detection 为 server_vad / semantic_vad 时按音量检测说完（静音达到 silence_duration_ms）并自动回复
+    """
+
+    def __init__(self, websocket, state):
+        self.websocket = websocket
+        self.state = state
+        self.session = {
+            "modalities": ["audio", "text"],
+            "voice": "alloy",
+            "turn_detection": {
+                "type": "server_vad", "threshold": 0.5,
+                "prefix_padding_ms": 300, "silence_duration_ms": 500, "create_response": True,
+            },
+            "input_audio_transcription": None,
+            "max_response_output_tokens": "inf",
+        }
+        self.buffer_bytes = 0
+        self.input_seconds = 0.0
+        self.speaking = False
+        self.silence_ms = 0.0
+        self.response_task = None
+
+    async def send(self, event_type, **payload):
+        await self.websocket.send(json.dumps({"type": event_type, "event_id": f"event_{uuid.uuid4().hex}", **payload}))
+
+    async def run(self):
+        await self.send("session.created", session=self.session)
+        async for raw in self.websocket:
+            event = json.loads(raw)
+            event_type = event.get("type")
+            if event_type == "session.update":
+                self.session.update(event.get("session") or {})
+                await self.send("session.updated", session=self.session)
+            elif event_type == "input_audio_buffer.append":
+                await self._append(base64.b64decode(event.get("audio", "")))
+            elif event_type == "input_audio_buffer.commit":
+                await self._commit()
+            elif event_type == "input_audio_buffer.clear":
+                self.buffer_bytes = 0
+                await self.send("input_audio_buffer.cleared")
+            elif event_type == "response.create":
+                self._start_response()
+            elif event_type == "response.cancel" and self.response_task is not None:
+                self.response_task.cancel()
+        if self.response_task is not None:
+            self.response_task.cancel()
+
+    async def _append(self, pcm):
+        self.buffer_bytes += len(pcm)
+        vad = self.session.get("turn_detection")
+        if not vad:
+            return
+        if _rms(pcm) >= VAD_SILENCE_RMS:
+            if not self.speaking:
+                self.speaking = True
+                await self.send("input_audio_buffer.speech_started",
+                                audio_start_ms=int(self.buffer_bytes / 48), item_id=f"item_{uuid.uuid4().hex}")
+            self.silence_ms = 0.0
+            return
+        if not self.speaking:
+            return
+        self.silence_ms += len(pcm) / (REALTIME_SAMPLE_RATE * 2) * 1000
+        if self.silence_ms >= vad.get("silence_duration_ms", 500):
+            self.speaking = False
+            await self.send("input_audio_buffer.speech_stopped", audio_end_ms=int(self.buffer_bytes / 48))
+            await self._commit()
+            if vad.get("create_response", True):
+                self._start_response()
+
+    async def _commit(self):
+        item_id = f"item_{uuid.uuid4().hex}"
+        audio_seconds = self.buffer_bytes / (REALTIME_SAMPLE_RATE * 2)
+        self.input_seconds += audio_seconds
+        self.buffer_bytes = 0
+        await self.send("input_audio_buffer.committed", item_id=item_id)
+        if self.session.get("input_audio_transcription"):
+            asyncio.get_running_loop().create_task(self._transcribe(item_id, audio_seconds))
+
+    async def _transcribe(self, item_id, audio_seconds):
+        await asyncio.sleep(0.05 + audio_seconds * self.state.settings.realtime_transcribe_ratio)
+        await self.send("conversation.item.input_audio_transcription.completed",
+                        item_id=item_id, content_index=0, transcript="mock input transcript")
+
+    def _start_response(self):
+        if self.response_task is not None and not self.response_task.done():
+            self.response_task.cancel()
+        self.response_task = asyncio.get_running_loop().create_task(self._respond())
+
+    async def _respond(self):
+        settings = self.state.settings
+        rng = self.state.next_rng()
+        response_id = f"resp_{uuid.uuid4().hex}"
+        item_id = f"item_{uuid.uuid4().hex}"
+        text_tokens = settings.output_tokens
+        limit = self.session.get("max_response_output_tokens")
+        if isinstance(limit, int):
+            text_tokens = max(1, min(text_tokens, limit))
+        words = [rng.choice(WORDS) for _ in range(text_tokens)]
+        audio = "audio" in self.session.get("modalities", [])
+        response = {"id": response_id, "object": "realtime.response", "status": "in_progress", "output": []}
+        await self.send("response.created", response=response)
+        try:
+            await asyncio.sleep(settings.ttft)
+            if rng.random() < settings.error_rate:
+                response.update(status="failed", status_details={"type": "failed", "error": {"message": "Injected error."}})
+                await self.send("response.done", response=response)
+                return
+
+            # 静音音频块，时长与 token 数成正比
+            chunk = base64.b64encode(
+                bytes(int(REALTIME_SAMPLE_RATE * settings.realtime_audio_per_token) * 2)
+            ).decode('ascii')
+            interval = 1.0 / settings.tokens_per_sec
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(max(0.0, interval * (1 + rng.uniform(-settings.jitter, settings.jitter))))
+                delta = word if i == 0 else " " + word
+                if audio:
+                    await self.send("response.audio.delta", response_id=response_id, item_id=item_id,
+                                    output_index=0, content_index=0, delta=chunk)
+                    await self.send("response.audio_transcript.delta", response_id=response_id, item_id=item_id,
+                                    output_index=0, content_index=0, delta=delta)
+                else:
+                    await self.send("response.text.delta", response_id=response_id, item_id=item_id,
+                                    output_index=0, content_index=0, delta=delta)
+
+            transcript = " ".join(words)
+            if audio:
+                await self.send("response.audio.done", response_id=response_id, item_id=item_id,
+                                output_index=0, content_index=0)
+                await self.send("response.audio_transcript.done", response_id=response_id, item_id=item_id,
+                                output_index=0, content_index=0, transcript=transcript)
+            else:
+                await self.send("response.text.done", response_id=response_id, item_id=item_id,
+                                output_index=0, content_index=0, text=transcript)
+            # 音频输入约每秒 10 个 token，会话内累计
+            input_tokens = 20 + int(self.input_seconds * 10)
+            response.update(status="completed", usage={
+                "input_tokens": input_tokens,
+                "output_tokens": text_tokens,
+                "total_tokens": input_tokens + text_tokens,
+            })
+            await self.send("response.done", response=response)
+        except asyncio.CancelledError:
+            response.update(status="cancelled")
+            await self.send("response.done", response=response)
+
+
+def start_mock_realtime_server(settings=None, host="127.0.0.1", port=0, state=None):
+    """
+    在后台线程启动 Realtime WebSocket 模拟服务，返回 (server, endpoint)；需要 websockets
+    endpoint 形如 http://127.0.0.1:PORT/openai/realtime，与 Realtime 页面的配置格式相同
+    """
+    from websockets.asyncio.server import serve
+
+    state = state or MockState(settings or MockSettings())
+    ready = threading.Event()
+    holder = {}
+
+    async def handler(websocket):
+        await MockRealtimeSession(websocket, state).run()
+
+    async def main():
+        async with serve(handler, host, port, max_size=None) as server:
+            holder["server"] = server
+            holder["port"] = server.sockets[0].getsockname()[1]
+            ready.set()
+            await server.serve_forever()
+
+    threading.Thread(target=lambda: asyncio.run(main()), daemon=True, name="mock-realtime").start()
+    ready.wait(10)
+    return holder.get("server"), f"http://{host}:{holder.get('port')}/openai/realtime"
+
+
+def start_mock_server(settings=None, host="127.0.0.1", port=0):
+    """在后台线程启动模拟服务，返回 (server, base_url)；port=0 时随机分配端口"""
+    handler = type("Handler", (MockHandler,), {"state": MockState(settings or MockSettings())})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-server").start()
+    return server, f"http://{host}:{server.server_address[1]}/openai/v1"
+
+
+def main(argv=None):
+    defaults = MockSettings()
+    parser = argparse.ArgumentParser(description="本地模拟 Responses API / Realtime SDP 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=defaults.ttft)
+    parser.add_argument("--tokens-per-sec", type=float, default=defaults.tokens_per_sec)
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--reasoning-tokens-per-sec", type=float, default=defaults.reasoning_tokens_per_sec)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate)
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument("--rpm-limit", type=int, default=defaults.rpm_limit)
+    parser.add_argument("--tpm-limit", type=int, default=defaults.tpm_limit)
+    parser.add_argument("--no-prompt-cache", action="store_true")
+    parser.add_argument("--sdp-delay", type=float, default=defaults.sdp_delay)
+    parser.add_argument("--realtime-ws-port", type=int, default=8766, help="Realtime WebSocket 端口，0 表示不启动")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        jitter=args.jitter,
+        output_tokens=args.output_tokens,
+        reasoning_tokens_per_sec=args.reasoning_tokens_per_sec,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        rpm_limit=args.rpm_limit,
+        tpm_limit=args.tpm_limit,
+        prompt_cache=not args.no_prompt_cache,
+        sdp_delay=args.sdp_delay,
+        seed=args.seed,
+    )
+    server, base_url = start_mock_server(settings, args.host, args.port)
+    print(f"Responses API: {base_url}")
+    print(f"Realtime SDP:  http://{args.host}:{server.server_address[1]}/openai/realtime")
+    if args.realtime_ws_port:
+        try:
+            _, realtime_endpoint = start_mock_realtime_server(settings, args.host, args.realtime_ws_port)
+            print(f"Realtime WS:   {realtime_endpoint}")
+        except ImportError:
+            print("未安装 websockets，Realtime WebSocket 模拟服务未启动")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
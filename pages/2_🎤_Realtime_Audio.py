@@ -3,10 +3,32 @@ GPT Realtime Audio 测试
 使用 WebRTC 进行实时语音对话
 """
 
+import time
+
 import streamlit as st
-from streamlit.components.v1 import html
-import json
-from pathlib import Path
+
+from config_store import get_section, list_profiles, load_config, save_config, set_section
+from metrics_store import (
+    SETUP_PHASES, connect, query_realtime_setup, query_realtime_turns, record_realtime_setup, record_turn
+)
+from realtime_component import (
+    CUSTOM_PRESET, MODALITIES, SESSION_PRESETS, VAD_TYPES, VOICES,
+    build_session, new_reports, preset_name, realtime_session
+)
+from stream_metrics import percentile
+
+# 每轮延迟字段（毫秒，起点为用户说完；关闭 VAD 时为点击“发送本轮”）
+TURN_LATENCIES = {
+    "created_ms": "→ response.created",
+    "first_audio_ms": "→ 首段音频",
+    "audio_done_ms": "→ 音频结束",
+    "input_transcript_ms": "→ 用户转写",
+    "output_transcript_ms": "→ 回复转写",
+}
+
+
+def _seconds(ms):
+    return ms / 1000 if ms is not None else None
 
 # 页面配置
 st.set_page_config(
@@ -15,26 +37,7 @@ st.set_page_config(
     layout="wide"
 )
 
-# 加载配置
-CONFIG_FILE = Path("config.json")
-
-def load_config():
-    if CONFIG_FILE.exists():
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-def save_config(config):
-    try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
-        return True
-    except:
-        return False
-
+# 加载配置（与聊天页面共用，文件未变化时命中缓存）
 config = load_config()
 
 # 标题
@@ -45,15 +48,24 @@ st.markdown("使用 WebRTC 与 GPT 进行实时语音对话")
 with st.sidebar:
     st.header("⚙️ Realtime 模型配置")
     
+    profiles = list_profiles(config)
+    active_profile = config.get('active_profile', 'default')
+    profile = st.selectbox(
+        "配置",
+        options=profiles,
+        index=profiles.index(active_profile) if active_profile in profiles else 0,
+        key="realtime_profile"
+    )
+
     # 从配置文件加载 realtime 模型的配置
-    realtime_config = config.get('realtime', {})
+    realtime_config = get_section(config, 'realtime', profile)
     
     api_key = st.text_input(
         "API Key",
         type="password",
         value=realtime_config.get('api_key', ''),
         help="Azure OpenAI API Key",
-        key="realtime_api_key"
+        key=f"realtime_api_key_{profile}"
     )
     
     endpoint = st.text_input(
@@ -61,31 +73,148 @@ with st.sidebar:
         value=realtime_config.get('endpoint', ''),
         placeholder="https://xxx.cognitiveservices.azure.com/openai/realtime",
         help="完整的 realtime 端点 URL（包含 /openai/realtime）",
-        key="realtime_endpoint"
+        key=f"realtime_endpoint_{profile}"
     )
     
     deployment = st.text_input(
         "Deployment Name",
         value=realtime_config.get('deployment', 'gpt-realtime'),
         help="Realtime 模型部署名称",
-        key="realtime_deployment"
+        key=f"realtime_deployment_{profile}"
     )
     
     api_version = st.text_input(
         "API Version",
         value=realtime_config.get('api_version', '2024-10-01-preview'),
         help="Azure OpenAI API 版本",
-        key="realtime_api_version"
+        key=f"realtime_api_version_{profile}"
+    )
+
+    region = st.text_input(
+        "区域（可选）",
+        value=realtime_config.get('region', ''),
+        placeholder="eastus2",
+        help="用于按区域统计建连耗时",
+        key=f"realtime_region_{profile}"
+    )
+
+    prewarm = st.checkbox(
+        "🔥 预热连接",
+        value=realtime_config.get('prewarm', True),
+        help="页面加载后立即获取麦克风、收集 ICE 并创建 Offer，点击后只需交换 SDP；"
+             "空闲时会占用麦克风",
+        key=f"realtime_prewarm_{profile}"
+    )
+    prewarm_after_stop = st.checkbox(
+        "停止后重新预热",
+        value=realtime_config.get('prewarm_after_stop', False),
+        disabled=not prewarm,
+        help="停止对话后立即重新获取麦克风并预热；关闭时停止即释放麦克风，下次开始时再建立连接",
+        key=f"realtime_prewarm_after_stop_{profile}"
     )
     
+    st.subheader("🎛️ 会话设置")
+    saved_session = realtime_config.get('session') or {}
+    preset_keys = list(SESSION_PRESETS)
+    saved_preset = saved_session.get('preset', 'balanced')
+    selected_preset = st.selectbox(
+        "预设",
+        options=preset_keys,
+        index=preset_keys.index(saved_preset) if saved_preset in preset_keys else 1,
+        format_func=lambda name: SESSION_PRESETS[name]['label'],
+        help="通道打开时通过 session.update 发送；会话中修改会立即生效",
+        key=f"realtime_preset_{profile}"
+    )
+    # 切换预设时各项重置为预设值；与已保存的预设相同时沿用已保存的微调
+    defaults = dict(SESSION_PRESETS[selected_preset])
+    if saved_preset == selected_preset:
+        defaults.update({name: saved_session[name] for name in defaults if name in saved_session})
+    widget_suffix = f"{profile}_{selected_preset}"
+
+    with st.expander("详细参数"):
+        vad = st.selectbox(
+            "轮次检测（VAD）",
+            options=VAD_TYPES,
+            index=VAD_TYPES.index(defaults['vad']),
+            help="server_vad 按静音判断说完；semantic_vad 按语义判断；none 说完后点击“发送本轮”提交音频并请求回复",
+            key=f"realtime_vad_{widget_suffix}"
+        )
+        threshold = st.slider(
+            "VAD 阈值", 0.0, 1.0, float(defaults['threshold']), 0.05,
+            disabled=vad != "server_vad",
+            help="越高越不容易被噪声触发",
+            key=f"realtime_threshold_{widget_suffix}"
+        )
+        prefix_padding_ms = st.number_input(
+            "前置填充 (ms)", 0, 2000, int(defaults['prefix_padding_ms']), 50,
+            disabled=vad != "server_vad",
+            key=f"realtime_prefix_padding_{widget_suffix}"
+        )
+        silence_duration_ms = st.number_input(
+            "静音时长 (ms)", 100, 3000, int(defaults['silence_duration_ms']), 50,
+            disabled=vad != "server_vad",
+            help="说完后等待多久判定轮次结束，直接计入语音到语音延迟",
+            key=f"realtime_silence_{widget_suffix}"
+        )
+        eagerness = st.selectbox(
+            "语义 VAD 积极程度",
+            options=["low", "medium", "high", "auto"],
+            index=["low", "medium", "high", "auto"].index(defaults['eagerness']),
+            disabled=vad != "semantic_vad",
+            key=f"realtime_eagerness_{widget_suffix}"
+        )
+        transcription = st.checkbox(
+            "输入语音转写",
+            value=defaults['transcription'],
+            help="显示用户说的话；关闭可减少服务端处理",
+            key=f"realtime_transcription_{widget_suffix}"
+        )
+        max_output_tokens = st.number_input(
+            "最大回复 tokens（0 为不限）", 0, 4096, int(defaults['max_output_tokens']), 64,
+            key=f"realtime_max_tokens_{widget_suffix}"
+        )
+        voice = st.selectbox(
+            "声音",
+            options=VOICES,
+            index=VOICES.index(defaults['voice']) if defaults['voice'] in VOICES else 0,
+            key=f"realtime_voice_{widget_suffix}"
+        )
+        modalities = st.radio(
+            "回复形式",
+            options=list(MODALITIES),
+            index=list(MODALITIES).index(defaults['modalities']),
+            format_func=lambda name: "语音 + 文字" if name == "audio" else "仅文字",
+            horizontal=True,
+            key=f"realtime_modalities_{widget_suffix}"
+        )
+
+    session_settings = {
+        'vad': vad,
+        'threshold': threshold,
+        'prefix_padding_ms': prefix_padding_ms,
+        'silence_duration_ms': silence_duration_ms,
+        'eagerness': eagerness,
+        'transcription': transcription,
+        'max_output_tokens': max_output_tokens,
+        'voice': voice,
+        'modalities': modalities,
+    }
+    preset = preset_name(session_settings, selected_preset)
+    if preset == CUSTOM_PRESET:
+        st.caption(f"已在「{SESSION_PRESETS[selected_preset]['label']}」基础上修改，记录为 custom")
+
     # 保存配置按钮
     if st.button("💾 保存 Realtime 配置", use_container_width=True):
-        config['realtime'] = {
+        set_section(config, 'realtime', {
             'api_key': api_key,
             'endpoint': endpoint,
             'deployment': deployment,
-            'api_version': api_version
-        }
+            'api_version': api_version,
+            'region': region,
+            'prewarm': prewarm,
+            'prewarm_after_stop': prewarm_after_stop,
+            'session': dict(session_settings, preset=selected_preset)
+        }, profile)
         if save_config(config):
             st.success("✅ Realtime 配置已保存！")
         else:
@@ -125,299 +254,153 @@ API Key: {"*" * 40}
     # WebRTC 音频界面
     st.markdown("---")
     
-    # 创建 HTML/JavaScript 代码用于 WebRTC
-    webrtc_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                padding: 20px;
-                background-color: #f5f5f5;
-            }}
-            .container {{
-                max-width: 800px;
-                margin: 0 auto;
-                background: white;
-                padding: 30px;
-                border-radius: 10px;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            }}
-            .button {{
-                padding: 15px 30px;
-                font-size: 18px;
-                border: none;
-                border-radius: 5px;
-                cursor: pointer;
-                margin: 10px;
-                transition: all 0.3s;
-            }}
-            .start-btn {{
-                background-color: #4CAF50;
-                color: white;
-            }}
-            .start-btn:hover {{
-                background-color: #45a049;
-            }}
-            .start-btn:disabled {{
-                background-color: #cccccc;
-                cursor: not-allowed;
-            }}
-            .stop-btn {{
-                background-color: #f44336;
-                color: white;
-            }}
-            .stop-btn:hover {{
-                background-color: #da190b;
-            }}
-            .stop-btn:disabled {{
-                background-color: #cccccc;
-                cursor: not-allowed;
-            }}
-            .status {{
-                padding: 15px;
-                margin: 20px 0;
-                border-radius: 5px;
-                font-size: 16px;
-            }}
-            .status.idle {{
-                background-color: #e3f2fd;
-                color: #1976d2;
-            }}
-            .status.connecting {{
-                background-color: #fff3e0;
-                color: #f57c00;
-            }}
-            .status.connected {{
-                background-color: #e8f5e9;
-                color: #388e3c;
-            }}
-            .status.error {{
-                background-color: #ffebee;
-                color: #c62828;
-            }}
-            .transcript {{
-                margin-top: 20px;
-                padding: 15px;
-                background-color: #f9f9f9;
-                border-radius: 5px;
-                min-height: 200px;
-                max-height: 400px;
-                overflow-y: auto;
-            }}
-            .message {{
-                margin: 10px 0;
-                padding: 10px;
-                border-radius: 5px;
-            }}
-            .user-message {{
-                background-color: #e3f2fd;
-                text-align: right;
-            }}
-            .assistant-message {{
-                background-color: #f1f8e9;
-                text-align: left;
-            }}
-            .debug {{
-                margin-top: 20px;
-                padding: 10px;
-                background-color: #f5f5f5;
-                border: 1px solid #ddd;
-                border-radius: 5px;
-                font-size: 12px;
-                max-height: 200px;
-                overflow-y: auto;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h2>🎤 实时语音对话</h2>
-            
-            <div class="status idle" id="status">
-                准备就绪
-            </div>
-            
-            <div>
-                <button class="button start-btn" id="startBtn" onclick="startSession()">
-                    🎤 开始对话
-                </button>
-                <button class="button stop-btn" id="stopBtn" onclick="stopSession()" disabled>
-                    🛑 停止对话
-                </button>
-            </div>
-            
-            <div class="transcript" id="transcript">
-                <p style="color: #999;">对话内容将显示在这里...</p>
-            </div>
-            
-            <div class="debug" id="debug">
-                <strong>调试信息:</strong><br>
-            </div>
-        </div>
-        
-        <script>
-            const API_KEY = "{api_key}";
-            const ENDPOINT = "{endpoint}";
-            const DEPLOYMENT = "{deployment}";
-            const API_VERSION = "{api_version}";
-            
-            let peerConnection = null;
-            let dataChannel = null;
-            
-            function addDebug(message) {{
-                const debugEl = document.getElementById('debug');
-                const time = new Date().toLocaleTimeString();
-                debugEl.innerHTML += `[${{time}}] ${{message}}<br>`;
-                debugEl.scrollTop = debugEl.scrollHeight;
-                console.log(message);
-            }}
-            
-            function updateStatus(message, type = 'idle') {{
-                const statusEl = document.getElementById('status');
-                statusEl.textContent = message;
-                statusEl.className = 'status ' + type;
-                addDebug('Status: ' + message);
-            }}
-            
-            function addMessage(content, role) {{
-                const transcript = document.getElementById('transcript');
-                const messageDiv = document.createElement('div');
-                messageDiv.className = 'message ' + role + '-message';
-                messageDiv.textContent = content;
-                transcript.appendChild(messageDiv);
-                transcript.scrollTop = transcript.scrollHeight;
-            }}
-            
-            async function startSession() {{
-                try {{
-                    updateStatus('正在连接...', 'connecting');
-                    document.getElementById('startBtn').disabled = true;
-                    
-                    addDebug('开始创建 RTCPeerConnection...');
-                    
-                    // 创建 RTCPeerConnection
-                    peerConnection = new RTCPeerConnection();
-                    
-                    addDebug('请求麦克风权限...');
-                    
-                    // 添加音频轨道
-                    const stream = await navigator.mediaDevices.getUserMedia({{ audio: true }});
-                    addDebug('麦克风权限已获取');
-                    
-                    stream.getTracks().forEach(track => {{
-                        peerConnection.addTrack(track, stream);
-                        addDebug('添加音频轨道: ' + track.label);
-                    }});
-                    
-                    // 创建 Data Channel
-                    addDebug('创建 Data Channel...');
-                    dataChannel = peerConnection.createDataChannel('oai-events');
-                    
-                    dataChannel.onopen = () => {{
-                        updateStatus('✅ 已连接，可以开始说话了！', 'connected');
-                        document.getElementById('stopBtn').disabled = false;
-                        addDebug('Data Channel 已打开');
-                    }};
-                    
-                    dataChannel.onmessage = (event) => {{
-                        try {{
-                            const message = JSON.parse(event.data);
-                            addDebug('收到消息: ' + message.type);
-                            
-                            if (message.type === 'response.audio_transcript.done') {{
-                                addMessage(message.transcript, 'assistant');
-                            }} else if (message.type === 'conversation.item.input_audio_transcription.completed') {{
-                                addMessage(message.transcript, 'user');
-                            }}
-                        }} catch (error) {{
-                            addDebug('解析消息错误: ' + error.message);
-                        }}
-                    }};
-                    
-                    dataChannel.onerror = (error) => {{
-                        updateStatus('❌ Data Channel 错误', 'error');
-                        addDebug('Data Channel 错误: ' + error);
-                    }};
-                    
-                    // 创建 Offer
-                    addDebug('创建 SDP Offer...');
-                    const offer = await peerConnection.createOffer();
-                    await peerConnection.setLocalDescription(offer);
-                    addDebug('SDP Offer 已创建');
-                    
-                    // 构建完整 URL（endpoint 已经包含 /openai/realtime）
-                    const url = `${{ENDPOINT}}?api-version=${{API_VERSION}}&deployment=${{DEPLOYMENT}}`;
-                    addDebug('请求 URL: ' + url);
-                    
-                    // 发送 Offer 到 Azure
-                    addDebug('发送 SDP Offer 到 Azure...');
-                    const response = await fetch(url, {{
-                        method: 'POST',
-                        headers: {{
-                            'Content-Type': 'application/sdp',
-                            'api-key': API_KEY
-                        }},
-                        body: offer.sdp
-                    }});
-                    
-                    addDebug('响应状态: ' + response.status + ' ' + response.statusText);
-                    
-                    if (!response.ok) {{
-                        const errorText = await response.text();
-                        addDebug('错误响应: ' + errorText);
-                        throw new Error('Failed to connect: ' + response.statusText + ' - ' + errorText);
-                    }}
-                    
-                    const answerSdp = await response.text();
-                    addDebug('收到 SDP Answer，长度: ' + answerSdp.length);
-                    
-                    await peerConnection.setRemoteDescription({{
-                        type: 'answer',
-                        sdp: answerSdp
-                    }});
-                    
-                    addDebug('连接建立成功！');
-                    
-                }} catch (error) {{
-                    console.error('Error:', error);
-                    updateStatus('❌ 连接失败: ' + error.message, 'error');
-                    addDebug('连接失败: ' + error.message);
-                    document.getElementById('startBtn').disabled = false;
-                }}
-            }}
-            
-            function stopSession() {{
-                addDebug('断开连接...');
-                
-                if (peerConnection) {{
-                    peerConnection.close();
-                    peerConnection = null;
-                }}
-                if (dataChannel) {{
-                    dataChannel.close();
-                    dataChannel = null;
-                }}
-                
-                updateStatus('已断开连接', 'idle');
-                document.getElementById('startBtn').disabled = false;
-                document.getElementById('stopBtn').disabled = true;
-            }}
-            
-            // 初始化调试信息
-            addDebug('页面已加载');
-            addDebug('Endpoint: ' + ENDPOINT);
-            addDebug('Deployment: ' + DEPLOYMENT);
-            addDebug('API Version: ' + API_VERSION);
-            addDebug('API Version: ' + API_VERSION);
-        </script>
-    </body>
-    </html>
-    """
-    
-    # 显示 WebRTC 界面
-    html(webrtc_html, height=900, scrolling=True)
+    # WebRTC 界面（双向组件：前端回传建连阶段耗时和每轮延迟）
+    reports = realtime_session(
+        api_key=api_key,
+        endpoint=endpoint,
+        deployment=deployment,
+        api_version=api_version,
+        prewarm=prewarm,
+        prewarm_after_stop=prewarm_after_stop,
+        session=build_session(session_settings),
+        preset=preset,
+        key="realtime_webrtc"
+    )
+
+    seen = st.session_state.setdefault("realtime_seen_reports", set())
+    turns = st.session_state.setdefault("realtime_turns", [])
+    for report in new_reports(reports, seen):
+        if report.get("kind") == "turn":
+            turns.append(report)
+            record_turn(
+                ts=report.get("ts", 0) / 1000 or None,
+                source="realtime",
+                endpoint=endpoint,
+                model=deployment,
+                ttft=_seconds(report.get("first_audio_ms")),
+                total_duration=_seconds(report.get("audio_done_ms")),
+                input_tokens=report.get("input_tokens", 0),
+                output_tokens=report.get("output_tokens", 0),
+                total_tokens=report.get("total_tokens", 0),
+                error_class=None if report.get("status") == "completed" else (report.get("status") or "Unknown").title(),
+                preset=report.get("preset"),
+            )
+            continue
+        if report.get("kind") != "setup":
+            continue
+        phases = report.get("phases") or {}
+        record_realtime_setup(
+            ts=report.get("ts", 0) / 1000 or None,
+            endpoint=endpoint,
+            deployment=deployment,
+            region=region,
+            prewarmed=report.get("prewarmed", False),
+            click_to_ready_ms=report.get("click_to_ready_ms"),
+            error=report.get("error"),
+            preset=report.get("preset"),
+            **{phase: phases.get(phase) for phase in SETUP_PHASES}
+        )
+        st.session_state.realtime_last_setup = report
+
+    # 最近一次建连的阶段分解
+    last_setup = st.session_state.get("realtime_last_setup")
+    if last_setup and not last_setup.get("error"):
+        phases = last_setup.get("phases") or {}
+        st.markdown("#### ⏱️ 最近一次建连")
+        cols = st.columns(6)
+        cols[0].metric("点击→就绪", f"{last_setup['click_to_ready_ms']:.0f} ms",
+                       help="已预热" if last_setup.get("prewarmed") else "未预热")
+        cols[1].metric("麦克风授权", f"{phases.get('mic_ms', 0):.0f} ms")
+        cols[2].metric("Offer + ICE 收集", f"{phases.get('offer_ms', 0) + phases.get('ice_gather_ms', 0):.0f} ms")
+        cols[3].metric("SDP 往返", f"{phases.get('sdp_ms', 0):.0f} ms")
+        cols[4].metric("ICE 连通", f"{phases.get('ice_ms', 0):.0f} ms")
+        cols[5].metric("通道打开", f"{phases.get('channel_ms', 0):.0f} ms")
+        if last_setup.get("prewarmed") and last_setup.get("prewarm_ms"):
+            st.caption(f"🔥 麦克风、ICE 和 Offer 已在页面加载时完成（预热耗时 {last_setup['prewarm_ms']:.0f} ms）")
+
+    # 每轮语音到语音延迟（本页会话内）
+    completed = [turn for turn in turns if turn.get("status") == "completed"]
+    if completed:
+        last_turn = completed[-1]
+        st.markdown(f"#### 🗣️ 语音到语音延迟（{len(completed)} 轮）")
+        cols = st.columns(len(TURN_LATENCIES))
+        for col, (field, label) in zip(cols, TURN_LATENCIES.items()):
+            values = [turn[field] for turn in completed if turn.get(field) is not None]
+            if not values:
+                col.metric(label, "-")
+                continue
+            current = last_turn.get(field)
+            col.metric(
+                label,
+                f"{current:.0f} ms" if current is not None else "-",
+                help=f"P50 {percentile(values, 50):.0f} ms · P90 {percentile(values, 90):.0f} ms · "
+                     f"P99 {percentile(values, 99):.0f} ms"
+            )
+        first_audio = [turn["first_audio_ms"] for turn in completed if turn.get("first_audio_ms") is not None]
+        if first_audio:
+            st.caption(
+                f"说完→首段音频 P50 {percentile(first_audio, 50):.0f} ms · "
+                f"P90 {percentile(first_audio, 90):.0f} ms · P99 {percentile(first_audio, 99):.0f} ms；"
+                f"未完成（打断或失败）{len(turns) - len(completed)} 轮。每轮已写入指标库（source=realtime），可在 Dashboard 查看"
+            )
+
+    # 按部署和区域汇总（最近 7 天）
+    with st.expander("📊 建连耗时统计（按部署 / 区域）"):
+        now = time.time()
+        conn = connect()
+        try:
+            rows = query_realtime_setup(conn, now - 7 * 86400, now)
+        finally:
+            conn.close()
+        if rows:
+            st.dataframe(
+                [
+                    {
+                        "部署": row["deployment"],
+                        "区域": row["region"] or "-",
+                        "预热": "是" if row["prewarmed"] else "否",
+                        "次数": row["sessions"],
+                        "失败率": f"{row['error_rate']:.0%}",
+                        "P50 (ms)": round(row["ready_p50"]),
+                        "P90 (ms)": round(row["ready_p90"]),
+                        "P99 (ms)": round(row["ready_p99"]),
+                        "SDP 往返 P50": round(row["sdp_ms"]),
+                        "ICE 连通 P50": round(row["ice_ms"]),
+                    }
+                    for row in rows
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.caption("还没有建连记录")
+
+    with st.expander("🎛️ 语音到语音延迟（按部署 / 会话预设，最近 7 天）"):
+        now = time.time()
+        conn = connect()
+        try:
+            rows = query_realtime_turns(conn, now - 7 * 86400, now)
+        finally:
+            conn.close()
+        if rows:
+            st.dataframe(
+                [
+                    {
+                        "部署": row["deployment"],
+                        "预设": SESSION_PRESETS.get(row["preset"], {}).get("label", row["preset"] or "-"),
+                        "轮数": row["turns"],
+                        "未完成": f"{row['interrupted_rate']:.0%}",
+                        "首段音频 P50 (ms)": round(row["first_audio_p50"] * 1000),
+                        "首段音频 P90 (ms)": round(row["first_audio_p90"] * 1000),
+                        "音频结束 P50 (ms)": round(row["audio_done_p50"] * 1000),
+                    }
+                    for row in rows
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.caption("还没有语音轮次记录")
     
     # 技术说明
     st.markdown("---")
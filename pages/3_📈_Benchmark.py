@@ -0,0 +1,221 @@
+"""
+Responses API 并发压测
+对部署发起并发流式请求，统计 TTFT / 总时长 / 吞吐百分位数和错误率
+"""
+
+import streamlit as st
+import json
+import io
+
+from benchmark import (
+    BenchmarkConfig, DEFAULT_PROMPTS, build_report, results_to_csv, run_benchmark, summarize
+)
+from config_store import get_section, list_profiles, load_config
+from image_utils import DETAIL_LEVELS
+from load_balancer import deployments_from_config
+
+# 页面配置
+st.set_page_config(
+    page_title="并发压测",
+    page_icon="📈",
+    layout="wide"
+)
+
+# 加载配置（与聊天页面共用）
+config = load_config()
+
+# 标题
+st.title("📈 并发压测")
+st.markdown("对聊天部署发起并发流式请求，请求构造与聊天页面一致")
+
+# 侧边栏配置
+with st.sidebar:
+    st.header("⚙️ 压测目标")
+
+    profiles = list_profiles(config)
+    active_profile = config.get('active_profile', 'default')
+    profile = st.selectbox(
+        "配置",
+        options=profiles,
+        index=profiles.index(active_profile) if active_profile in profiles else 0,
+        key="bench_profile"
+    )
+    chat_config = get_section(config, 'chat', profile)
+
+    api_key = st.text_input(
+        "API Key",
+        type="password",
+        value=chat_config.get('api_key', ''),
+        key=f"bench_api_key_{profile}"
+    )
+    endpoint = st.text_input(
+        "Endpoint (Base URL)",
+        value=chat_config.get('endpoint', ''),
+        key=f"bench_endpoint_{profile}"
+    )
+    model = st.text_input(
+        "模型名称",
+        value=chat_config.get('model', 'gpt-4o'),
+        key=f"bench_model_{profile}"
+    )
+    reasoning_effort = st.selectbox(
+        "Reasoning Effort",
+        options=["none", "minimal", "low", "medium", "high"],
+        index=0
+    )
+    balance_profiles = st.multiselect(
+        "负载均衡（可选）", options=profiles,
+        help="选择多个配置时，每个请求按 TTFT / 错误率在这些部署之间路由，权重使用聊天页面保存的值"
+    )
+
+    st.divider()
+
+    st.subheader("🔧 负载")
+    concurrency = st.number_input("并发数", min_value=1, max_value=256, value=4)
+    rate = st.number_input(
+        "目标速率 (请求/秒)", min_value=0.0, max_value=1000.0, value=0.0, step=0.5,
+        help="0 表示闭环：始终保持“并发数”个请求在途"
+    )
+    duration = st.number_input("持续时间 (秒)", min_value=1.0, max_value=3600.0, value=30.0)
+    max_requests = st.number_input("最大请求数", min_value=0, value=0, help="0 表示不限制")
+
+# 负载均衡的部署
+balance_weights = config.get('balancer', {}).get('weights', {})
+deployments = deployments_from_config(
+    config, {name: balance_weights.get(name, 1.0) for name in balance_profiles}
+)
+
+# 提示词和图片
+prompts_text = st.text_area(
+    "提示词（每行一个，按顺序轮换）",
+    value="\n".join(DEFAULT_PROMPTS),
+    height=150
+)
+instructions = st.text_area(
+    "Instructions（可选）",
+    value=chat_config.get('instructions', ''),
+    height=100,
+    key=f"bench_instructions_{profile}",
+    help="所有请求共用的固定前缀；超过 1024 tokens 时可观察提示缓存命中率"
+)
+col1, col2 = st.columns([3, 1])
+with col1:
+    uploaded_images = st.file_uploader(
+        "📎 附加图片（可选，按顺序轮换）",
+        type=['png', 'jpg', 'jpeg', 'webp', 'gif', 'bmp', 'tiff'],
+        accept_multiple_files=True
+    )
+with col2:
+    image_detail = st.selectbox("图片细节", options=DETAIL_LEVELS)
+
+if st.button("🚀 开始压测", type="primary", use_container_width=True):
+    prompts = [line.strip() for line in prompts_text.splitlines() if line.strip()]
+    if (not api_key or not endpoint) and not deployments:
+        st.error("❌ 请先在侧边栏配置 API Key 和 Endpoint")
+    elif not prompts:
+        st.error("❌ 至少需要一个提示词")
+    else:
+        bench_config = BenchmarkConfig(
+            endpoint=endpoint,
+            api_key=api_key,
+            model=model,
+            prompts=prompts,
+            instructions=instructions,
+            images=[f.getvalue() for f in uploaded_images or []],
+            image_detail=image_detail,
+            reasoning_effort=reasoning_effort,
+            concurrency=int(concurrency),
+            rate=float(rate),
+            duration=float(duration),
+            max_requests=int(max_requests),
+            deployments=deployments,
+        )
+
+        progress_bar = st.progress(0.0)
+        status = st.empty()
+
+        def progress(done, sent, elapsed):
+            progress_bar.progress(min(elapsed / bench_config.duration, 1.0))
+            status.text(f"⏳ {elapsed:.1f}s · 已完成 {done} / 已发送 {sent}")
+
+        results, wall_seconds = run_benchmark(bench_config, progress)
+        progress_bar.progress(1.0)
+        status.text(f"✅ 完成：{len(results)} 个请求，用时 {wall_seconds:.1f}s")
+
+        st.session_state.bench_run = {
+            'config': bench_config,
+            'results': results,
+            'summary': summarize(results, wall_seconds),
+        }
+
+# 显示最近一次结果
+if 'bench_run' in st.session_state:
+    run = st.session_state.bench_run
+    summary = run['summary']
+
+    st.markdown("---")
+    st.subheader("📊 结果")
+
+    col1, col2, col3, col4, col5, col6, col7 = st.columns(7)
+    with col1:
+        st.metric("请求数", summary['requests'])
+    with col2:
+        st.metric("错误率", f"{summary['error_rate'] * 100:.1f}%")
+    with col3:
+        st.metric("429 比例", f"{summary['rate_429'] * 100:.1f}%")
+    with col4:
+        st.metric("实际 RPM", f"{summary['achieved_rpm']:.1f}")
+    with col5:
+        st.metric("实际 TPM", f"{summary['achieved_tpm']:.0f}")
+    with col6:
+        st.metric("用时", f"{summary['wall_seconds']:.1f}s")
+    with col7:
+        st.metric("♻️ 缓存命中率", f"{summary.get('cache_hit_ratio', 0.0):.0%}",
+                  help="cached_tokens / input_tokens（成功请求）")
+
+    st.table({
+        "指标": ["TTFT (s)", "总时长 (s)", "输出速度 (tok/s)"],
+        "p50": [summary[k]['p50'] for k in ('ttft', 'total_duration', 'output_tokens_per_sec')],
+        "p90": [summary[k]['p90'] for k in ('ttft', 'total_duration', 'output_tokens_per_sec')],
+        "p99": [summary[k]['p99'] for k in ('ttft', 'total_duration', 'output_tokens_per_sec')],
+        "平均": [summary[k]['mean'] for k in ('ttft', 'total_duration', 'output_tokens_per_sec')],
+    })
+
+    if summary['deployments']:
+        st.table({
+            "部署": list(summary['deployments']),
+            "请求数": [v['requests'] for v in summary['deployments'].values()],
+            "错误数": [v['errors'] for v in summary['deployments'].values()],
+            "TTFT p50 (s)": [v['ttft_p50'] for v in summary['deployments'].values()],
+        })
+
+    if summary['error_types']:
+        st.warning("错误类型：" + "，".join(f"{k} × {v}" for k, v in summary['error_types'].items()))
+
+    with st.expander("📋 逐请求结果"):
+        st.dataframe([r.__dict__ for r in run['results']], use_container_width=True)
+
+    # 导出
+    csv_buffer = io.StringIO()
+    results_to_csv(run['results'], csv_buffer)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            "⬇️ 导出 JSON",
+            data=json.dumps(
+                build_report(run['config'], run['results'], summary),
+                indent=2, ensure_ascii=False
+            ),
+            file_name="benchmark.json",
+            mime="application/json",
+            use_container_width=True
+        )
+    with col2:
+        st.download_button(
+            "⬇️ 导出 CSV",
+            data=csv_buffer.getvalue(),
+            file_name="benchmark.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
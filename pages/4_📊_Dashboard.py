@@ -0,0 +1,141 @@
+"""
+延迟仪表盘
+展示指标库中每轮请求的时间序列、延迟分布和部署对比
+"""
+
+import streamlit as st
+import time
+from datetime import datetime
+
+
+from metrics_store import (
+    connect, histogram_percentile, list_dimensions, query_comparison,
+    query_histogram, query_recent, query_timeseries
+)
+
+# 页面配置
+st.set_page_config(
+    page_title="延迟仪表盘",
+    page_icon="📊",
+    layout="wide"
+)
+
+# 时间范围 -> (秒数, 时间桶分钟数)
+TIME_RANGES = {
+    "最近 1 小时": (3600, 1),
+    "最近 6 小时": (6 * 3600, 5),
+    "最近 24 小时": (24 * 3600, 15),
+    "最近 7 天": (7 * 24 * 3600, 60),
+    "最近 30 天": (30 * 24 * 3600, 240),
+}
+
+
+@st.cache_resource
+def get_connection():
+    return connect()
+
+
+conn = get_connection()
+
+# 标题
+st.title("📊 延迟仪表盘")
+
+# 侧边栏筛选
+with st.sidebar:
+    st.header("🔎 筛选")
+
+    range_label = st.selectbox("时间范围", options=list(TIME_RANGES), index=2)
+    range_seconds, bucket_minutes = TIME_RANGES[range_label]
+
+    dimensions = list_dimensions(conn)
+    # Realtime 的 TTFT 是首个音频时间，默认只看聊天
+    sources = st.multiselect(
+        "来源", options=dimensions["source"],
+        default=["chat"] if "chat" in dimensions["source"] else None,
+        help="chat：聊天 / 对比；realtime：语音每轮（TTFT 为首个音频）"
+    )
+    endpoints = st.multiselect("Endpoint", options=dimensions["endpoint"])
+    models = st.multiselect("模型", options=dimensions["model"])
+    efforts = st.multiselect("Reasoning Effort", options=dimensions["reasoning_effort"])
+
+    if st.button("🔄 刷新", use_container_width=True):
+        st.rerun()
+
+end = time.time()
+start = end - range_seconds
+filters = {"sources": sources, "endpoints": endpoints, "models": models, "efforts": efforts}
+
+timeseries = query_timeseries(conn, start, end, bucket_minutes=bucket_minutes, **filters)
+if not timeseries:
+    st.info("所选范围内没有数据。在聊天页面发送消息后，指标会自动记录到这里。")
+    st.stop()
+
+ttft_hist = query_histogram(conn, start, end, "ttft", **filters)
+duration_hist = query_histogram(conn, start, end, "total_duration", **filters)
+
+# 总览
+total_requests = sum(row["requests"] for row in timeseries)
+total_errors = sum(row["errors"] for row in timeseries)
+
+col1, col2, col3, col4, col5, col6 = st.columns(6)
+with col1:
+    st.metric("请求数", total_requests)
+with col2:
+    st.metric("错误率", f"{total_errors / total_requests * 100:.1f}%")
+with col3:
+    st.metric("TTFT p50", f"{histogram_percentile(ttft_hist, 50):.2f}s")
+with col4:
+    st.metric("TTFT p90", f"{histogram_percentile(ttft_hist, 90):.2f}s")
+with col5:
+    st.metric("TTFT p99", f"{histogram_percentile(ttft_hist, 99):.2f}s")
+with col6:
+    st.metric("总时长 p50", f"{histogram_percentile(duration_hist, 50):.2f}s")
+
+# 时间序列
+st.subheader("📈 时间序列")
+series = [dict(row, time=datetime.fromtimestamp(row["ts"])) for row in timeseries]
+
+col1, col2 = st.columns(2)
+with col1:
+    st.caption(f"平均 TTFT / 总时长（秒，{bucket_minutes} 分钟一桶）")
+    st.line_chart(series, x="time", y=["ttft", "total_duration"])
+with col2:
+    st.caption("请求数 / 错误数")
+    st.bar_chart(series, x="time", y=["requests", "errors"])
+
+# 延迟分布
+st.subheader("📊 延迟分布")
+col1, col2 = st.columns(2)
+for col, title, histogram in ((col1, "TTFT", ttft_hist), (col2, "总时长", duration_hist)):
+    with col:
+        st.caption(f"{title}（秒，对数分桶）")
+        if histogram:
+            st.bar_chart(
+                [{"区间": f"{value:.3f}", "次数": count} for value, count in histogram],
+                x="区间", y="次数"
+            )
+
+# 部署对比
+st.subheader("🏁 部署对比")
+comparison = query_comparison(conn, start, end, **filters)
+st.dataframe(
+    [
+        dict(
+            row,
+            error_rate=f"{row['error_rate']:.1%}",
+            **{
+                name: round(row[name], 2) if row[name] is not None else None
+                for name in ("ttft_mean", "ttft_p50", "ttft_p90", "ttft_p99", "duration_mean")
+            }
+        )
+        for row in comparison
+    ],
+    use_container_width=True
+)
+
+# 原始记录
+with st.expander("📋 最近记录"):
+    recent = query_recent(conn, start, end)
+    for row in recent:
+        row["ts"] = datetime.fromtimestamp(row["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+    st.dataframe(recent, use_container_width=True)
@@ -0,0 +1,161 @@
+"""
+批量请求
+上传 JSONL / CSV 提示词文件，有界并发执行并逐条写出结果，支持断点续跑
+"""
+
+import streamlit as st
+import threading
+from pathlib import Path
+
+from batch_runner import BatchConfig, count_items, load_checkpoint, run_batch
+from config_store import get_section, list_profiles, load_config
+from image_utils import DETAIL_LEVELS
+from load_balancer import deployments_from_config
+
+# 页面配置
+st.set_page_config(
+    page_title="批量请求",
+    page_icon="📦",
+    layout="wide"
+)
+
+# 批量任务的输入输出目录
+BATCH_DIR = Path("batch_runs")
+
+# 加载配置（与聊天页面共用）
+config = load_config()
+
+# 标题
+st.title("📦 批量请求")
+st.markdown("""
+上传 JSONL（每行 `{"id": ..., "prompt": ..., "image": ...}`）或带表头的 CSV。
+结果逐条追加到输出文件；中断后再次运行会跳过已完成的条目。
+""")
+
+# 侧边栏配置
+with st.sidebar:
+    st.header("⚙️ 目标部署")
+
+    profiles = list_profiles(config)
+    active_profile = config.get('active_profile', 'default')
+    profile = st.selectbox(
+        "配置",
+        options=profiles,
+        index=profiles.index(active_profile) if active_profile in profiles else 0,
+        key="batch_profile"
+    )
+    chat_config = get_section(config, 'chat', profile)
+
+    api_key = st.text_input(
+        "API Key",
+        type="password",
+        value=chat_config.get('api_key', ''),
+        key=f"batch_api_key_{profile}"
+    )
+    endpoint = st.text_input(
+        "Endpoint (Base URL)",
+        value=chat_config.get('endpoint', ''),
+        key=f"batch_endpoint_{profile}"
+    )
+    model = st.text_input(
+        "模型名称",
+        value=chat_config.get('model', 'gpt-4o'),
+        key=f"batch_model_{profile}"
+    )
+    reasoning_effort = st.selectbox(
+        "Reasoning Effort",
+        options=["none", "minimal", "low", "medium", "high"],
+        index=0
+    )
+    image_detail = st.selectbox("图片细节", options=DETAIL_LEVELS)
+    balance_profiles = st.multiselect(
+        "负载均衡（可选）", options=profiles,
+        help="选择多个配置时，每次请求（含重试）按 TTFT / 错误率在这些部署之间路由，权重使用聊天页面保存的值"
+    )
+
+    st.divider()
+
+    st.subheader("🔧 执行")
+    workers = st.number_input("并发数", min_value=1, max_value=64, value=4)
+    max_retries = st.number_input("最大重试次数", min_value=0, max_value=20, value=5)
+    retry_failed = st.checkbox("续跑时重试失败条目", value=False)
+
+# 负载均衡的部署
+balance_weights = config.get('balancer', {}).get('weights', {})
+deployments = deployments_from_config(
+    config, {name: balance_weights.get(name, 1.0) for name in balance_profiles}
+)
+
+uploaded = st.file_uploader("📄 提示词文件", type=['jsonl', 'csv'])
+
+if uploaded is not None:
+    BATCH_DIR.mkdir(exist_ok=True)
+    input_path = BATCH_DIR / uploaded.name
+    # 同名文件内容不变时不重写，避免影响续跑
+    if not input_path.exists() or input_path.read_bytes() != uploaded.getvalue():
+        input_path.write_bytes(uploaded.getvalue())
+
+    output_path = Path(st.text_input(
+        "输出文件",
+        value=str(BATCH_DIR / f"{input_path.stem}.results.jsonl")
+    ))
+
+    total = count_items(input_path)
+    finished = len(load_checkpoint(output_path, retry_failed))
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("条目数", total)
+    with col2:
+        st.metric("已完成（将跳过）", finished)
+
+    if st.button("🚀 开始 / 继续", type="primary", use_container_width=True):
+        if (not api_key or not endpoint) and not deployments:
+            st.error("❌ 请先在侧边栏配置 API Key 和 Endpoint")
+        else:
+            batch_config = BatchConfig(
+                endpoint=endpoint,
+                api_key=api_key,
+                model=model,
+                input_path=str(input_path),
+                output_path=str(output_path),
+                reasoning_effort=reasoning_effort,
+                image_detail=image_detail,
+                workers=int(workers),
+                max_retries=int(max_retries),
+                retry_failed=retry_failed,
+                deployments=deployments,
+            )
+
+            # 点击停止会触发重跑并打断本次执行；run_batch 收到打断后停止在途条目并写出已完成的结果
+            stop_event = threading.Event()
+            st.button("⏹️ 停止", on_click=stop_event.set, use_container_width=True)
+            progress_bar = st.progress(0.0)
+            status = st.empty()
+
+            def progress(stats):
+                done = stats["ok"] + stats["error"] + stats["skipped"]
+                progress_bar.progress(min(done / max(stats["total"], 1), 1.0))
+                status.text(
+                    f"⏳ {stats['elapsed']:.1f}s · {done}/{stats['total']} · "
+                    f"成功 {stats['ok']} · 失败 {stats['error']} · 跳过 {stats['skipped']} · "
+                    f"重试 {stats['retries']}"
+                )
+
+            stats = run_batch(batch_config, progress, stop_event)
+            if stats["stopped"]:
+                st.warning("⏹️ 已停止，再次点击开始即可从断点继续")
+            else:
+                progress_bar.progress(1.0)
+                st.success(
+                    f"✅ 完成：成功 {stats['ok']}，失败 {stats['error']}，跳过 {stats['skipped']}，"
+                    f"用时 {stats['elapsed']:.1f}s，共 {stats['tokens']} tokens"
+                )
+
+    if output_path.exists():
+        st.download_button(
+            "⬇️ 下载结果",
+            data=output_path.read_bytes(),
+            file_name=output_path.name,
+            mime="application/jsonl",
+            use_container_width=True
+        )
@@ -0,0 +1,221 @@
+"""
+部署配额限流
+进程级令牌桶，按部署的 RPM / TPM 预算准入请求，各会话轮流获得配额
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+# 图片按 high detail 的典型值估算
+IMAGE_TOKEN_ESTIMATE = 765
+
+
+class AdmissionRejected(Exception):
+    """排队超时或队列已满，请求被拒绝"""
+
+
+@dataclass
+class Ticket:
+    """一次准入"""
+    session_id: str
+    estimated_tokens: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+    granted_at: float = None
+
+    @property
+    def wait_seconds(self):
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+
+def estimate_request_tokens(request, expected_output_tokens=1000):
+    """不联网估算请求会消耗的 token：input 约 4 字节一个 token，图片按固定值，加上预期输出"""
+    images = 0
+
+    def strip_images(value):
+        nonlocal images
+        if isinstance(value, dict):
+            if value.get("type") == "input_image":
+                images += 1
+                return None
+            return {k: strip_images(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [strip_images(v) for v in value]
+        return value
+
+    payload = strip_images([request.get("instructions"), request.get("input")])
+    text_bytes = len(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+    return text_bytes // 4 + images * IMAGE_TOKEN_ESTIMATE + expected_output_tokens
+
+
+class DeploymentLimiter:
+    """
+    单个部署的 RPM / TPM 令牌桶
+
+    - 两个桶按每分钟预算匀速补充，容量即每分钟预算
+    - 等待中的请求按会话轮转（round robin），同一会话内先进先出
+    - 每个会话排队数和最长等待时间有上限，超出时拒绝
+    - 响应头 x-ratelimit-remaining-* 比本地估计更少时以服务端为准；429 时暂停准入
+    """
+
+    def __init__(self, rpm, tpm, max_wait=30.0, max_queue_per_session=4):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        self.max_queue_per_session = max_queue_per_session
+        self._cond = threading.Condition()
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._queues = {}
+        self._order = deque()
+        self.admitted = 0
+        self.rejected = 0
+
+    def configure(self, rpm, tpm, max_wait, max_queue_per_session):
+        with self._cond:
+            self.rpm = rpm
+            self.tpm = tpm
+            self._requests = min(self._requests, rpm)
+            self._tokens = min(self._tokens, tpm)
+            self.max_wait = max_wait
+            self.max_queue_per_session = max_queue_per_session
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _time_until_available(self, ticket, now):
+        """当前桶里不够时，还需要等多久"""
+        waits = [self._paused_until - now]
+        if self._requests < 1:
+            waits.append((1 - self._requests) * 60 / self.rpm)
+        # 单个请求超过整桶容量时，只要求桶是满的
+        needed = min(ticket.estimated_tokens, self.tpm)
+        if self._tokens < needed:
+            waits.append((needed - self._tokens) * 60 / self.tpm)
+        return max(waits)
+
+    def _is_next(self, ticket):
+        return (
+            self._order and self._order[0] == ticket.session_id
+            and self._queues[ticket.session_id][0] is ticket
+        )
+
+    def _dequeue(self, ticket):
+        queue = self._queues[ticket.session_id]
+        queue.remove(ticket)
+        self._order.remove(ticket.session_id)
+        if queue:
+            # 本会话还有等待的请求，排到队尾
+            self._order.append(ticket.session_id)
+        else:
+            del self._queues[ticket.session_id]
+
+    def acquire(self, session_id, estimated_tokens):
+        """阻塞直到获得配额，返回 Ticket；超时或排队已满时抛出 AdmissionRejected"""
+        ticket = Ticket(session_id=session_id, estimated_tokens=estimated_tokens)
+        deadline = ticket.enqueued_at + self.max_wait
+        with self._cond:
+            queue = self._queues.get(session_id)
+            if queue is not None and len(queue) >= self.max_queue_per_session:
+                self.rejected += 1
+                raise AdmissionRejected(f"会话排队已满（{self.max_queue_per_session}）")
+            if queue is None:
+                queue = self._queues[session_id] = deque()
+                self._order.append(session_id)
+            queue.append(ticket)
+
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._is_next(ticket):
+                    wait = self._time_until_available(ticket, now)
+                    if wait <= 0:
+                        self._requests -= 1
+                        self._tokens -= ticket.estimated_tokens
+                        ticket.granted_at = now
+                        self._dequeue(ticket)
+                        self.admitted += 1
+                        self._cond.notify_all()
+                        return ticket
+                else:
+                    wait = 0.1
+                if now >= deadline:
+                    self._dequeue(ticket)
+                    self.rejected += 1
+                    self._cond.notify_all()
+                    raise AdmissionRejected(f"排队超过 {self.max_wait:.0f}s")
+                self._cond.wait(max(0.005, min(wait, deadline - now, 0.5)))
+
+    def reconcile(self, ticket, actual_tokens):
+        """用 response.completed 中的实际用量修正预估"""
+        with self._cond:
+            self._tokens = min(self.tpm, self._tokens + ticket.estimated_tokens - actual_tokens)
+            self._cond.notify_all()
+
+    def update_from_headers(self, headers):
+        """服务端剩余额度比本地少时以服务端为准"""
+        with self._cond:
+            try:
+                remaining_requests = headers.get("x-ratelimit-remaining-requests")
+                if remaining_requests is not None:
+                    self._requests = min(self._requests, float(remaining_requests))
+                remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+                if remaining_tokens is not None:
+                    self._tokens = min(self._tokens, float(remaining_tokens))
+            except ValueError:
+                pass
+
+    def on_rate_limited(self, headers):
+        """收到 429：在 Retry-After 内暂停所有准入"""
+        retry_after = 1.0
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except ValueError:
+            pass
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._requests = min(self._requests, 0.0)
+        self.update_from_headers(headers)
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "requests_available": self._requests,
+                "tokens_available": self._tokens,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "sessions_waiting": len(self._queues),
+                "paused_seconds": max(0.0, self._paused_until - now),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(endpoint, model, rpm, tpm, max_wait=30.0, max_queue_per_session=4):
+    """按 (endpoint, model) 共享限流器；参数变化时更新"""
+    key = (endpoint.rstrip('/'), model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = DeploymentLimiter(rpm, tpm, max_wait, max_queue_per_session)
+            return limiter
+    if (limiter.rpm, limiter.tpm, limiter.max_wait, limiter.max_queue_per_session) != \
+            (rpm, tpm, max_wait, max_queue_per_session):
+        limiter.configure(rpm, tpm, max_wait, max_queue_per_session)
+    return limiter
@@ -0,0 +1,479 @@
+"""
+Realtime 语音延迟压测（无需浏览器）
+通过 WebSocket 连接 Realtime 接口，按实时速度发送录好的语音，记录每段语音从说完到首段音频的延迟
+
+用法：
+    python realtime_benchmark.py --audio samples/ --concurrency 4 --repeat 5 --out realtime.json
+    python realtime_benchmark.py --profile eastus --profile westus --api-version 2024-10-01-preview --audio samples/
+    python realtime_benchmark.py --mock --repeat 10
+
+音频为 .wav（16-bit PCM，自动转为 24kHz 单声道）或 .pcm / .raw（24kHz 单声道 PCM16）
+"""
+
+import argparse
+import asyncio
+import base64
+import csv
+import json
+import math
+import sys
+import time
+import wave
+from array import array
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+from websockets.asyncio.client import connect
+
+from config_store import DEFAULT_PROFILE, get_section, load_config
+from stream_metrics import percentile
+
+SAMPLE_RATE = 24000
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+
+AUDIO_SUFFIXES = (".wav", ".pcm", ".raw")
+AUDIO_DELTA_EVENTS = ("response.audio.delta", "response.output_audio.delta")
+TEXT_DELTA_EVENTS = (
+    "response.audio_transcript.delta", "response.output_audio_transcript.delta", "response.text.delta",
+)
+
+
+@dataclass
+class RealtimeBenchConfig:
+    """压测参数"""
+    endpoint: str
+    api_key: str
+    deployment: str
+    api_version: str = "2024-10-01-preview"
+    # [(名称, 24kHz 单声道 PCM16 字节)]
+    utterances: list = field(default_factory=list)
+    concurrency: int = 1
+    # 每段语音发送的次数
+    repeat: int = 1
+    chunk_ms: int = 40
+    # manual：发完后 commit + response.create；server_vad：追加静音，由服务端判断说完
+    turn_detection: str = "manual"
+    trailing_silence_ms: int = 1500
+    silence_duration_ms: int = 500
+    transcription: bool = True
+    voice: str = "alloy"
+    timeout: float = 60.0
+    # 结果标签（命名配置），多部署对比时区分
+    label: str = ""
+
+
+@dataclass
+class UtteranceResult:
+    """单段语音的结果（时间单位：秒，起点为语音发送完毕即“说完”）"""
+    index: int
+    utterance: str
+    audio_seconds: float
+    started_at: float = 0.0
+    connect: float = 0.0
+    # server_vad 时服务端判定说完（speech_stopped）的延迟
+    vad_stop: float = 0.0
+    response_created: float = 0.0
+    first_audio: float = 0.0
+    first_text: float = 0.0
+    total_duration: float = 0.0
+    input_transcript_latency: float = 0.0
+    response_audio_seconds: float = 0.0
+    transcript: str = ""
+    input_transcript: str = ""
+    input_tokens: int = 0
+    output_tokens: int = 0
+    status: str = ""
+    error: str = ""
+
+
+# ---------- 音频 ----------
+
+def _to_mono_24k(samples, channels, rate):
+    if channels > 1:
+        samples = array('h', (
+            sum(samples[i:i + channels]) // channels for i in range(0, len(samples), channels)
+        ))
+    if rate == SAMPLE_RATE or not samples:
+        return samples
+    # 线性插值重采样
+    count = max(1, int(len(samples) * SAMPLE_RATE / rate))
+    step = (len(samples) - 1) / max(count - 1, 1)
+    resampled = array('h')
+    for i in range(count):
+        position = i * step
+        low = int(position)
+        high = min(low + 1, len(samples) - 1)
+        resampled.append(int(samples[low] + (samples[high] - samples[low]) * (position - low)))
+    return resampled
+
+
+def load_audio(path):
+    """读取语音文件，返回 24kHz 单声道 PCM16 字节"""
+    path = Path(path)
+    if path.suffix.lower() != ".wav":
+        return path.read_bytes()
+    with wave.open(str(path), 'rb') as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: 只支持 16-bit PCM WAV")
+        channels = f.getnchannels()
+        rate = f.getframerate()
+        samples = array('h', f.readframes(f.getnframes()))
+    if sys.byteorder == "big":
+        samples.byteswap()
+    samples = _to_mono_24k(samples, channels, rate)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def load_utterances(path):
+    """目录（按文件名排序）或单个文件 → [(名称, PCM 字节)]"""
+    path = Path(path)
+    files = sorted(p for p in path.iterdir() if p.suffix.lower() in AUDIO_SUFFIXES) if path.is_dir() else [path]
+    return [(p.name, load_audio(p)) for p in files]
+
+
+def synth_utterance(seconds=1.5, frequency=220.0):
+    """合成一段带起伏的音调（模拟服务的离线压测用，不需要录音）"""
+    count = int(SAMPLE_RATE * seconds)
+    samples = array('h', (
+        int(8000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE) * (0.6 + 0.4 * math.sin(i / 2400)))
+        for i in range(count)
+    ))
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def realtime_ws_url(endpoint, api_version, deployment):
+    """Realtime 页面的 endpoint（https://.../openai/realtime）→ WebSocket URL"""
+    parts = urlsplit(endpoint)
+    scheme = {"https": "wss", "http": "ws"}.get(parts.scheme, parts.scheme)
+    query = urlencode({"api-version": api_version, "deployment": deployment})
+    return urlunsplit((scheme, parts.netloc, parts.path, query, ""))
+
+
+# ---------- 单段语音 ----------
+
+def _session_update(config):
+    if config.turn_detection == "server_vad":
+        turn_detection = {
+            "type": "server_vad",
+            "silence_duration_ms": config.silence_duration_ms,
+            "create_response": True,
+        }
+    else:
+        turn_detection = None
+    return {
+        "type": "session.update",
+        "session": {
+            "modalities": ["audio", "text"],
+            "voice": config.voice,
+            "input_audio_format": "pcm16",
+            "output_audio_format": "pcm16",
+            "turn_detection": turn_detection,
+            "input_audio_transcription": {"model": "whisper-1"} if config.transcription else None,
+        },
+    }
+
+
+async def _send_audio(websocket, pcm, chunk_ms, start):
+    """按实时速度发送，返回最后一块发出的时间"""
+    chunk_bytes = BYTES_PER_SECOND * chunk_ms // 1000
+    for i, offset in enumerate(range(0, len(pcm), chunk_bytes)):
+        delay = start + i * chunk_ms / 1000 - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await websocket.send(json.dumps({
+            "type": "input_audio_buffer.append",
+            "audio": base64.b64encode(pcm[offset:offset + chunk_bytes]).decode('ascii'),
+        }))
+    return time.perf_counter()
+
+
+async def _run_one(config, url, index, name, pcm, bench_start):
+    result = UtteranceResult(index=index, utterance=name, audio_seconds=len(pcm) / BYTES_PER_SECOND)
+    started = time.perf_counter()
+    result.started_at = started - bench_start
+    marks = {}
+    transcript = []
+    response_audio_bytes = 0
+
+    try:
+        async with connect(url, additional_headers={"api-key": config.api_key},
+                           max_size=None, open_timeout=config.timeout) as websocket:
+            async def receive():
+                nonlocal response_audio_bytes
+                async for raw in websocket:
+                    event = json.loads(raw)
+                    event_type = event.get("type")
+                    now = time.perf_counter()
+                    if event_type == "session.created":
+                        marks.setdefault("session", now)
+                    elif event_type == "error":
+                        raise RuntimeError((event.get("error") or {}).get("message", "error"))
+                    elif event_type == "input_audio_buffer.speech_stopped":
+                        marks.setdefault("vad_stop", now)
+                    elif event_type == "conversation.item.input_audio_transcription.completed":
+                        marks.setdefault("input_transcript", now)
+                        result.input_transcript = event.get("transcript", "")
+                    elif event_type == "response.created":
+                        marks.setdefault("response_created", now)
+                    elif event_type in AUDIO_DELTA_EVENTS:
+                        marks.setdefault("first_audio", now)
+                        response_audio_bytes += len(base64.b64decode(event.get("delta", "")))
+                    elif event_type in TEXT_DELTA_EVENTS:
+                        marks.setdefault("first_text", now)
+                        transcript.append(event.get("delta", ""))
+                    elif event_type == "response.done":
+                        marks["done"] = now
+                        response = event.get("response") or {}
+                        usage = response.get("usage") or {}
+                        result.status = response.get("status", "")
+                        result.input_tokens = usage.get("input_tokens", 0)
+                        result.output_tokens = usage.get("output_tokens", 0)
+                        if result.status != "completed":
+                            details = response.get("status_details") or {}
+                            result.error = result.status or "Incomplete"
+                            if details.get("error"):
+                                result.error = f"{result.error}: {details['error'].get('message', '')}"
+                        return
+
+            receiver = asyncio.create_task(receive())
+            await websocket.send(json.dumps(_session_update(config)))
+            result.connect = time.perf_counter() - started
+
+            speech_start = time.perf_counter()
+            speech_end = await _send_audio(websocket, pcm, config.chunk_ms, speech_start)
+            if config.turn_detection == "server_vad":
+                silence = bytes(BYTES_PER_SECOND * config.trailing_silence_ms // 1000)
+                sender = asyncio.create_task(_send_audio(websocket, silence, config.chunk_ms, speech_end))
+            else:
+                await websocket.send(json.dumps({"type": "input_audio_buffer.commit"}))
+                await websocket.send(json.dumps({"type": "response.create"}))
+                sender = None
+
+            await asyncio.wait_for(receiver, config.timeout)
+            if sender is not None:
+                sender.cancel()
+
+        if "done" not in marks:
+            result.error = "Closed"
+
+        def since_end(mark):
+            return marks[mark] - speech_end if mark in marks else 0.0
+
+        result.vad_stop = since_end("vad_stop")
+        result.response_created = since_end("response_created")
+        result.first_audio = since_end("first_audio")
+        result.first_text = since_end("first_text")
+        result.total_duration = since_end("done")
+        result.input_transcript_latency = since_end("input_transcript")
+        result.response_audio_seconds = response_audio_bytes / BYTES_PER_SECOND
+        result.transcript = "".join(transcript)
+    except asyncio.TimeoutError:
+        result.error = "Timeout"
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"[:200]
+    return result
+
+
+# ---------- 压测 ----------
+
+async def _run_all(config, progress):
+    url = realtime_ws_url(config.endpoint, config.api_version, config.deployment)
+    jobs = asyncio.Queue()
+    for round_index in range(config.repeat):
+        for name, pcm in config.utterances:
+            jobs.put_nowait((jobs.qsize(), name, pcm))
+    total = jobs.qsize()
+    results = []
+    bench_start = time.perf_counter()
+
+    async def worker():
+        while True:
+            try:
+                index, name, pcm = jobs.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results.append(await _run_one(config, url, index, name, pcm, bench_start))
+            if progress is not None:
+                progress(len(results), total, time.perf_counter() - bench_start)
+
+    await asyncio.gather(*(worker() for _ in range(max(config.concurrency, 1))))
+    return results, time.perf_counter() - bench_start
+
+
+def run_realtime_benchmark(config, progress=None):
+    """执行压测，返回 (results, wall_seconds)；progress(done, total, elapsed)"""
+    results, wall_seconds = asyncio.run(_run_all(config, progress))
+    results.sort(key=lambda r: r.index)
+    return results, wall_seconds
+
+
+def summarize(results, wall_seconds):
+    """百分位数和错误率"""
+    ok = [r for r in results if not r.error]
+    total = len(results)
+
+    def pcts(values):
+        values = [v for v in values if v]
+        return {
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'mean': sum(values) / len(values) if values else 0.0,
+        }
+
+    return {
+        'utterances': total,
+        'succeeded': len(ok),
+        'errors': total - len(ok),
+        'error_rate': (total - len(ok)) / total if total else 0.0,
+        'wall_seconds': wall_seconds,
+        'connect': pcts([r.connect for r in ok]),
+        'vad_stop': pcts([r.vad_stop for r in ok]),
+        'first_audio': pcts([r.first_audio for r in ok]),
+        'total_duration': pcts([r.total_duration for r in ok]),
+        'input_transcript_latency': pcts([r.input_transcript_latency for r in ok]),
+        'response_audio_seconds': pcts([r.response_audio_seconds for r in ok]),
+        'error_types': {
+            error: sum(1 for r in results if r.error == error)
+            for error in sorted({r.error for r in results if r.error})
+        },
+    }
+
+
+def build_report(config, results, summary):
+    """完整结果（不包含 API Key 和音频内容）"""
+    config_dict = asdict(config)
+    config_dict.pop('api_key', None)
+    config_dict['utterances'] = [
+        {'name': name, 'seconds': len(pcm) / BYTES_PER_SECOND} for name, pcm in config.utterances
+    ]
+    return {
+        'config': config_dict,
+        'summary': summary,
+        'results': [asdict(r) for r in results],
+    }
+
+
+def export_csv(rows, path):
+    """逐段结果写为 CSV（多部署时带 label 列）"""
+    fieldnames = ['label'] + list(UtteranceResult.__dataclass_fields__)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for label, result in rows:
+            writer.writerow({'label': label, **asdict(result)})
+
+
+def format_comparison(reports):
+    """多个部署 / API 版本的对比表（毫秒）"""
+    header = f"{'部署':<28}{'成功':>6}{'错误率':>8}{'首段音频 P50':>14}{'P90':>8}{'P99':>8}{'完成 P50':>10}"
+    lines = [header]
+    for report in reports:
+        config, summary = report['config'], report['summary']
+        label = f"{config['label'] or config['deployment']} @ {config['api_version']}"
+        lines.append(
+            f"{label:<28}{summary['succeeded']:>6}{summary['error_rate']:>8.1%}"
+            f"{summary['first_audio']['p50'] * 1000:>14.0f}{summary['first_audio']['p90'] * 1000:>8.0f}"
+            f"{summary['first_audio']['p99'] * 1000:>8.0f}{summary['total_duration']['p50'] * 1000:>10.0f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Realtime 语音延迟压测（WebSocket）")
+    parser.add_argument("--config", default="config.json", help="配置文件，读取其中的 realtime 配置")
+    parser.add_argument("--profile", action="append", default=[],
+                        help="使用的命名配置，可重复以对比多个部署")
+    parser.add_argument("--api-version", action="append", default=[],
+                        help="覆盖 API 版本，可重复以对比多个版本")
+    parser.add_argument("--endpoint", help="覆盖配置文件中的 endpoint")
+    parser.add_argument("--api-key", help="覆盖配置文件中的 api_key")
+    parser.add_argument("--deployment", help="覆盖配置文件中的 deployment")
+    parser.add_argument("--audio", help="语音文件或目录（.wav / .pcm / .raw）")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1, help="每段语音发送的次数")
+    parser.add_argument("--chunk-ms", type=int, default=40, help="每次发送的音频时长")
+    parser.add_argument("--turn-detection", default="manual", choices=["manual", "server_vad"])
+    parser.add_argument("--trailing-silence-ms", type=int, default=1500)
+    parser.add_argument("--silence-duration-ms", type=int, default=500)
+    parser.add_argument("--no-transcription", action="store_true", help="关闭输入语音转写")
+    parser.add_argument("--voice", default="alloy")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--mock", action="store_true", help="在进程内启动本地 Realtime 模拟服务并对其压测")
+    parser.add_argument("--out", help="导出 JSON")
+    parser.add_argument("--csv", help="导出 CSV")
+    args = parser.parse_args(argv)
+
+    if args.audio:
+        utterances = load_utterances(args.audio)
+    elif args.mock:
+        utterances = [(f"synth-{seconds}s", synth_utterance(seconds)) for seconds in (1.0, 2.0, 3.0)]
+    else:
+        parser.error("缺少 --audio")
+    if not utterances:
+        parser.error(f"{args.audio} 中没有语音文件")
+
+    mock_endpoint = None
+    if args.mock:
+        from mock_server import start_mock_realtime_server
+        _, mock_endpoint = start_mock_realtime_server()
+
+    file_config = load_config(args.config)
+    configs = []
+    for profile in args.profile or [DEFAULT_PROFILE]:
+        realtime_config = get_section(file_config, 'realtime', profile)
+        for api_version in args.api_version or [realtime_config.get('api_version', '2024-10-01-preview')]:
+            config = RealtimeBenchConfig(
+                endpoint=mock_endpoint or args.endpoint or realtime_config.get('endpoint', ''),
+                api_key=args.api_key or realtime_config.get('api_key', '') or ("mock" if args.mock else ''),
+                deployment=args.deployment or realtime_config.get('deployment', 'gpt-realtime'),
+                api_version=api_version,
+                utterances=utterances,
+                concurrency=args.concurrency,
+                repeat=args.repeat,
+                chunk_ms=args.chunk_ms,
+                turn_detection=args.turn_detection,
+                trailing_silence_ms=args.trailing_silence_ms,
+                silence_duration_ms=args.silence_duration_ms,
+                transcription=not args.no_transcription,
+                voice=args.voice,
+                timeout=args.timeout,
+                label=profile if args.profile else "",
+            )
+            if not config.endpoint or not config.api_key:
+                parser.error(f"配置 {profile} 缺少 endpoint 或 api_key")
+            configs.append(config)
+
+    reports = []
+    csv_rows = []
+    for config in configs:
+        print(f"== {config.label or config.deployment} @ {config.api_version}")
+
+        def progress(done, total, elapsed):
+            print(f"\r[{elapsed:6.1f}s] 已完成 {done} / {total}", end="", flush=True)
+
+        results, wall_seconds = run_realtime_benchmark(config, progress)
+        print()
+        summary = summarize(results, wall_seconds)
+        reports.append(build_report(config, results, summary))
+        csv_rows.extend((config.label or config.deployment, r) for r in results)
+        if len(configs) == 1:
+            print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+    if len(configs) > 1:
+        print(format_comparison(reports))
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(reports[0] if len(reports) == 1 else {'runs': reports}, f, indent=2, ensure_ascii=False)
+    if args.csv:
+        export_csv(csv_rows, args.csv)
+
+
+if __name__ == "__main__":
+    main()
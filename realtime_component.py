@@ -0,0 +1,129 @@
+"""
+Realtime WebRTC 组件
+前端在 frontend/realtime/，以双向组件方式加载：Python 传入连接配置，前端回传建连阶段耗时等报告
+"""
+
+from pathlib import Path
+
+import streamlit.components.v1 as components
+
+FRONTEND_DIR = Path(__file__).parent / "frontend" / "realtime"
+
+_component = components.declare_component("realtime_webrtc", path=str(FRONTEND_DIR))
+
+VOICES = ["alloy", "ash", "ballad", "coral", "echo", "sage", "shimmer", "verse"]
+# none 关闭轮次检测，由前端“发送本轮”按钮提交音频缓冲并请求回复
+VAD_TYPES = ["server_vad", "semantic_vad", "none"]
+# audio 表示语音回复（附带文字转写），text 表示只回复文字
+MODALITIES = {"audio": ["audio", "text"], "text": ["text"]}
+
+# session.update 预设：VAD 静音时长决定说完后多久开始回复，输入转写会增加服务端负担
+SESSION_PRESETS = {
+    "lowest_latency": {
+        "label": "⚡ 最低延迟",
+        "vad": "server_vad",
+        "threshold": 0.5,
+        "prefix_padding_ms": 200,
+        "silence_duration_ms": 200,
+        "eagerness": "high",
+        "transcription": False,
+        "max_output_tokens": 512,
+        "voice": "alloy",
+        "modalities": "audio",
+    },
+    "balanced": {
+        "label": "⚖️ 均衡",
+        "vad": "server_vad",
+        "threshold": 0.5,
+        "prefix_padding_ms": 300,
+        "silence_duration_ms": 500,
+        "eagerness": "auto",
+        "transcription": True,
+        "max_output_tokens": 0,
+        "voice": "alloy",
+        "modalities": "audio",
+    },
+    "accurate_transcription": {
+        "label": "📝 准确转写",
+        "vad": "semantic_vad",
+        "threshold": 0.6,
+        "prefix_padding_ms": 500,
+        "silence_duration_ms": 800,
+        "eagerness": "low",
+        "transcription": True,
+        "max_output_tokens": 0,
+        "voice": "alloy",
+        "modalities": "audio",
+    },
+}
+
+CUSTOM_PRESET = "custom"
+
+
+def preset_name(settings, preset):
+    """设置与所选预设一致时返回预设名，否则为 custom"""
+    defaults = SESSION_PRESETS.get(preset)
+    if defaults is None:
+        return CUSTOM_PRESET
+    if any(settings.get(name) != value for name, value in defaults.items() if name != "label"):
+        return CUSTOM_PRESET
+    return preset
+
+
+def build_session(settings, transcription_model="whisper-1"):
+    """页面设置 → session.update 的 session 字段"""
+    if settings["vad"] == "server_vad":
+        turn_detection = {
+            "type": "server_vad",
+            "threshold": settings["threshold"],
+            "prefix_padding_ms": settings["prefix_padding_ms"],
+            "silence_duration_ms": settings["silence_duration_ms"],
+            "create_response": True,
+        }
+    elif settings["vad"] == "semantic_vad":
+        turn_detection = {
+            "type": "semantic_vad",
+            "eagerness": settings["eagerness"],
+            "create_response": True,
+        }
+    else:
+        turn_detection = None
+    return {
+        "modalities": MODALITIES[settings["modalities"]],
+        "voice": settings["voice"],
+        "turn_detection": turn_detection,
+        "input_audio_transcription": {"model": transcription_model} if settings["transcription"] else None,
+        "max_response_output_tokens": settings["max_output_tokens"] or "inf",
+    }
+
+
+def realtime_session(api_key, endpoint, deployment, api_version, prewarm=True,
+                     session=None, preset=None, key=None, prewarm_after_stop=False):
+    """
+    渲染实时语音界面，返回前端最近的报告列表（没有报告时为空列表）
+
+    - prewarm=True 时页面加载后立即获取麦克风、收集 ICE 并创建 Offer，点击后只需交换 SDP
+    - 停止对话时释放麦克风；prewarm_after_stop=True 时随即重新预热（会再次占用麦克风）
+    - session 为 session.update 的内容，通道打开时发送；会话中变化时立即重新发送
+    - preset 随每轮延迟报告一起回传
+    """
+    value = _component(
+        api_key=api_key,
+        endpoint=endpoint,
+        deployment=deployment,
+        api_version=api_version,
+        prewarm=prewarm,
+        prewarm_after_stop=prewarm_after_stop,
+        session=session,
+        preset=preset,
+        key=key,
+        default=None,
+    )
+    return (value or {}).get("reports", [])
+
+
+def new_reports(reports, seen):
+    """按 id 去重，返回尚未处理的报告；seen 为调用方保存的 id 集合"""
+    fresh = [report for report in reports if report.get("id") not in seen]
+    seen.update(report["id"] for report in fresh if report.get("id"))
+    return fresh
@@ -0,0 +1,261 @@
+"""
+响应缓存
+按请求内容的规范化哈希缓存流式响应（内存 LRU + 磁盘），命中时按原增量回放
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from types import SimpleNamespace
+
+from chat_request import abort_stream
+
+CACHE_DIR = Path(".response_cache")
+
+
+def _canonical(value):
+    """把 data URL 图片替换为内容哈希，避免原始图片进入缓存键"""
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key == "image_url" and isinstance(item, str) and item.startswith("data:"):
+                result[key] = "sha256:" + hashlib.sha256(item.encode('utf-8')).hexdigest()
+            else:
+                result[key] = _canonical(item)
+        return result
+    if isinstance(value, list):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def cache_key(request, endpoint):
+    """endpoint 与请求参数（不含 stream）的规范化哈希；不同资源上同名的部署不共用缓存"""
+    payload = {key: value for key, value in request.items() if key != "stream"}
+    payload["endpoint"] = endpoint.rstrip('/')
+    canonical = json.dumps(_canonical(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return None
+    input_details = getattr(usage, 'input_tokens_details', None)
+    output_details = getattr(usage, 'output_tokens_details', None)
+    return {
+        "input_tokens": getattr(usage, 'input_tokens', 0) or 0,
+        "input_tokens_details": {
+            "cached_tokens": getattr(input_details, 'cached_tokens', 0) or 0,
+        },
+        "output_tokens": getattr(usage, 'output_tokens', 0) or 0,
+        "output_tokens_details": {
+            "reasoning_tokens": getattr(output_details, 'reasoning_tokens', 0) or 0,
+        },
+        "total_tokens": getattr(usage, 'total_tokens', 0) or 0,
+    }
+
+
+def _usage_namespace(usage):
+    if usage is None:
+        return None
+    return SimpleNamespace(
+        input_tokens=usage["input_tokens"],
+        input_tokens_details=SimpleNamespace(**usage["input_tokens_details"]),
+        output_tokens=usage["output_tokens"],
+        output_tokens_details=SimpleNamespace(**usage["output_tokens_details"]),
+        total_tokens=usage["total_tokens"],
+    )
+
+
+def replay_events(entry):
+    """把缓存条目转换为与 SDK 流式事件同形的对象序列"""
+    response = SimpleNamespace(id=entry["response_id"], usage=_usage_namespace(entry["usage"]))
+    yield SimpleNamespace(type="response.created", response=response)
+    for delta in entry["deltas"]:
+        yield SimpleNamespace(type="response.output_text.delta", delta=delta)
+    yield SimpleNamespace(type="response.completed", response=response)
+
+
+class RecordingStream:
+    """
+    包装真实的流：透传事件，完整结束时写入缓存
+
+    key 为缓存键，或在结束时计算缓存键的函数（对冲时按胜出的部署）
+    """
+
+    def __init__(self, stream, cache, key, request_size):
+        self.stream = stream
+        self.cache = cache
+        self.key = key
+        self.request_size = request_size
+
+    def __iter__(self):
+        deltas = []
+        for event in self.stream:
+            if event.type == "response.output_text.delta" and event.delta:
+                deltas.append(event.delta)
+            elif event.type == "response.completed":
+                response = getattr(event, 'response', None)
+                key = self.key() if callable(self.key) else self.key
+                self.cache.put(key, {
+                    "response_id": getattr(response, 'id', None),
+                    "usage": _usage_dict(getattr(response, 'usage', None)),
+                    "deltas": deltas,
+                    "request_size": self.request_size,
+                })
+            yield event
+
+    def close(self):
+        abort_stream(self.stream)
+
+
+class ResponseCache:
+    """内存 LRU + 磁盘两级缓存，按 TTL 和大小淘汰"""
+
+    def __init__(self, directory=CACHE_DIR, ttl=24 * 3600,
+                 max_memory_bytes=32 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.tokens_saved = 0
+
+    def configure(self, ttl=None, max_memory_bytes=None, max_disk_bytes=None):
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if max_memory_bytes is not None:
+                self.max_memory_bytes = max_memory_bytes
+            if max_disk_bytes is not None:
+                self.max_disk_bytes = max_disk_bytes
+            self._evict_memory()
+
+    def _evict_memory(self):
+        while self._memory and self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted["size"]
+
+    def _path(self, key):
+        return self.directory / f"{key}.json"
+
+    def get(self, key):
+        """命中返回条目并计入统计，否则返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry["created_at"] > self.ttl:
+                self._memory.pop(key)
+                self._memory_bytes -= entry["size"]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+
+        if entry is None:
+            entry = self._load(key, now)
+            if entry is not None:
+                self._remember(key, entry)
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += entry["request_size"] + entry["size"]
+            if entry["usage"]:
+                self.tokens_saved += entry["usage"]["total_tokens"]
+        return entry
+
+    def _load(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - entry["created_at"] > self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+        # 更新 mtime，磁盘淘汰按最近使用排序
+        os.utime(path)
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old["size"]
+            self._memory[key] = entry
+            self._memory_bytes += entry["size"]
+            self._evict_memory()
+
+    def put(self, key, entry):
+        entry = dict(entry)
+        entry["created_at"] = time.time()
+        entry["size"] = sum(len(delta.encode('utf-8')) for delta in entry["deltas"])
+        self._remember(key, entry)
+
+        # 磁盘：先写临时文件再替换，避免读到半个文件
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """删除过期文件；总大小超限时从最旧的开始删除"""
+        now = time.time()
+        files = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+            else:
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        for path in self.directory.glob("*.json"):
+            path.unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "tokens_saved": self.tokens_saved,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+
+
+_cache = ResponseCache()
+
+
+def get_response_cache():
+    """进程级单例"""
+    return _cache
@@ -0,0 +1,126 @@
+"""
+流式请求延迟指标
+记录每个事件的单调时间戳，计算 TTFT、token 间延迟、TPOT、吞吐和卡顿
+"""
+
+import math
+import time
+from dataclasses import dataclass, field
+
+
+def percentile(values, p):
+    """线性插值百分位数，values 为空时返回 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return ordered[low]
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+@dataclass
+class TurnMetrics:
+    """单轮请求的结构化指标（时间单位：秒）"""
+    response_id: str = None
+    ttft: float = 0.0
+    total_duration: float = 0.0
+    reasoning_seconds: float = 0.0
+    itl_p50: float = 0.0
+    itl_p90: float = 0.0
+    itl_p99: float = 0.0
+    itl_max: float = 0.0
+    tpot: float = 0.0
+    output_tokens_per_sec: float = 0.0
+    stall_count: int = 0
+    stall_seconds: float = 0.0
+    text_deltas: int = 0
+    input_tokens: int = 0
+    # 命中前缀缓存的 input tokens
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    reasoning_tokens: int = 0
+    total_tokens: int = 0
+    completed: bool = False
+
+
+@dataclass
+class StreamRecorder:
+    """在流式循环中逐个喂入事件"""
+    stall_threshold: float = 1.0
+    start: float = field(default_factory=time.perf_counter)
+    first_event: float = None
+    first_text: float = None
+    last_text: float = None
+    end: float = None
+    gaps: list = field(default_factory=list)
+    metrics: TurnMetrics = field(default_factory=TurnMetrics)
+
+    def on_event(self, event):
+        now = time.perf_counter()
+        if self.first_event is None:
+            self.first_event = now
+
+        # 文本增量：记录 token 间隔
+        if event.type == "response.output_text.delta":
+            if self.first_text is None:
+                self.first_text = now
+            else:
+                self.gaps.append(now - self.last_text)
+            self.last_text = now
+            self.metrics.text_deltas += 1
+
+        elif event.type == "response.created":
+            self.metrics.response_id = event.response.id
+
+        # 完成事件：提取 usage
+        elif event.type == "response.completed":
+            self.metrics.completed = True
+            response = getattr(event, 'response', None)
+            if response is not None:
+                self.metrics.response_id = response.id
+                self.on_usage(getattr(response, 'usage', None))
+
+    def on_usage(self, usage):
+        if usage is None:
+            return
+        self.metrics.total_tokens = getattr(usage, 'total_tokens', 0) or 0
+        self.metrics.input_tokens = getattr(usage, 'input_tokens', 0) or 0
+        self.metrics.output_tokens = getattr(usage, 'output_tokens', 0) or 0
+        input_details = getattr(usage, 'input_tokens_details', None)
+        if input_details is not None:
+            self.metrics.cached_tokens = getattr(input_details, 'cached_tokens', 0) or 0
+        details = getattr(usage, 'output_tokens_details', None)
+        if details is not None:
+            self.metrics.reasoning_tokens = getattr(details, 'reasoning_tokens', 0) or 0
+
+    def finish(self):
+        """流结束，计算汇总指标"""
+        self.end = time.perf_counter()
+        m = self.metrics
+        m.total_duration = self.end - self.start
+
+        if self.first_text is not None:
+            m.ttft = self.first_text - self.start
+            # 首个文本增量之前的时间（推理模型主要花在思考上）
+            if m.reasoning_tokens > 0 and self.first_event is not None:
+                m.reasoning_seconds = self.first_text - self.first_event
+
+        if self.gaps:
+            m.itl_p50 = percentile(self.gaps, 50)
+            m.itl_p90 = percentile(self.gaps, 90)
+            m.itl_p99 = percentile(self.gaps, 99)
+            m.itl_max = max(self.gaps)
+            stalls = [gap for gap in self.gaps if gap > self.stall_threshold]
+            m.stall_count = len(stalls)
+            m.stall_seconds = sum(stalls)
+
+        # 可见文本的 token 数；没有 usage 时退化为增量个数
+        visible_tokens = (m.output_tokens - m.reasoning_tokens) if m.output_tokens else m.text_deltas
+        if self.first_text is not None and self.last_text > self.first_text and visible_tokens > 1:
+            generation_seconds = self.last_text - self.first_text
+            m.tpot = generation_seconds / (visible_tokens - 1)
+            m.output_tokens_per_sec = (visible_tokens - 1) / generation_seconds
+        return m
@@ -0,0 +1,109 @@
+"""
+流式输出渲染
+按帧率 / 字节阈值合并增量，已完成的段落只渲染一次
+"""
+
+import time
+
+
+class RenderScheduler:
+    """
+    把流式增量写到 Streamlit 占位符
+
+    - 增量先进入缓冲区，到达帧间隔或缓冲字节数超过阈值时才刷新
+    - 代码块之外的完整段落（以空行结尾）固定到独立元素，之后只重绘末尾段落
+    - finish() 时总是刷新剩余内容
+    """
+
+    def __init__(self, placeholder, fps=15, max_buffer_bytes=1024, cursor="▌"):
+        self.container = placeholder.container()
+        self.min_interval = 1.0 / fps if fps > 0 else 0.0
+        self.max_buffer_bytes = max_buffer_bytes
+        self.cursor = cursor
+
+        self.text = ""
+        self._frozen_len = 0
+        self._tail = self.container.empty()
+        self._pending_bytes = 0
+        self._last_flush = 0.0
+
+        # 统计
+        self.render_calls = 0
+        self.render_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.deltas = 0
+
+    def events(self, stream):
+        """迭代流式事件，并统计等待网络的时间"""
+        iterator = iter(stream)
+        while True:
+            start = time.perf_counter()
+            try:
+                event = next(iterator)
+            except StopIteration:
+                self.wait_seconds += time.perf_counter() - start
+                return
+            self.wait_seconds += time.perf_counter() - start
+            yield event
+
+    def append(self, delta):
+        """追加增量，必要时刷新"""
+        if not delta:
+            return
+        self.text += delta
+        self.deltas += 1
+        self._pending_bytes += len(delta.encode('utf-8'))
+
+        now = time.perf_counter()
+        if (now - self._last_flush >= self.min_interval
+                or self._pending_bytes >= self.max_buffer_bytes):
+            self.flush()
+
+    def tick(self):
+        """等待增量期间重绘一次末尾段落，让页面有机会处理停止等操作"""
+        start = time.perf_counter()
+        self._tail.markdown(self.text[self._frozen_len:] + self.cursor)
+        self.render_calls += 1
+        self.render_seconds += time.perf_counter() - start
+
+    def _freeze_paragraphs(self):
+        """把代码块之外已完成的段落固定下来"""
+        boundary = self.text.rfind("\n\n", self._frozen_len)
+        while boundary != -1:
+            # 切分点之前的 ``` 必须成对，否则处在代码块内部
+            if self.text.count("```", 0, boundary) % 2 == 0:
+                break
+            boundary = self.text.rfind("\n\n", self._frozen_len, boundary)
+        if boundary == -1:
+            return
+
+        self._tail.markdown(self.text[self._frozen_len:boundary])
+        self.render_calls += 1
+        self._frozen_len = boundary + 2
+        self._tail = self.container.empty()
+
+    def flush(self, final=False):
+        """把缓冲区写到页面"""
+        start = time.perf_counter()
+        self._freeze_paragraphs()
+        tail = self.text[self._frozen_len:]
+        if tail or final:
+            self._tail.markdown(tail if final else tail + self.cursor)
+            self.render_calls += 1
+        self._pending_bytes = 0
+        end = time.perf_counter()
+        self._last_flush = end
+        self.render_seconds += end - start
+
+    def finish(self):
+        """流结束，输出最终文本"""
+        self.flush(final=True)
+        return self.text
+
+    def stats(self):
+        return {
+            'render_calls': self.render_calls,
+            'render_seconds': self.render_seconds,
+            'wait_seconds': self.wait_seconds,
+            'deltas': self.deltas,
+        }
@@ -0,0 +1,118 @@
+"""
+后台流式消费
+工作线程读取流式响应，页面线程只负责渲染；可随时取消，取消时中止底层 HTTP 连接
+"""
+
+import threading
+import time
+
+from chat_request import abort_stream, consume_stream
+
+# follow() 没有新增量时的最长等待，期间把控制权交还页面，停止按钮才能及时生效
+FOLLOW_POLL_SECONDS = 0.25
+
+# 取消后等待工作线程退出的时间；读取仍阻塞（如 HTTP/2 共享连接）时不再等待
+CANCEL_GRACE_SECONDS = 1.0
+
+
+class StreamWorker:
+    """
+    在工作线程中消费一个流
+
+    - 文本增量追加到 parts，follow() 在调用方线程按顺序产出，脚本重跑后可以重新接上
+    - cancel() 中止流式响应，已收到的文本保留
+    - 结束后 metrics 为 TurnMetrics；非取消导致的异常保存在 error
+    - on_done(worker) 在本轮结束时调用一次，页面没有再接上时也会执行
+    """
+
+    def __init__(self, stream, recorder, on_done=None):
+        self.stream = stream
+        self.recorder = recorder
+        self.on_done = on_done
+        self.parts = []
+        self.metrics = None
+        self.error = None
+        self.done = False
+        self.cancelled_at = None
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="stream-worker")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def text(self):
+        with self._cond:
+            return "".join(self.parts)
+
+    def _events(self):
+        for event in self.stream:
+            if self._cancel.is_set():
+                return
+            yield event
+
+    def _push(self, delta):
+        with self._cond:
+            if self.done:
+                return
+            self.parts.append(delta)
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            consume_stream(self._events(), self.recorder, on_delta=self._push)
+        except Exception as e:
+            # 取消时中止连接会让读取抛出异常，不算错误
+            if not self._cancel.is_set():
+                self.error = e
+        finally:
+            abort_stream(self.stream)
+            self._finish()
+
+    def _finish(self):
+        """结束本轮（只执行一次）：汇总指标并回调 on_done"""
+        with self._cond:
+            if self.done:
+                return
+            self.metrics = self.recorder.finish()
+            self.done = True
+            self._cond.notify_all()
+        if self.on_done is not None:
+            self.on_done(self)
+
+    def cancel(self):
+        """停止生成：中止 HTTP 响应，服务端随之停止输出"""
+        if self.done or self._cancel.is_set():
+            return
+        self.cancelled_at = time.perf_counter()
+        self._cancel.set()
+        abort_stream(self.stream)
+
+    def follow(self, poll_interval=FOLLOW_POLL_SECONDS):
+        """
+        产出文本增量直到流结束（从头开始）
+
+        等待超过 poll_interval 时产出空字符串，调用方借此刷新页面、响应停止按钮
+        """
+        index = 0
+        while True:
+            with self._cond:
+                if index >= len(self.parts) and not self.done:
+                    self._cond.wait(poll_interval)
+                new_parts = self.parts[index:]
+                done = self.done
+            index += len(new_parts)
+            yield from new_parts
+            if done:
+                return
+            if not new_parts:
+                if self.cancelled and time.perf_counter() - self.cancelled_at >= CANCEL_GRACE_SECONDS:
+                    self._finish()
+                    continue
+                yield ""
@@ -0,0 +1,217 @@
+"""
+请求阶段追踪
+把一轮请求的各阶段（图片编码、获取客户端、发送、等待首个事件、推理、生成、渲染）记录为 span，
+保存在内存环形缓冲区，可导出为 Chrome trace-event JSON（Perfetto 可直接打开）或 OTLP JSON。
+未启用时 span() 返回空操作对象，开销接近于零
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+# 导出目录
+TRACE_DIR = Path("traces")
+
+SERVICE_NAME = "aoai-demonstrate"
+
+
+class _NoopSpan:
+    """未启用追踪时使用，所有操作为空"""
+
+    trace_id = None
+    span_id = None
+
+    def set(self, **attributes):
+        return self
+
+    def end(self, end_ns=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """一个阶段：单调时钟纳秒时间戳 + 属性"""
+
+    __slots__ = (
+        "tracer", "name", "trace_id", "span_id", "parent_id",
+        "start_ns", "end_ns", "thread_id", "attributes",
+    )
+
+    def __init__(self, tracer, name, parent=None, start_ns=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None and parent.trace_id else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = start_ns if start_ns is not None else time.perf_counter_ns()
+        self.end_ns = None
+        self.thread_id = threading.get_ident()
+        self.attributes = attributes or {}
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def end(self, end_ns=None):
+        """结束并放入缓冲区（重复调用无效）"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns if end_ns is not None else time.perf_counter_ns()
+        self.tracer._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        self.end()
+        return False
+
+
+def _seconds_to_ns(seconds):
+    return int(seconds * 1_000_000_000)
+
+
+class Tracer:
+    """进程级追踪器，最近的 capacity 个 span 保存在环形缓冲区"""
+
+    def __init__(self, capacity=10000):
+        self.enabled = False
+        self._spans = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        # 单调时钟与墙上时钟的对应关系，导出 OTLP 时换算
+        self._wall_anchor_ns = time.time_ns()
+        self._mono_anchor_ns = time.perf_counter_ns()
+
+    def configure(self, enabled, capacity=None):
+        with self._lock:
+            self.enabled = enabled
+            if capacity is not None and capacity != self._spans.maxlen:
+                self._spans = deque(self._spans, maxlen=capacity)
+
+    def span(self, name, parent=None, **attributes):
+        """开始一个 span；可用作上下文管理器，也可手动 end()"""
+        if not self.enabled or parent is NOOP_SPAN:
+            return NOOP_SPAN
+        return Span(self, name, parent, attributes=attributes)
+
+    def record(self, name, start, end, parent=None, **attributes):
+        """补记一个已经发生的阶段（start / end 为 time.perf_counter() 秒）"""
+        if not self.enabled or parent is NOOP_SPAN or start is None or end is None:
+            return
+        span = Span(self, name, parent, start_ns=_seconds_to_ns(start), attributes=attributes)
+        span.end(_seconds_to_ns(end))
+
+    def _finish(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def chrome_trace(self):
+        """Chrome trace-event 格式（完整事件 ph=X，时间单位微秒）"""
+        pid = os.getpid()
+        events = []
+        for span in self.spans():
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".")[0],
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": dict(span.attributes, trace_id=span.trace_id, span_id=span.span_id),
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def otlp(self):
+        """OTLP/JSON（ExportTraceServiceRequest）格式"""
+        offset = self._wall_anchor_ns - self._mono_anchor_ns
+        spans = []
+        for span in self.spans():
+            item = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns + offset),
+                "endTimeUnixNano": str(span.end_ns + offset),
+                "attributes": [_otlp_attribute(k, v) for k, v in span.attributes.items()],
+            }
+            if span.parent_id:
+                item["parentSpanId"] = span.parent_id
+            if "error" in span.attributes:
+                item["status"] = {"code": 2, "message": str(span.attributes["error"])}
+            spans.append(item)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+            }]
+        }
+
+    def export(self, fmt="chrome", directory=TRACE_DIR):
+        """写入 traces/ 目录，返回文件路径"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        data = self.chrome_trace() if fmt == "chrome" else self.otlp()
+        path = directory / f"trace-{time.strftime('%Y%m%d-%H%M%S')}.{fmt}.json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        return path
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def record_stream_phases(tracer, recorder, parent):
+    """按 StreamRecorder 的时间戳补记流式阶段：等待首个事件、推理、生成"""
+    if not tracer.enabled or parent is NOOP_SPAN:
+        return
+    metrics = recorder.metrics
+    tracer.record("stream.first_event", recorder.start, recorder.first_event, parent)
+    if recorder.first_text is not None:
+        tracer.record(
+            "stream.reasoning", recorder.first_event, recorder.first_text, parent,
+            reasoning_tokens=metrics.reasoning_tokens
+        )
+        tracer.record(
+            "stream.generate", recorder.first_text, recorder.last_text, parent,
+            output_tokens=metrics.output_tokens, text_deltas=metrics.text_deltas
+        )
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    """进程级单例"""
+    return _tracer